@@ -0,0 +1,283 @@
+# admission.py
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+import metrics
+
+# --- ADMISSION CONTROL ---
+# /chat and /chat/stream pass through an admission controller before they
+# touch the database, so one tenant's traffic spike can't starve the others:
+#   1. each business has a token bucket: ADMISSION_RATE_PER_BUSINESS
+#      requests/s with bursts of ADMISSION_BURST_PER_BUSINESS; an empty bucket
+#      is answered at once with 429 and the seconds until the next token,
+#   2. at most ADMISSION_MAX_IN_FLIGHT requests run at a time in the worker,
+#      and at most ADMISSION_MAX_IN_FLIGHT_PER_BUSINESS of one business,
+#   3. requests beyond those limits wait in per-business queues, served by
+#      weighted fair queuing (start-time tags advanced by 1/weight, so a
+#      business with weight 2 gets twice the turns of one with weight 1 when
+#      both are backlogged); ADMISSION_BUSINESS_WEIGHTS is "id:weight,..."
+#   4. a request that finds its queue full (ADMISSION_MAX_QUEUE overall,
+#      ADMISSION_MAX_QUEUE_PER_BUSINESS per business) or waits longer than
+#      ADMISSION_MAX_WAIT seconds is shed with 503 and Retry-After.
+# The controller lives on the worker's event loop, so it needs no locks;
+# limits are per worker process. Admission runs before the business is looked
+# up, so state for unknown ids must not pile up: idle tenants whose bucket has
+# refilled are dropped, and swept every ADMISSION_SWEEP_INTERVAL seconds.
+# Shed counters only use business_id labels that a completed request has
+# already claimed (see metrics.py).
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_IN_FLIGHT_PER_BUSINESS = int(os.getenv("ADMISSION_MAX_IN_FLIGHT_PER_BUSINESS", "16"))
+ADMISSION_RATE_PER_BUSINESS = float(os.getenv("ADMISSION_RATE_PER_BUSINESS", "10"))
+ADMISSION_BURST_PER_BUSINESS = float(os.getenv("ADMISSION_BURST_PER_BUSINESS", "30"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_QUEUE_PER_BUSINESS = int(os.getenv("ADMISSION_MAX_QUEUE_PER_BUSINESS", "32"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_SWEEP_INTERVAL = float(os.getenv("ADMISSION_SWEEP_INTERVAL", "30"))
+
+
+def parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in spec.split(","):
+        if item.strip():
+            business_id, _, weight = item.rpartition(":")
+            weights[business_id.strip()] = float(weight)
+            if not weights[business_id.strip()] > 0:
+                raise ValueError(f"ADMISSION_BUSINESS_WEIGHTS: weight of '{business_id.strip()}' must be positive, got {weight}.")
+    return weights
+
+
+ADMISSION_BUSINESS_WEIGHTS = parse_weights(os.getenv("ADMISSION_BUSINESS_WEIGHTS", ""))
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; answer with status_code and Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    The slot of an admitted request. release() is idempotent; a ticket that
+    is dropped without it (a stream whose client left before it started)
+    frees its slot when it is garbage collected.
+    """
+
+    __slots__ = ("controller", "business_id", "waited", "released")
+
+    def __init__(self, controller, business_id: str, waited: float):
+        self.controller = controller
+        self.business_id = business_id
+        self.waited = waited
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.business_id)
+
+    def __del__(self):
+        self.release()
+
+
+class _Tenant:
+    __slots__ = ("weight", "tokens", "refilled_at", "in_flight", "waiters", "last_tag")
+
+    def __init__(self, weight: float, burst: float):
+        self.weight = weight
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.waiters = deque()  # (future, start tag)
+        self.last_tag = 0.0
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_in_flight_per_business: int = ADMISSION_MAX_IN_FLIGHT_PER_BUSINESS,
+                 rate: float = ADMISSION_RATE_PER_BUSINESS, burst: float = ADMISSION_BURST_PER_BUSINESS,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_queue_per_business: int = ADMISSION_MAX_QUEUE_PER_BUSINESS,
+                 max_wait: float = ADMISSION_MAX_WAIT, weights: dict = ADMISSION_BUSINESS_WEIGHTS):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_business = max_in_flight_per_business
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_queue_per_business = max_queue_per_business
+        self.max_wait = max_wait
+        self.weights = weights
+        self._tenants = {}
+        self._backlogged = {}  # business_id -> tenant, for tenants with waiters
+        self._in_flight = 0
+        self._queued = 0
+        self._virtual_time = 0.0
+        self._swept_at = time.monotonic()
+        self.admitted = 0
+        self.queued_total = 0
+        self.rate_limited = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def _tenant(self, business_id: str) -> _Tenant:
+        tenant = self._tenants.get(business_id)
+        if tenant is None:
+            tenant = self._tenants[business_id] = _Tenant(self.weights.get(business_id, 1.0), self.burst)
+        return tenant
+
+    def _take_token(self, tenant: _Tenant) -> float:
+        """Takes a token; returns 0, or the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tenant.tokens = min(self.burst, tenant.tokens + (now - tenant.refilled_at) * self.rate)
+        tenant.refilled_at = now
+        if tenant.tokens < 1:
+            return (1 - tenant.tokens) / self.rate
+        tenant.tokens -= 1
+        return 0.0
+
+    def _next_tag(self, tenant: _Tenant) -> float:
+        tenant.last_tag = max(self._virtual_time, tenant.last_tag) + 1.0 / tenant.weight
+        return tenant.last_tag
+
+    def _shed(self, business_id: str, reason: str):
+        label = metrics.REGISTRY.business_label(business_id, claim=False)
+        metrics.REGISTRY.inc("rag_admission_shed_total", (("business_id", label), ("reason", reason)))
+
+    def _forget_if_idle(self, business_id: str, tenant: _Tenant):
+        # An idle tenant with a full bucket carries no state worth keeping.
+        if (tenant.in_flight == 0 and not tenant.waiters
+                and tenant.tokens + (time.monotonic() - tenant.refilled_at) * self.rate >= self.burst):
+            self._tenants.pop(business_id, None)
+
+    def _sweep_idle(self):
+        """Drops idle tenants that were never released (e.g. rate-limited unknown ids)."""
+        now = time.monotonic()
+        if now - self._swept_at < ADMISSION_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for business_id, tenant in list(self._tenants.items()):
+            self._forget_if_idle(business_id, tenant)
+
+    async def acquire(self, business_id: str) -> Ticket:
+        """Waits for a slot; returns its Ticket or raises AdmissionRejected."""
+        self._sweep_idle()
+        tenant = self._tenant(business_id)
+        wait_for_token = self._take_token(tenant)
+        if wait_for_token:
+            self.rate_limited += 1
+            self._shed(business_id, "rate_limited")
+            raise AdmissionRejected(429, "Too many requests for this business.", math.ceil(wait_for_token))
+
+        if (self._in_flight < self.max_in_flight and tenant.in_flight < self.max_in_flight_per_business
+                and not tenant.waiters):
+            self._next_tag(tenant)
+            self._grant(tenant)
+            return Ticket(self, business_id, 0.0)
+
+        if self._queued >= self.max_queue or len(tenant.waiters) >= self.max_queue_per_business:
+            tenant.tokens += 1  # Not served, so not charged.
+            self.shed_queue_full += 1
+            self._shed(business_id, "queue_full")
+            raise AdmissionRejected(503, "Server busy.", ADMISSION_RETRY_AFTER)
+
+        waiter = (asyncio.get_running_loop().create_future(), self._next_tag(tenant))
+        tenant.waiters.append(waiter)
+        self._backlogged[business_id] = tenant
+        self._queued += 1
+        self.queued_total += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[0]), self.max_wait)
+        except asyncio.TimeoutError:
+            if not waiter[0].done():
+                self._withdraw(business_id, tenant, waiter)
+                self.shed_timeout += 1
+                self._shed(business_id, "timeout")
+                raise AdmissionRejected(503, "Server busy.", ADMISSION_RETRY_AFTER)
+            # Granted just as the wait ran out: keep the slot.
+        except asyncio.CancelledError:
+            # The client went away while waiting.
+            if waiter[0].done():
+                self._release(business_id)
+            else:
+                self._withdraw(business_id, tenant, waiter)
+            raise
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+        return Ticket(self, business_id, waited)
+
+    def _withdraw(self, business_id: str, tenant: _Tenant, waiter: tuple):
+        waiter[0].cancel()
+        tenant.waiters.remove(waiter)
+        self._queued -= 1
+        if not tenant.waiters:
+            del self._backlogged[business_id]
+        self._forget_if_idle(business_id, tenant)
+
+    def _grant(self, tenant: _Tenant):
+        tenant.in_flight += 1
+        self._in_flight += 1
+        self.admitted += 1
+
+    def _release(self, business_id: str):
+        """Frees the slot of a finished request and admits the next waiters."""
+        tenant = self._tenants.get(business_id)
+        if tenant is not None:
+            tenant.in_flight -= 1
+        self._in_flight -= 1
+        self._dispatch()
+        if tenant is not None:
+            self._forget_if_idle(business_id, tenant)
+
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight and self._queued:
+            best_id, best = None, None
+            for business_id, tenant in self._backlogged.items():
+                if tenant.in_flight < self.max_in_flight_per_business:
+                    if best is None or tenant.waiters[0][1] < best.waiters[0][1]:
+                        best_id, best = business_id, tenant
+            if best is None:
+                return  # Every waiting business is at its own limit.
+            future, tag = best.waiters.popleft()
+            if not best.waiters:
+                del self._backlogged[best_id]
+            self._queued -= 1
+            self._virtual_time = tag
+            self._grant(best)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "businesses_tracked": len(self._tenants),
+            "businesses_queued": len(self._backlogged),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rate_limited": self.rate_limited,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "avg_queue_wait_ms": round(1000 * self.total_wait / self.queued_total, 3) if self.queued_total else 0.0,
+            "max_queue_wait_ms": round(1000 * self.max_wait_seen, 3),
+        }
+
+
+ADMISSION = AdmissionController()
+
+
+def get_admission_stats() -> dict:
+    return ADMISSION.stats()
+# --- END OF ADMISSION CONTROL ---
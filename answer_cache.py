@@ -0,0 +1,168 @@
+# answer_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# --- SEMANTIC ANSWER CACHE ---
+# Many chat questions are near-duplicates of ones already answered. Answers
+# are cached per (business, agent settings, knowledge-base version), and a new
+# question hits when its embedding is within ANSWER_CACHE_SIMILARITY (cosine)
+# of a cached question. Because the settings and the knowledge-base version
+# are part of the key, a change made by another process (e.g. the dashboard)
+# can never be served stale: the new key simply misses. invalidate() also
+# frees the old entries right away in the process that made the change.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "20000"))
+ANSWER_CACHE_MAX_PER_BUSINESS = int(os.getenv("ANSWER_CACHE_MAX_PER_BUSINESS", "500"))
+
+
+class _Bucket:
+    """Cached answers for one (business, settings, version) key, in LRU order."""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # normalized question -> (expires_at, unit embedding, answer)
+        self._matrix = None
+        self._keys = None
+
+    def matrix(self):
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key][1] for key in self._keys]) if self._keys else None
+        return self._keys, self._matrix
+
+    def changed(self):
+        self._matrix = None
+        self._keys = None
+
+
+class AnswerCache:
+    def __init__(self, threshold: float, ttl_seconds: float, max_entries: int, max_per_business: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_per_business = max_per_business
+        self._buckets = OrderedDict()  # (business_id, settings_hash, kb_version) -> _Bucket
+        self._size = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple, question: str, embedding: np.ndarray):
+        """Returns a cached answer for this or a sufficiently similar question, or None."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self.misses += 1
+                return None
+            self._buckets.move_to_end(key)
+
+            entry = bucket.entries.get(question)
+            if entry is not None and entry[0] > now:
+                bucket.entries.move_to_end(question)
+                self.exact_hits += 1
+                return entry[2]
+
+            keys, matrix = bucket.matrix()
+            if matrix is not None:
+                scores = matrix @ _unit(embedding)
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    entry = bucket.entries[keys[i]]
+                    if entry[0] > now:
+                        bucket.entries.move_to_end(keys[i])
+                        self.semantic_hits += 1
+                        return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, question: str, embedding: np.ndarray, answer: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket()
+            self._buckets.move_to_end(key)
+            if question not in bucket.entries:
+                self._size += 1
+            bucket.entries[question] = (time.monotonic() + self.ttl_seconds, _unit(embedding), answer)
+            bucket.entries.move_to_end(question)
+            bucket.changed()
+            while len(bucket.entries) > self.max_per_business:
+                self._pop_oldest(bucket)
+            while self._size > self.max_entries:
+                oldest_key, oldest = next(iter(self._buckets.items()))
+                self._pop_oldest(oldest)
+                if not oldest.entries:
+                    del self._buckets[oldest_key]
+
+    def invalidate(self, business_id: str):
+        """Drops every cached answer of a business."""
+        with self._lock:
+            for key in [key for key in self._buckets if key[0] == business_id]:
+                self._size -= len(self._buckets.pop(key).entries)
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": self._size,
+                "similarity_threshold": self.threshold,
+            }
+
+    def _pop_oldest(self, bucket: _Bucket):
+        bucket.entries.popitem(last=False)
+        bucket.changed()
+        self._size -= 1
+        self.evictions += 1
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype='float32')
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def cache_key(business_id: str, business: dict, kb_version: int) -> tuple:
+    """Builds the cache key from everything that shapes an answer besides the question."""
+    settings = f"{business['name']}\x00{business['personality']}"
+    return (business_id, hashlib.sha1(settings.encode('utf-8')).hexdigest(), kb_version)
+
+
+ANSWER_CACHE = AnswerCache(ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_PER_BUSINESS)
+
+
+def get_answer(business_id: str, business: dict, kb_version: int, question: str, embedding: np.ndarray):
+    return ANSWER_CACHE.get(cache_key(business_id, business, kb_version), question, embedding)
+
+
+def put_answer(business_id: str, business: dict, kb_version: int, question: str, embedding: np.ndarray, answer: str):
+    ANSWER_CACHE.put(cache_key(business_id, business, kb_version), question, embedding, answer)
+
+
+def invalidate(business_id: str):
+    ANSWER_CACHE.invalidate(business_id)
+
+
+def get_answer_cache_stats() -> dict:
+    """Returns hit/miss/eviction counters for the semantic answer cache."""
+    return ANSWER_CACHE.stats()
+# --- END OF SEMANTIC ANSWER CACHE ---
@@ -8,79 +8,93 @@ import os
 import document_processor
 import vector_store_manager
 import llm_interface
+import answer_cache
+import embedding_cache
+import db_pool
+import ingestion_pipeline
+import site_crawler
+import context_packer
+import chat_analytics
+import config_cache
 
 st.set_page_config(layout="wide", page_title="AI Agent Dashboard")
 
 def get_db_connection():
-    """Establishes a connection to the PostgreSQL database using Streamlit secrets."""
+    """
+    Borrows a pooled connection to the PostgreSQL database using Streamlit secrets:
+    `with get_db_connection() as conn:`. The pool lives across Streamlit reruns.
+    """
     database_url = st.secrets["DATABASE_URL"]
     if "sslmode" not in database_url:
         database_url += "?sslmode=require"
-    conn = psycopg2.connect(database_url)
-    return conn
+    return db_pool.get_pool(database_url).connection()
 
 def initialize_database():
     """Checks if tables exist and creates them if they don't. A self-healing function."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
     
-    # Check if the 'businesses' table exists using PostgreSQL's system catalog
-    cursor.execute("SELECT to_regclass('public.businesses')")
-    table_exists = cursor.fetchone()[0]
+        # Check if the 'businesses' table exists using PostgreSQL's system catalog
+        cursor.execute("SELECT to_regclass('public.businesses')")
+        table_exists = cursor.fetchone()[0]
     
-    if not table_exists:
-        st.toast("First time setup: Initializing database tables...", icon="🚀")
-        # Table to store business information and customizations
-        cursor.execute('''
-        CREATE TABLE businesses (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            agent_name TEXT DEFAULT 'AI Assistant',
-            welcome_message TEXT DEFAULT 'Hi! How can I help you today?',
-            personality TEXT DEFAULT 'friendly',
-            brand_color TEXT DEFAULT '#007bff'
-        )
-        ''')
+        if not table_exists:
+            st.toast("First time setup: Initializing database tables...", icon="🚀")
+            # Table to store business information and customizations
+            cursor.execute('''
+            CREATE TABLE businesses (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                agent_name TEXT DEFAULT 'AI Assistant',
+                welcome_message TEXT DEFAULT 'Hi! How can I help you today?',
+                personality TEXT DEFAULT 'friendly',
+                brand_color TEXT DEFAULT '#007bff'
+            )
+            ''')
 
-        # Table to log chat interactions for analytics
-        cursor.execute('''
-        CREATE TABLE chat_logs (
-            log_id SERIAL PRIMARY KEY,
-            business_id TEXT NOT NULL,
-            question TEXT NOT NULL,
-            answer TEXT NOT NULL,
-            timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (business_id) REFERENCES businesses (id)
-        )
-        ''')
+            # Table to log chat interactions for analytics
+            cursor.execute('''
+            CREATE TABLE chat_logs (
+                log_id SERIAL PRIMARY KEY,
+                business_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (business_id) REFERENCES businesses (id)
+            )
+            ''')
         
-        conn.commit()
-        st.toast("Database initialized successfully!", icon="✅")
+            conn.commit()
+            st.toast("Database initialized successfully!", icon="✅")
     
-    cursor.close()
-    conn.close()
+        cursor.close()
+        # Indexes and analytics rollups, added after the first release; a catalog lookup once in place.
+        if chat_analytics.ensure_schema(conn):
+            st.toast("Analytics rollups created from the chat history.", icon="📊")
 
 # --- Business Management Functions ---
 def get_all_businesses():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('SELECT * FROM businesses ORDER BY name')
-    businesses = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute('SELECT * FROM businesses ORDER BY name')
+        businesses = cursor.fetchall()
+        cursor.close()
     return businesses
 
 def update_business_settings(business_id, agent_name, welcome_message, personality, brand_color):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE businesses 
-        SET agent_name = %s, welcome_message = %s, personality = %s, brand_color = %s
-        WHERE id = %s
-    ''', (agent_name, welcome_message, personality, brand_color, business_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE businesses 
+            SET agent_name = %s, welcome_message = %s, personality = %s, brand_color = %s
+            WHERE id = %s
+        ''', (agent_name, welcome_message, personality, brand_color, business_id))
+        # API workers drop their cached config when this commits.
+        config_cache.notify_config_changed(cursor, business_id)
+        conn.commit()
+        cursor.close()
+    # Cached answers were written in the old personality.
+    answer_cache.invalidate(business_id)
 
 # --- Content Processing Function ---
 def process_and_store_content(business_id, raw_content):
@@ -90,16 +104,21 @@ def process_and_store_content(business_id, raw_content):
 
     st.info(f"Processing content for business {business_id}...")
     with st.spinner("Chunking text, generating embeddings, and updating knowledge base... This may take a moment."):
-        text_chunks = document_processor.chunk_text(raw_content)
-        embeddings = document_processor.generate_embeddings(text_chunks)
-        index_dir = os.path.join("data", business_id)
-        os.makedirs(index_dir, exist_ok=True)
-        embedding_dim = document_processor.get_embedding_model().get_sentence_embedding_dimension()
-        current_index, current_texts = vector_store_manager.create_or_load_faiss_index(business_id, embedding_dimension=embedding_dim)
-        vector_store_manager.add_embeddings_to_faiss(
-            business_id, embeddings, text_chunks, current_index, current_texts
-        )
-    st.success(f"Knowledge base updated with {len(text_chunks)} new chunks.")
+        summary = ingestion_pipeline.ingest_sources(business_id, [{"kind": "raw", "text": raw_content}])
+    show_ingest_summary(summary)
+
+
+def show_ingest_summary(summary):
+    """Reports how many chunks were added, and how many were already known."""
+    if summary["chunks"]:
+        st.success(f"Knowledge base updated with {summary['chunks']} new chunks from {summary['sources']} source(s) "
+                   f"in {summary['total_seconds']:.1f}s ({summary['chunks_per_second']:.0f} chunks/s).")
+    elif not summary["duplicate_chunks"]:
+        st.warning("No content to process for this source.")
+    if summary["duplicate_chunks"] or summary["reused_embeddings"]:
+        st.info(f"{summary['duplicate_chunks']} chunk(s) were already in the knowledge base and were skipped; "
+                f"{summary['reused_embeddings']} embedding(s) were reused from the cache and "
+                f"{summary['embedded_chunks']} newly generated.")
 
 
 # --- Main App Execution ---
@@ -127,12 +146,11 @@ try:
                     st.sidebar.error("A business with this name already exists.")
                 else:
                     new_id = str(uuid.uuid4())
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('INSERT INTO businesses (id, name) VALUES (%s, %s)', (new_id, new_business_name))
-                    conn.commit()
-                    cursor.close()
-                    conn.close()
+                    with get_db_connection() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute('INSERT INTO businesses (id, name) VALUES (%s, %s)', (new_id, new_business_name))
+                        conn.commit()
+                        cursor.close()
                     st.sidebar.success(f"Business '{new_business_name}' registered!")
                     st.rerun()
             else:
@@ -141,12 +159,11 @@ try:
     # --- Main Dashboard Area ---
     if selected_name:
         business_id = business_options[selected_name]
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute('SELECT * FROM businesses WHERE id = %s', (business_id,))
-        current_business = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute('SELECT * FROM businesses WHERE id = %s', (business_id,))
+            current_business = cursor.fetchone()
+            cursor.close()
 
         if current_business:
             st.header(f"Managing: {current_business['name']}")
@@ -159,27 +176,57 @@ try:
                 uploaded_files = st.file_uploader("Upload PDFs or Text files", type=["pdf", "txt"], accept_multiple_files=True, key=f"upload_{business_id}")
                 if st.button("Process Uploaded Files", key=f"process_upload_{business_id}"):
                     if uploaded_files:
+                        temp_dir = os.path.join("data", business_id, "temp")
+                        os.makedirs(temp_dir, exist_ok=True)
+                        sources = []
                         for uploaded_file in uploaded_files:
-                            temp_dir = os.path.join("data", business_id, "temp")
-                            os.makedirs(temp_dir, exist_ok=True)
                             temp_file_path = os.path.join(temp_dir, uploaded_file.name)
                             with open(temp_file_path, "wb") as f:
                                 f.write(uploaded_file.getbuffer())
-                            
-                            if uploaded_file.type == "application/pdf":
-                                raw_content = document_processor.get_text_from_pdf(temp_file_path)
-                            else:
-                                raw_content = uploaded_file.getvalue().decode("utf-8")
-                            
-                            process_and_store_content(business_id, raw_content)
-                            os.remove(temp_file_path)
+                            kind = "pdf" if uploaded_file.type == "application/pdf" else "text"
+                            sources.append({"name": uploaded_file.name, "kind": kind, "path": temp_file_path})
+
+                        # All files go through one pipeline run and land in the index as a single update.
+                        progress_bar = st.progress(0.0, text="Extracting text...")
+                        stage_labels = {"extract": "Extracting text", "embed": "Generating embeddings", "commit": "Updating knowledge base"}
+                        stage_weights = {"extract": (0.0, 0.3), "embed": (0.3, 0.65), "commit": (0.95, 0.05)}
+                        def report_progress(stage, done, total):
+                            start, weight = stage_weights[stage]
+                            progress_bar.progress(min(1.0, start + weight * done / max(total, 1)), text=f"{stage_labels[stage]}... ({done}/{total})")
+                        try:
+                            summary = ingestion_pipeline.ingest_sources(business_id, sources, progress=report_progress)
+                        finally:
+                            for source in sources:
+                                os.remove(source["path"])
+                        progress_bar.empty()
+                        show_ingest_summary(summary)
+                        if summary["empty_sources"]:
+                            st.warning(f"{summary['empty_sources']} file(s) contained no extractable text.")
                     else:
                         st.warning("Please upload files before processing.")
 
                 st.subheader("Scrape a Website")
                 url_to_scrape = st.text_input("Enter URL to scrape", key=f"url_{business_id}")
+                crawl_site = st.checkbox("Also index linked pages on the same site", key=f"crawl_{business_id}")
+                crawl_depth = st.number_input("Link depth", min_value=1, max_value=5, value=site_crawler.CRAWL_MAX_DEPTH,
+                                              key=f"crawl_depth_{business_id}", disabled=not crawl_site)
                 if st.button("Scrape and Add", key=f"scrape_{business_id}"):
-                    if url_to_scrape:
+                    if url_to_scrape and crawl_site:
+                        with st.spinner("Crawling site..."):
+                            crawl = site_crawler.crawl_site(business_id, url_to_scrape, max_depth=int(crawl_depth))
+                        crawl_summary = crawl.summary()
+                        st.caption(f"Visited {crawl_summary['pages_visited']} pages in {crawl_summary['seconds']:.1f}s: "
+                                   f"{crawl_summary['pages_changed']} new or changed, {crawl_summary['not_modified']} not modified, "
+                                   f"{crawl_summary['unchanged']} unchanged, {crawl_summary['failed']} failed.")
+                        if crawl.changed_pages:
+                            with st.spinner("Updating knowledge base..."):
+                                summary = ingestion_pipeline.ingest_sources(
+                                    business_id, [{"kind": "raw", "name": url, "text": text} for url, text in crawl.changed_pages])
+                            show_ingest_summary(summary)
+                        else:
+                            st.info("No new or changed pages since the last crawl.")
+                        crawl.commit()
+                    elif url_to_scrape:
                         raw_content = document_processor.get_text_from_url(url_to_scrape)
                         process_and_store_content(business_id, raw_content)
                     else:
@@ -202,6 +249,15 @@ try:
             with tab5:
                 st.subheader("Test Your Agent in Real-time")
                 st.write("Interact with your AI agent here to see how it responds with the current knowledge and personality settings.")
+                # The test tab shares the same in-process caches as the retrieval below.
+                cache_stats = vector_store_manager.get_index_cache_stats()
+                st.caption(f"Index cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions, {cache_stats['entries']} loaded")
+                embedding_stats = document_processor.get_query_embedding_cache_stats()
+                st.caption(f"Query embedding cache: {embedding_stats['hit_rate']:.0%} hit rate over {embedding_stats['hits'] + embedding_stats['misses']} questions")
+                answer_stats = answer_cache.get_answer_cache_stats()
+                st.caption(f"Answer cache: {answer_stats['exact_hits']} exact and {answer_stats['semantic_hits']} similar-question hits, {answer_stats['misses']} misses")
+                ingest_stats = embedding_cache.get_embedding_cache_stats()
+                st.caption(f"Chunk embedding cache: {ingest_stats['hit_rate']:.0%} reused, {ingest_stats['duplicates_skipped']} duplicate chunks skipped")
 
                 if f"chat_history_{business_id}" not in st.session_state:
                     st.session_state[f"chat_history_{business_id}"] = []
@@ -217,9 +273,14 @@ try:
 
                     with st.chat_message("assistant"):
                         with st.spinner("Thinking..."):
-                            query_embedding = document_processor.generate_embeddings([prompt])[0]
-                            retrieved_texts = vector_store_manager.search_faiss_index(business_id, query_embedding)
-                            if not retrieved_texts:
+                            query_embedding = document_processor.embed_query(prompt)
+                            normalized_prompt = document_processor.normalize_query(prompt)
+                            kb_version = vector_store_manager.get_knowledge_base_version(business_id)
+                            cached_answer = answer_cache.get_answer(business_id, current_business, kb_version, normalized_prompt, query_embedding)
+                            retrieved_texts = [] if cached_answer is not None else context_packer.retrieve_context(business_id, query_embedding)
+                            if cached_answer is not None:
+                                final_answer = cached_answer
+                            elif not retrieved_texts:
                                 final_answer = "I'm sorry, but I couldn't find specific information about that. Would you like me to connect you with our team?"
                             else:
                                 context = "\n\n".join(retrieved_texts)
@@ -240,6 +301,8 @@ try:
                                 messages_payload = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt_with_context}]
                                 groq_api_key = st.secrets["GROQ_API_KEY"]
                                 final_answer = llm_interface.generate_response_with_groq(messages_payload, api_key=groq_api_key)
+                                if not llm_interface.is_error_response(final_answer):
+                                    answer_cache.put_answer(business_id, current_business, kb_version, normalized_prompt, query_embedding, final_answer)
                             st.markdown(final_answer)
                             st.session_state[f"chat_history_{business_id}"].append({"role": "assistant", "content": final_answer})
 
@@ -256,16 +319,13 @@ try:
 
             with tab4:
                 st.subheader("Analytics")
-                conn = get_db_connection()
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                cursor.execute('SELECT question, COUNT(*) as count FROM chat_logs WHERE business_id = %s GROUP BY question ORDER BY count DESC LIMIT 10', (business_id,))
-                logs = cursor.fetchall()
-                cursor.execute("SELECT COUNT(*) FROM chat_logs WHERE business_id = %s AND DATE(timestamp) = CURRENT_DATE", (business_id,))
-                daily_queries_result = cursor.fetchone()
-                daily_queries = daily_queries_result[0] if daily_queries_result and daily_queries_result[0] else 0
-                cursor.close()
-                conn.close()
-                st.metric("Queries Today", daily_queries)
+                with get_db_connection() as conn:
+                    # Precomputed by the chat log writer; see chat_analytics.py.
+                    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                    logs = chat_analytics.top_questions(cursor, business_id)
+                    daily_queries = chat_analytics.queries_today(cursor, business_id)
+                    cursor.close()
+                st.metric("Queries Today (UTC)", daily_queries)
                 st.write("**Most Asked Questions:**")
                 if logs:
                     for log in logs:
@@ -0,0 +1,105 @@
+# benchmarks/ann_tiers.py
+"""
+Compares the index tiers in index_tiers.py against exact flat search.
+
+For each tier it reports build time, recall@k against IndexFlatL2,
+single-query throughput (queries are issued one at a time, like /chat)
+and the serialized index size as a proxy for resident memory.
+
+    python benchmarks/ann_tiers.py --num-vectors 200000
+    python benchmarks/ann_tiers.py --business-id <id> --nprobe 32 --ef-search 128
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import index_tiers
+import segment_store
+
+
+def synthetic_vectors(n: int, d: int, seed: int = 0) -> np.ndarray:
+    """Clustered, unit-normalized vectors, closer to sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 500), d)).astype('float32')
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, d)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def business_vectors(business_id: str) -> np.ndarray:
+    store = segment_store.SegmentedStore(business_id)
+    if not store.segments:
+        raise SystemExit(f"No knowledge base found for business {business_id}.")
+    return np.concatenate([seg.vectors() for seg in store.segments]).astype('float32')
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, tiers: list[str], params: dict) -> list[dict]:
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for tier in tiers:
+        start = time.perf_counter()
+        index = exact if tier == "flat" else index_tiers.build_index(vectors, tier)
+        build_seconds = 0.0 if tier == "flat" else time.perf_counter() - start
+        index_tiers.apply_search_params(index, params)
+
+        found = np.empty_like(truth)
+        start = time.perf_counter()
+        for i in range(len(queries)):
+            _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+        elapsed = time.perf_counter() - start
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        results.append({
+            "tier": tier,
+            "build_seconds": round(build_seconds, 3),
+            f"recall@{k}": round(float(recall), 4),
+            "qps": round(len(queries) / elapsed, 1),
+            "latency_ms": round(1000 * elapsed / len(queries), 3),
+            "memory_mb": round(faiss.serialize_index(index).nbytes / 2**20, 2),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--business-id", help="Benchmark the vectors of an existing business instead of synthetic data.")
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--tiers", default=",".join(index_tiers.INDEX_TYPES))
+    parser.add_argument("--nprobe", type=int, default=index_tiers.DEFAULT_SEARCH_PARAMS["nprobe"])
+    parser.add_argument("--ef-search", type=int, default=index_tiers.DEFAULT_SEARCH_PARAMS["efSearch"])
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    if args.business_id:
+        vectors = business_vectors(args.business_id)
+    else:
+        vectors = synthetic_vectors(args.num_vectors, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), args.num_queries)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype('float32')
+
+    params = {"nprobe": args.nprobe, "efSearch": args.ef_search}
+    results = run(vectors, np.ascontiguousarray(queries, dtype='float32'), args.k, args.tiers.split(","), params)
+
+    print(f"{len(vectors)} vectors, d={vectors.shape[1]}, {len(queries)} queries, k={args.k}, {params}")
+    print(f"{'tier':<8}{'build s':>10}{'recall':>10}{'qps':>12}{'ms/query':>10}{'memory MB':>12}")
+    for r in results:
+        print(f"{r['tier']:<8}{r['build_seconds']:>10}{r[f'recall@{args.k}']:>10}{r['qps']:>12}{r['latency_ms']:>10}{r['memory_mb']:>12}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"num_vectors": len(vectors), "params": params, "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
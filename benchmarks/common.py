@@ -0,0 +1,64 @@
+# benchmarks/common.py
+"""Shared helpers of the benchmark scripts: latency summaries and JSON result files."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def summarize(seconds: list[float]) -> dict:
+    """Summarizes latency samples (in seconds) as milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = 1000 * np.asarray(seconds, dtype='float64')
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def time_calls(fn, repeat: int, warmup: int = 1) -> list[float]:
+    """Calls fn() `warmup` times untimed, then `repeat` times; returns the durations."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def environment() -> dict:
+    """Describes where a result was measured, so runs can be compared fairly."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path: str, suite: str, params: dict, results):
+    """Writes a result file that benchmarks/compare.py understands."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"suite": suite, "environment": environment(), "params": params, "results": results}, f, indent=2)
+    print(f"Results written to {path}")
@@ -0,0 +1,112 @@
+# benchmarks/compare.py
+"""
+Compares two benchmark result files (the --json output of micro.py,
+load_test.py or the other benchmarks) and flags regressions.
+
+Every numeric metric found in both files is compared. Latencies and
+durations (*_ms, *_seconds) are better when lower; throughputs (qps,
+*_per_second) and recall are better when higher; other numbers are shown
+but never flagged. Entries of result lists are matched by their endpoint,
+concurrency, name or similar field, not by position.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 10
+
+Exits with status 1 if any metric got worse by more than --threshold percent,
+so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("_ms", "_seconds")
+HIGHER_IS_BETTER = ("qps", "_per_second", "recall")
+IDENTITY_FIELDS = ("suite", "name", "endpoint", "concurrency", "workers", "backend", "tier", "index_type", "index_mmap")
+
+
+def _item_key(i: int, item) -> str:
+    if isinstance(item, dict):
+        parts = [f"{field}={item[field]}" for field in IDENTITY_FIELDS if field in item]
+        if parts:
+            return ",".join(parts)
+    return str(i)
+
+
+def flatten(value, prefix: str = "") -> dict:
+    """{"a": {"b": [{"name": "x", "p50_ms": 1}]}} -> {"a.b[name=x].p50_ms": 1}"""
+    if isinstance(value, dict):
+        metrics = {}
+        for key, item in value.items():
+            metrics.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return metrics
+    if isinstance(value, list):
+        metrics = {}
+        for i, item in enumerate(value):
+            metrics.update(flatten(item, f"{prefix}[{_item_key(i, item)}]"))
+        return metrics
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def direction(metric: str) -> int:
+    """-1 if lower is better, 1 if higher is better, 0 if neither."""
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    if any(marker in name for marker in HIGHER_IS_BETTER):
+        return 1
+    return 0
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    old, new = flatten(baseline.get("results", baseline)), flatten(candidate.get("results", candidate))
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        sign = direction(metric)
+        before, after = old[metric], new[metric]
+        change = (after - before) / abs(before) * 100 if before else 0.0
+        rows.append({
+            "metric": metric, "baseline": before, "candidate": after, "change_percent": round(change, 1),
+            "regression": sign != 0 and sign * change < -threshold,
+            "improvement": sign != 0 and sign * change > threshold,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change that counts")
+    parser.add_argument("--all", action="store_true", help="also list metrics without a better direction")
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+    for name, result in (("baseline", baseline), ("candidate", candidate)):
+        environment = result.get("environment", {})
+        if environment:
+            print(f"{name:<10} {environment.get('git_commit', '?'):<10} {environment.get('timestamp', '')}  "
+                  f"cpus={environment.get('cpu_count')}  python={environment.get('python')}")
+
+    if baseline.get("params") != candidate.get("params"):
+        print("Note: the runs used different parameters; only like-for-like metrics are comparable.")
+
+    rows = compare(baseline, candidate, args.threshold)
+    width = max((len(row["metric"]) for row in rows), default=10)
+    print(f"{'metric':<{width}}  {'baseline':>12}  {'candidate':>12}  {'change':>8}")
+    for row in rows:
+        if not args.all and direction(row["metric"]) == 0:
+            continue
+        flag = "  REGRESSION" if row["regression"] else ("  improved" if row["improvement"] else "")
+        print(f"{row['metric']:<{width}}  {row['baseline']:>12}  {row['candidate']:>12}  {row['change_percent']:>+7}%{flag}")
+
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regression(s) beyond {args.threshold}% out of {len(rows)} shared metrics.")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
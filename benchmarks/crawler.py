@@ -0,0 +1,145 @@
+# benchmarks/crawler.py
+"""
+Measures site_crawler.py against a local stand-in web server.
+
+The server serves a synthetic help centre of --num-pages linked pages with
+ETag/Last-Modified support and --latency-ms of simulated server time per
+request. The site is crawled twice: a cold crawl that downloads every page,
+then an incremental re-crawl after --change-fraction of the pages changed,
+which should cost mostly 304s.
+
+    python benchmarks/crawler.py --num-pages 500 --latency-ms 20
+    python benchmarks/crawler.py --workers 1 2 4 8 16 --json crawler.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import site_crawler
+
+
+class SyntheticSite:
+    """Pages /page/0 .. /page/N-1, each linking to a few others, plus an index at /."""
+
+    def __init__(self, num_pages: int, links_per_page: int, words_per_page: int):
+        self.num_pages = num_pages
+        self.links_per_page = links_per_page
+        self.words_per_page = words_per_page
+        self.revisions = [0] * num_pages
+        self.modified_at = [time.time()] * num_pages
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+
+    def body(self, path: str):
+        if path == "/":
+            links = "".join(f'<a href="/page/{i}">Article {i}</a>' for i in range(min(self.num_pages, 50)))
+            return f"<html><body><h1>Help centre</h1>{links}</body></html>", "index", self.modified_at[0]
+        page = int(path.rsplit("/", 1)[1])
+        links = "".join(f'<a href="/page/{(page * 7 + j) % self.num_pages}#top">Related {j}</a>'
+                        for j in range(1, self.links_per_page + 1))
+        words = " ".join(f"word{(page + i) % 997}" for i in range(self.words_per_page))
+        html = (f"<html><head><script>var x = 1;</script></head><body><h1>Article {page}</h1>"
+                f"<p>Revision {self.revisions[page]}. {words}</p>{links}</body></html>")
+        return html, f"{page}-{self.revisions[page]}", self.modified_at[page]
+
+    def change(self, fraction: float):
+        for page in range(0, self.num_pages, max(1, round(1 / fraction)) if fraction > 0 else self.num_pages + 1):
+            self.revisions[page] += 1
+            self.modified_at[page] = time.time() + 1
+
+
+def make_handler(site: SyntheticSite, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with site.lock:
+                site.requests += 1
+            time.sleep(latency)
+            path = self.path.split("#")[0]
+            if path == "/robots.txt":
+                return self._send(404, b"", {"Content-Type": "text/plain"})
+            if path != "/" and not (path.startswith("/page/") and path.rsplit("/", 1)[1].isdigit()
+                                    and int(path.rsplit("/", 1)[1]) < site.num_pages):
+                return self._send(404, b"not found", {"Content-Type": "text/plain"})
+            html, revision, modified_at = site.body(path)
+            etag = '"' + hashlib.sha1(revision.encode()).hexdigest() + '"'
+            headers = {"ETag": etag, "Last-Modified": formatdate(modified_at, usegmt=True),
+                       "Content-Type": "text/html; charset=utf-8"}
+            if self.headers.get("If-None-Match") == etag:
+                with site.lock:
+                    site.not_modified += 1
+                return self._send(304, b"", headers)
+            self._send(200, html.encode("utf-8"), headers)
+
+        def _send(self, status: int, body: bytes, headers: dict):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+    return Handler
+
+
+def run(workers: int, args) -> dict:
+    site = SyntheticSite(args.num_pages, args.links_per_page, args.words_per_page)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site, args.latency_ms / 1000.0))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    options = dict(max_workers=workers, max_depth=args.max_depth, max_pages=args.num_pages + 1,
+                   per_host_concurrency=workers, host_delay=0.0)
+    try:
+        crawler = site_crawler.SiteCrawler(**options)
+        cold = crawler.crawl(start_url)
+        crawler.close()
+
+        site.change(args.change_fraction)
+        crawler = site_crawler.SiteCrawler(**options)
+        warm = crawler.crawl(start_url, cold.state)
+        crawler.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {"workers": workers, "cold": cold.summary(), "recrawl": warm.summary(),
+            "server_requests": site.requests, "server_304s": site.not_modified}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-pages", type=int, default=300)
+    parser.add_argument("--links-per-page", type=int, default=5)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--max-depth", type=int, default=10)
+    parser.add_argument("--change-fraction", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = [run(workers, args) for workers in args.workers]
+    print(f"{'workers':>7}  {'cold pages':>10}  {'cold p/s':>9}  {'recrawl p/s':>11}  {'304s':>5}  {'changed':>7}")
+    for r in results:
+        print(f"{r['workers']:>7}  {r['cold']['pages_visited']:>10}  {r['cold']['pages_per_second']:>9}  "
+              f"{r['recrawl']['pages_per_second']:>11}  {r['recrawl']['not_modified']:>5}  {r['recrawl']['pages_changed']:>7}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"num_pages": args.num_pages, "latency_ms": args.latency_ms, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
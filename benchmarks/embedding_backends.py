@@ -0,0 +1,132 @@
+# benchmarks/embedding_backends.py
+"""
+Compares the embedding backends of document_processor.py on this CPU.
+
+For each backend it reports model load time, single-query latency (p50/p95,
+like one /chat question), batch throughput (like ingestion), and how well
+retrieval agrees with the torch baseline:
+
+  - cosine:       mean cosine similarity to the baseline embedding of each text
+  - recall@k:     overlap of the top-k chunks when corpus and queries are both
+                  embedded with the backend, against the baseline's top-k
+  - mixed@k:      the same, with backend queries against a baseline-embedded
+                  corpus (an index built before switching backends)
+
+    python benchmarks/embedding_backends.py
+    python benchmarks/embedding_backends.py --corpus docs/manual.txt --backends torch onnx-int8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import document_processor
+
+TOPICS = ["opening hours", "refund policy", "shipping times", "password reset", "pricing plans",
+          "data export", "team accounts", "invoice address", "API limits", "mobile app"]
+PHRASES = ["How do I change the {}?", "Our {} are explained on this page.", "Customers often ask about {}.",
+           "The {} depend on your region and plan.", "Contact support if the {} do not work as expected."]
+
+
+def synthetic_corpus(n: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    texts = []
+    for i in range(n):
+        sentences = [PHRASES[j].format(TOPICS[t]) for j, t in zip(rng.integers(0, len(PHRASES), 6),
+                                                                     rng.integers(0, len(TOPICS), 6))]
+        texts.append(f"Article {i}. " + " ".join(sentences))
+    return texts
+
+
+def synthetic_queries(n: int) -> list[str]:
+    rng = np.random.default_rng(1)
+    return [f"what about {TOPICS[t]} for {w}?" for t, w in zip(rng.integers(0, len(TOPICS), n),
+                                                               rng.choice(["teams", "students", "shops", "me"], n))]
+
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def overlap(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def normalized(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype='float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure(backend: str, corpus: list[str], queries: list[str], batch_size: int) -> dict:
+    start = time.perf_counter()
+    model = document_processor.load_embedding_model(backend)
+    load_seconds = time.perf_counter() - start
+
+    model.encode(queries[:8])  # warm-up
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(model.encode([query])[0])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    corpus_vectors = model.encode(corpus, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "query_p50_ms": round(1000 * float(np.percentile(latencies, 50)), 2),
+        "query_p95_ms": round(1000 * float(np.percentile(latencies, 95)), 2),
+        "texts_per_second": round(len(corpus) / batch_seconds, 1),
+        "_queries": normalized(query_vectors),
+        "_corpus": normalized(corpus_vectors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(document_processor.EMBEDDING_BACKENDS),
+                        choices=document_processor.EMBEDDING_BACKENDS)
+    parser.add_argument("--corpus", help="A text file to chunk and use as the corpus instead of synthetic articles.")
+    parser.add_argument("--num-texts", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8', errors='replace') as f:
+            corpus = document_processor.chunk_text(f.read())[:args.num_texts]
+    else:
+        corpus = synthetic_corpus(args.num_texts)
+    queries = synthetic_queries(args.num_queries)
+
+    backends = args.backends if "torch" in args.backends else ["torch"] + args.backends
+    results = [measure(backend, corpus, queries, args.batch_size) for backend in backends]
+    baseline = results[0]
+    truth = top_k(baseline["_corpus"], baseline["_queries"], args.k)
+    for r in results:
+        r["cosine"] = round(float(np.mean(np.sum(r["_corpus"] * baseline["_corpus"], axis=1))), 4)
+        r[f"recall@{args.k}"] = round(overlap(top_k(r["_corpus"], r["_queries"], args.k), truth), 4)
+        r[f"mixed@{args.k}"] = round(overlap(top_k(baseline["_corpus"], r["_queries"], args.k), truth), 4)
+        del r["_queries"], r["_corpus"]
+
+    print(f"{len(corpus)} texts, {len(queries)} queries, k={args.k}, batch size {args.batch_size}")
+    print(f"{'backend':<11}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}{'texts/s':>10}{'cosine':>9}{'recall':>9}{'mixed':>9}")
+    for r in results:
+        print(f"{r['backend']:<11}{r['load_seconds']:>8}{r['query_p50_ms']:>9}{r['query_p95_ms']:>9}"
+              f"{r['texts_per_second']:>10}{r['cosine']:>9}{r[f'recall@{args.k}']:>9}{r[f'mixed@{args.k}']:>9}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"num_texts": len(corpus), "num_queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# benchmarks/fake_llm_server.py
+"""
+A local stand-in for the Groq / OpenAI chat completions API, for load tests
+and for exercising llm_interface.py's pooling, concurrency limit and retries
+without spending tokens or hitting real rate limits.
+
+It answers POST /openai/v1/chat/completions (the Groq SDK's path) and
+/v1/chat/completions, with or without "stream": true. Behaviour:
+
+  --latency-ms       time to first token
+  --tokens-per-second  generation speed; --answer-tokens tokens per answer
+  --max-concurrency  requests beyond this many in flight get a 429 with Retry-After
+  --error-rate       fraction of requests that fail with a 500
+
+Point the app at it with GROQ_BASE_URL=http://127.0.0.1:8900 and any GROQ_API_KEY.
+
+    python benchmarks/fake_llm_server.py --port 8900 --latency-ms 300 --max-concurrency 8
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION_PATHS = ("/openai/v1/chat/completions", "/v1/chat/completions")
+
+
+class FakeLLMState:
+    def __init__(self, latency_ms: float = 200.0, tokens_per_second: float = 200.0, answer_tokens: int = 60,
+                 max_concurrency: int = 0, error_rate: float = 0.0, retry_after: float = 0.2):
+        self.latency = latency_ms / 1000.0
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.connections = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited, "errors": self.errors,
+                    "max_in_flight": self.max_in_flight, "connections": self.connections}
+
+
+def make_handler(state: FakeLLMState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._send_json(200, state.stats())
+            self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path not in COMPLETION_PATHS:
+                return self._send_json(404, {"error": {"message": "not found"}})
+            with state.lock:
+                state.requests += 1
+                if state.max_concurrency and state.in_flight >= state.max_concurrency:
+                    state.rate_limited += 1
+                    limited = True
+                else:
+                    state.in_flight += 1
+                    state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                    limited = False
+            if limited:
+                return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                                       {"Retry-After": str(state.retry_after)})
+            try:
+                if random.random() < state.error_rate:
+                    with state.lock:
+                        state.errors += 1
+                    return self._send_json(500, {"error": {"message": "Internal server error"}})
+                time.sleep(state.latency)
+                words = [f"word{i}" for i in range(state.answer_tokens)]
+                if body.get("stream"):
+                    self._stream(body, words)
+                else:
+                    time.sleep(len(words) / state.tokens_per_second)
+                    self._send_json(200, self._completion(body, " ".join(words)))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _completion(self, body: dict, text: str) -> dict:
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", [])),
+                          "completion_tokens": state.answer_tokens, "total_tokens": state.answer_tokens},
+            }
+
+        def _stream(self, body: dict, words: list[str]):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+            def send(payload: str):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            for i, word in enumerate(words):
+                delta = {"content": (" " if i else "") + word}
+                send(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": body.get("model", "fake"),
+                                 "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+                time.sleep(1 / state.tokens_per_second)
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_fake_server(port: int = 0, **options):
+    """Starts the server on a background thread; returns (server, base_url, state)."""
+    state = FakeLLMState(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--max-concurrency", type=int, default=0, help="0 = unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server, url, _ = start_fake_server(args.port, latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                                       answer_tokens=args.answer_tokens, max_concurrency=args.max_concurrency,
+                                       error_rate=args.error_rate, retry_after=args.retry_after)
+    print(f"Fake LLM server listening on {url} (set GROQ_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
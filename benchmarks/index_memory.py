@@ -0,0 +1,129 @@
+# benchmarks/index_memory.py
+"""
+Measures the memory each tenant costs when several worker processes serve
+the same tenants, with and without memory-mapped indexes (INDEX_MMAP).
+
+It writes --tenants synthetic knowledge bases into a scratch directory,
+then starts --workers processes that each load every tenant (like gunicorn
+workers after warming their index cache) and answer one query per tenant.
+Memory is read from /proc/<pid>/smaps_rollup (Linux):
+
+  - RSS:  resident pages, counting shared pages once per process
+  - PSS:  shared pages divided among the processes sharing them
+  - USS:  pages private to the process
+
+The sum of PSS over all workers, divided by the tenant count, is the real
+memory per tenant on the node.
+
+    python benchmarks/index_memory.py --tenants 20 --vectors-per-tenant 50000 --workers 4
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def smaps_rollup(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def build_tenants(data_root: str, tenants: int, vectors_per_tenant: int, dimension: int):
+    os.chdir(data_root)
+    import vector_store_manager
+
+    rng = np.random.default_rng(0)
+    for t in range(tenants):
+        vectors = rng.standard_normal((vectors_per_tenant, dimension)).astype('float32')
+        vector_store_manager.add_embeddings_to_faiss(f"tenant-{t}", vectors, [f"chunk {i}" for i in range(vectors_per_tenant)])
+
+
+def worker(data_root: str, tenants: int, dimension: int, ready, done):
+    os.chdir(data_root)
+    importlib.import_module("faiss")  # count the library itself in neither mode
+    import vector_store_manager
+
+    baseline = smaps_rollup(os.getpid())
+    query = np.random.default_rng(os.getpid()).standard_normal(dimension).astype('float32')
+    for t in range(tenants):
+        vector_store_manager.search_faiss_index(f"tenant-{t}", query, k=5)
+    ready.put((os.getpid(), baseline, vector_store_manager.get_index_cache_stats()))
+    done.wait()
+
+
+def run(mmap: bool, args, data_root: str) -> dict:
+    os.environ["INDEX_MMAP"] = "1" if mmap else "0"
+    context = multiprocessing.get_context("spawn")
+    ready, done = context.Queue(), context.Event()
+    processes = [context.Process(target=worker, args=(data_root, args.tenants, args.dimension, ready, done))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    reports = [ready.get() for _ in processes]
+    # Measure while every worker is still alive, so shared pages are divided among all of them.
+    usage = []
+    for pid, baseline, cache_stats in reports:
+        now = smaps_rollup(pid)
+        usage.append({key: now[key] - baseline[key] for key in now})
+    done.set()
+    for process in processes:
+        process.join()
+
+    total = {key: sum(u[key] for u in usage) for key in ("rss", "pss", "uss")}
+    mib = 2 ** 20
+    return {
+        "index_mmap": mmap,
+        "workers": args.workers,
+        "tenants": args.tenants,
+        "rss_mb_per_worker": round(total["rss"] / args.workers / mib, 2),
+        "uss_mb_per_worker": round(total["uss"] / args.workers / mib, 2),
+        "pss_mb_total": round(total["pss"] / mib, 2),
+        "pss_mb_per_tenant": round(total["pss"] / args.tenants / mib, 3),
+        "cache_private_mb_per_worker": round(reports[0][2]["bytes"] / mib, 2),
+        "cache_mapped_mb_per_worker": round(reports[0][2]["mapped_bytes"] / mib, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--vectors-per-tenant", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="index-memory-") as data_root:
+        build_tenants(data_root, args.tenants, args.vectors_per_tenant, args.dimension)
+        results = [run(False, args, data_root), run(True, args, data_root)]
+
+    index_mb = args.vectors_per_tenant * args.dimension * 4 / 2 ** 20
+    print(f"{args.tenants} tenants x {args.vectors_per_tenant} vectors (d={args.dimension}, {index_mb:.1f} MB each), {args.workers} workers")
+    print(f"{'INDEX_MMAP':<11}{'RSS/worker':>12}{'USS/worker':>12}{'PSS total':>11}{'PSS/tenant':>12}")
+    for r in results:
+        print(f"{str(int(r['index_mmap'])):<11}{r['rss_mb_per_worker']:>12}{r['uss_mb_per_worker']:>12}"
+              f"{r['pss_mb_total']:>11}{r['pss_mb_per_tenant']:>12}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"vectors_per_tenant": args.vectors_per_tenant, "dimension": args.dimension, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
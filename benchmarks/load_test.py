@@ -0,0 +1,211 @@
+# benchmarks/load_test.py
+"""
+End-to-end load test of the API (main.py) with local stand-ins for its
+external services, so it runs on a laptop or in CI:
+
+  - LLM:      benchmarks/fake_llm_server.py, with --llm-latency-ms per answer
+  - database: a SQLite file (benchmarks/standin_db.py), or a real Postgres
+              with --database-url
+  - data:     --businesses synthetic knowledge bases of --kb-chunks chunks,
+              in a scratch data directory
+
+The API runs in a separate process (uvicorn, one worker) like in
+production. For every endpoint and concurrency level, --concurrency
+clients send requests back to back for --duration seconds; the report has
+throughput and p50/p95/p99 latency per level. The answer cache is off
+unless --with-answer-cache, and questions are varied, so every /chat runs
+the full pipeline.
+
+    python benchmarks/load_test.py --concurrency 1 4 16 64 --duration 15 --json load.json
+    python benchmarks/compare.py baseline.json load.json
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import summarize, write_results
+
+ENDPOINTS = ("config", "chat", "chat_stream")
+
+
+def build_data(data_root: str, business_ids: list[str], kb_chunks: int, dimension: int):
+    """Writes the synthetic knowledge bases into data_root/data."""
+    os.chdir(data_root)
+    import document_processor
+    import vector_store_manager
+
+    rng = np.random.default_rng(0)
+    words = [f"word{i}" for i in range(5000)]
+    for business_id in business_ids:
+        text = " ".join(words[i] for i in rng.integers(0, len(words), kb_chunks * 80))
+        chunks = document_processor.chunk_text(text)[:kb_chunks]
+        vectors = rng.standard_normal((len(chunks), dimension)).astype('float32')
+        vector_store_manager.add_embeddings_to_faiss(business_id, vectors, chunks)
+
+
+def serve(args):
+    """Runs the API in this process (the --serve half of the load test)."""
+    if os.environ["DATABASE_URL"].startswith("sqlite:"):
+        import standin_db
+        standin_db.install()
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_api(args, data_root: str, env: dict) -> subprocess.Popen:
+    import httpx
+
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)]
+    api = subprocess.Popen(command, cwd=data_root, env=env)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if api.poll() is not None:
+            raise RuntimeError(f"The API exited during startup with code {api.returncode}.")
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/stats", timeout=1).status_code == 200:
+                return api
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    api.terminate()
+    raise RuntimeError(f"The API did not become ready within {args.startup_timeout}s.")
+
+
+async def run_level(client, endpoint: str, concurrency: int, duration: float, business_ids: list[str],
+                    questions) -> dict:
+    """Runs `concurrency` closed-loop clients against one endpoint for `duration` seconds."""
+    latencies, statuses = [], {}
+    business = itertools.cycle(business_ids)
+    stop_at = time.monotonic() + duration
+
+    async def request():
+        business_id = next(business)
+        if endpoint == "config":
+            response = await client.get(f"/config/{business_id}")
+            return response.status_code
+        path = "/chat" if endpoint == "chat" else "/chat/stream"
+        payload = {"businessId": business_id, "question": next(questions)}
+        if endpoint == "chat":
+            response = await client.post(path, json=payload)
+            return response.status_code
+        async with client.stream("POST", path, json=payload) as response:
+            async for _ in response.aiter_bytes():
+                pass
+            return response.status_code
+
+    async def worker():
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            try:
+                status = str(await request())
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ok = statuses.get("200", 0)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        **summarize(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "ok_per_second": round(ok / elapsed, 2),
+        "error_rate": round(1 - ok / len(latencies), 4) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+async def run_load(args, business_ids: list[str]) -> tuple[list[dict], dict]:
+    import httpx
+
+    questions = (f"How do I set up feature {i} for my account?" for i in itertools.count())
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    results = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                result = await run_level(client, endpoint, concurrency, args.duration, business_ids, questions)
+                print(f"{endpoint:<12}{concurrency:>6}{result['requests_per_second']:>10}{result.get('p50_ms', '-'):>10}"
+                      f"{result.get('p95_ms', '-'):>10}{result.get('p99_ms', '-'):>10}{result['error_rate']:>8}")
+                results.append(result)
+        stats = (await client.get("/stats")).json()
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=["config", "chat"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint and concurrency level")
+    parser.add_argument("--businesses", type=int, default=4)
+    parser.add_argument("--kb-chunks", type=int, default=2000)
+    parser.add_argument("--dimension", type=int, default=384, help="must match the embedding model")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="429 above this many calls; 0 = unlimited")
+    parser.add_argument("--database-url", help="a Postgres URL with the app's schema; default: a SQLite stand-in")
+    parser.add_argument("--with-answer-cache", action="store_true")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    import fake_llm_server
+
+    business_ids = [f"bench-{i}" for i in range(args.businesses)]
+    llm_server, llm_url, llm_state = fake_llm_server.start_fake_server(
+        latency_ms=args.llm_latency_ms, tokens_per_second=args.llm_tokens_per_second,
+        max_concurrency=args.llm_max_concurrency)
+    with tempfile.TemporaryDirectory(prefix="load-test-") as data_root:
+        build_data(data_root, business_ids, args.kb_chunks, args.dimension)
+        database_url = args.database_url
+        if database_url is None:
+            import standin_db
+            standin_db.create_database(os.path.join(data_root, "standin.sqlite3"), business_ids)
+            database_url = f"sqlite:///{os.path.join(data_root, 'standin.sqlite3')}"
+        env = {
+            **os.environ,
+            "DATABASE_URL": database_url,
+            "GROQ_BASE_URL": llm_url,
+            "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "load-test"),
+            "STARTUP_MODE": "warm",
+            "WARM_BUSINESS_IDS": ",".join(business_ids),
+        }
+        if not args.with_answer_cache:
+            env["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+
+        api = start_api(args, data_root, env)
+        try:
+            print(f"{'endpoint':<12}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            results, api_stats = asyncio.run(run_load(args, business_ids))
+        finally:
+            api.terminate()
+            api.wait(timeout=30)
+            llm_server.shutdown()
+
+    if args.json:
+        params = {key: value for key, value in vars(args).items() if key not in ("json", "serve", "database_url")}
+        params["database"] = "postgres" if args.database_url else "sqlite-standin"
+        write_results(args.json, "load", params,
+                      {"levels": results, "llm_server": llm_state.stats(), "api_stats": api_stats})
+
+
+if __name__ == "__main__":
+    main()
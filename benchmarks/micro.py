@@ -0,0 +1,147 @@
+# benchmarks/micro.py
+"""
+Micro-benchmarks of the hot functions of the RAG pipeline, run in a scratch
+data directory so no real knowledge base is touched:
+
+  chunk    - chunk_text() over documents of --doc-chars characters
+  embed    - generate_embeddings(), one text per call vs one batched call
+             (loads the embedding model of EMBEDDING_BACKEND)
+  search   - search_faiss_index() with a warm index cache, per corpus size
+  persist  - add_embeddings_to_faiss() appending --persist-batch vectors to a
+             knowledge base of each corpus size (a new segment on disk)
+
+Vectors for search/persist are random, so those suites do not need the model.
+
+    python benchmarks/micro.py --suites chunk search persist --sizes 1000 10000 100000
+    python benchmarks/micro.py --json before.json   # then compare.py before.json after.json
+"""
+import argparse
+import itertools
+import os
+import tempfile
+
+# Measure appends and searches without a background merge running alongside.
+os.environ.setdefault("COMPACTION_MAX_SEGMENTS", "1000000")
+
+import numpy as np
+
+# Importing common also puts the repo on sys.path.
+from common import summarize, time_calls, write_results
+
+SUITES = ("chunk", "embed", "search", "persist")
+
+
+def synthetic_text(num_chars: int, seed: int = 0) -> str:
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(2000)]
+    text = " ".join(words[i] for i in rng.integers(0, len(words), num_chars // 6 + 1))
+    return text[:num_chars]
+
+
+def bench_chunk(args) -> dict:
+    import document_processor
+
+    text = synthetic_text(args.doc_chars)
+    chunks = document_processor.chunk_text(text)
+    latency = summarize(time_calls(lambda: document_processor.chunk_text(text), args.repeat))
+    return {"chunk_text": {**latency, "doc_chars": args.doc_chars, "chunks": len(chunks),
+                           "mb_per_second": round(args.doc_chars / 2 ** 20 / (latency["mean_ms"] / 1000), 2)}}
+
+
+def bench_embed(args) -> dict:
+    import document_processor
+
+    texts = document_processor.chunk_text(synthetic_text(500 * args.embed_texts))[:args.embed_texts]
+    document_processor.generate_embeddings(texts[:1])  # load the model outside the measurement
+    next_text = itertools.cycle(texts).__next__
+    single = time_calls(lambda: document_processor.generate_embeddings([next_text()]), 3 * len(texts), warmup=0)
+    batch = time_calls(lambda: document_processor.generate_embeddings(texts), 3)
+    return {
+        "embed_single": {**summarize(single), "texts_per_call": 1,
+                         "texts_per_second": round(len(single) / sum(single), 1)},
+        "embed_batch": {**summarize(batch), "texts_per_call": len(texts),
+                        "texts_per_second": round(len(texts) * len(batch) / sum(batch), 1)},
+    }
+
+
+def build_corpus(business_id: str, size: int, dimension: int, seed: int = 0):
+    import vector_store_manager
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, 50000):
+        n = min(50000, size - start)
+        vectors = rng.standard_normal((n, dimension)).astype('float32')
+        vector_store_manager.add_embeddings_to_faiss(business_id, vectors, [f"chunk {start + i}" for i in range(n)])
+
+
+def bench_search(args) -> dict:
+    import vector_store_manager
+
+    results = {}
+    queries = np.random.default_rng(1).standard_normal((args.repeat, args.dimension)).astype('float32')
+    for size in args.sizes:
+        business_id = f"bench-search-{size}"
+        build_corpus(business_id, size, args.dimension)
+        vector_store_manager.search_faiss_index(business_id, queries[0], k=args.k)  # load into the cache
+        next_query = itertools.cycle(queries).__next__
+        samples = time_calls(lambda: vector_store_manager.search_faiss_index(business_id, next_query(), k=args.k),
+                             args.repeat, warmup=0)
+        latency = summarize(samples)
+        results[f"search_{size}"] = {**latency, "vectors": size, "k": args.k,
+                                     "qps": round(1000 / latency["mean_ms"], 1)}
+    return results
+
+
+def bench_persist(args) -> dict:
+    import vector_store_manager
+
+    results = {}
+    rng = np.random.default_rng(2)
+    batch = rng.standard_normal((args.persist_batch, args.dimension)).astype('float32')
+    texts = [f"new chunk {i}" for i in range(args.persist_batch)]
+    for size in args.sizes:
+        business_id = f"bench-persist-{size}"
+        build_corpus(business_id, size, args.dimension)
+        samples = time_calls(lambda: vector_store_manager.add_embeddings_to_faiss(business_id, batch, texts),
+                             args.persist_repeat, warmup=0)
+        latency = summarize(samples)
+        results[f"persist_{size}"] = {**latency, "existing_vectors": size, "batch": args.persist_batch,
+                                      "vectors_per_second": round(args.persist_batch / (latency["mean_ms"] / 1000), 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="corpus sizes (vectors)")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--doc-chars", type=int, default=1_000_000)
+    parser.add_argument("--embed-texts", type=int, default=64)
+    parser.add_argument("--persist-batch", type=int, default=1000)
+    parser.add_argument("--persist-repeat", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    benches = {"chunk": bench_chunk, "embed": bench_embed, "search": bench_search, "persist": bench_persist}
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="micro-bench-") as data_root:
+        os.chdir(data_root)
+        for suite in args.suites:
+            print(f"Running {suite} ...")
+            results.update(benches[suite](args))
+
+    print(f"{'benchmark':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  throughput")
+    for name, r in results.items():
+        throughput = next((f"{r[key]} {key}" for key in ("qps", "texts_per_second", "vectors_per_second", "mb_per_second")
+                           if key in r), "")
+        print(f"{name:<22}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}  {throughput}")
+    if args.json:
+        write_results(args.json, "micro", {key: value for key, value in vars(args).items() if key != "json"}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# benchmarks/standin_db.py
+"""
+A SQLite stand-in for the Postgres database, for load tests on a machine
+without one. install() makes the API's two database paths talk to a SQLite
+file instead:
+
+  - asyncpg.create_pool (the async /chat path): `$1` placeholders, fetchrow()
+  - db_pool.get_pool (the /config endpoint and the chat log writer): `%s`
+    placeholders, dict rows for DictCursor, execute_values() inserts and
+    the analytics rollup upserts
+
+Only the SQL the API issues is supported; it is a benchmark fixture, not a
+database driver. SQLite serializes writers, so the numbers it produces are
+for comparing builds of the API with each other, not for sizing Postgres.
+"""
+import asyncio
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS businesses (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    agent_name TEXT DEFAULT 'AI Assistant',
+    welcome_message TEXT DEFAULT 'Hi! How can I help you today?',
+    personality TEXT DEFAULT 'friendly',
+    brand_color TEXT DEFAULT '#007bff'
+);
+CREATE TABLE IF NOT EXISTS chat_logs (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    business_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS chat_logs_business_id_timestamp_idx ON chat_logs (business_id, timestamp);
+CREATE TABLE IF NOT EXISTS chat_daily_counts (
+    business_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    queries INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (business_id, day)
+);
+CREATE TABLE IF NOT EXISTS chat_question_counts (
+    business_id TEXT NOT NULL,
+    question_hash TEXT NOT NULL,
+    question TEXT NOT NULL,
+    asked INTEGER NOT NULL DEFAULT 0,
+    last_asked TEXT,
+    PRIMARY KEY (business_id, question_hash)
+);
+"""
+
+
+def sqlite_path(dsn: str) -> str:
+    """sqlite:///relative.db or sqlite:////absolute.db, ignoring any ?query."""
+    return dsn[len("sqlite:///"):].split("?", 1)[0]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def create_database(path: str, business_ids: list[str]):
+    """Creates the schema and one business row per id."""
+    conn = connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT OR REPLACE INTO businesses (id, name) VALUES (?, ?)",
+                     [(bid, f"Benchmark Business {bid}") for bid in business_ids])
+    conn.commit()
+    conn.close()
+
+
+def _qmark(sql: str) -> str:
+    """Rewrites the Postgres-only parts of the API's SQL for SQLite."""
+    sql = re.sub(r"SELECT to_regclass\('public\.(\w+)'\)", r"SELECT (SELECT name FROM sqlite_master WHERE name = '\1')", sql)
+    sql = sql.replace("GREATEST(", "MAX(")
+    return re.sub(r"\$\d+|%s", "?", sql)
+
+
+# --- SYNC SIDE (db_pool.get_pool) ---
+class _Cursor:
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, as_dict: bool):
+        self._conn = conn
+        self._lock = lock
+        self._as_dict = as_dict
+        self._cursor = conn.cursor()
+
+    def execute(self, sql: str, params=()):
+        with self._lock:
+            self._cursor.execute(_qmark(sql), tuple(params))
+
+    def executemany(self, sql: str, rows):
+        with self._lock:
+            self._cursor.executemany(_qmark(sql), [tuple(row) for row in rows])
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None and self._as_dict else (tuple(row) if row is not None else None)
+
+    def fetchall(self):
+        return [dict(row) if self._as_dict else tuple(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Connection:
+    closed = False
+
+    def __init__(self, path: str):
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+
+    def cursor(self, cursor_factory=None):
+        return _Cursor(self._conn, self._lock, cursor_factory is not None)
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+
+class SyncPool:
+    """Quacks like db_pool.ConnectionPool: one SQLite connection per thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _Connection(self.path)
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+    def stats(self) -> dict:
+        return {"standin": "sqlite", "path": self.path}
+
+    def close(self):
+        pass
+
+
+def _execute_values(cursor, sql: str, rows, template=None, page_size: int = 100):
+    """psycopg2.extras.execute_values for the stand-in: one executemany per call."""
+    rows = list(rows)
+    if rows:
+        placeholders = "(" + ", ".join("?" * len(rows[0])) + ")"
+        cursor.executemany(sql.replace("%s", placeholders, 1), rows)
+
+
+# --- ASYNC SIDE (asyncpg.create_pool) ---
+class _AsyncConnection:
+    def __init__(self, path: str):
+        self._conn = connect(path)
+
+    async def fetchrow(self, sql: str, *args):
+        row = self._conn.execute(_qmark(sql), args).fetchone()
+        return dict(row) if row is not None else None
+
+    async def fetch(self, sql: str, *args):
+        return [dict(row) for row in self._conn.execute(_qmark(sql), args).fetchall()]
+
+    async def execute(self, sql: str, *args):
+        self._conn.execute(_qmark(sql), args)
+        self._conn.commit()
+
+
+class AsyncPool:
+    """Quacks like an asyncpg pool: acquire(timeout)/release/close, max_size connections."""
+
+    def __init__(self, path: str, max_size: int = 10):
+        self._idle = [_AsyncConnection(path) for _ in range(max_size)]
+        self._available = asyncio.Semaphore(max_size)
+
+    async def acquire(self, timeout: float = None):
+        await asyncio.wait_for(self._available.acquire(), timeout)
+        return self._idle.pop()
+
+    async def release(self, conn):
+        self._idle.append(conn)
+        self._available.release()
+
+    async def close(self):
+        for conn in self._idle:
+            conn._conn.close()
+
+
+def install():
+    """Routes sqlite:/// database URLs of db_pool and asyncpg to the stand-in."""
+    import asyncpg
+    import psycopg2.extras
+
+    import db_pool
+
+    real_create_pool = asyncpg.create_pool
+    real_get_pool = db_pool.get_pool
+    sync_pools = {}
+
+    async def create_pool(dsn, *args, max_size: int = 10, **kwargs):
+        if not dsn.startswith("sqlite:"):
+            return await real_create_pool(dsn, *args, max_size=max_size, **kwargs)
+        return AsyncPool(sqlite_path(dsn), max_size)
+
+    def get_pool(dsn: str):
+        if not dsn.startswith("sqlite:"):
+            return real_get_pool(dsn)
+        path = sqlite_path(dsn)
+        return sync_pools.setdefault(path, SyncPool(path))
+
+    asyncpg.create_pool = create_pool
+    db_pool.get_pool = get_pool
+    real_execute_values = psycopg2.extras.execute_values
+
+    def execute_values(cursor, sql, rows, *args, **kwargs):
+        if isinstance(cursor, _Cursor):
+            return _execute_values(cursor, sql, rows, *args, **kwargs)
+        return real_execute_values(cursor, sql, rows, *args, **kwargs)
+
+    psycopg2.extras.execute_values = execute_values
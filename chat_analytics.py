@@ -0,0 +1,132 @@
+# chat_analytics.py
+import hashlib
+from collections import defaultdict
+
+import psycopg2.extras
+
+import document_processor
+
+# --- CHAT ANALYTICS ROLLUPS ---
+# The Analytics tab used to aggregate a tenant's whole chat_logs history on
+# every Streamlit rerun. Two rollup tables now hold the answers instead, and
+# the chat log writer keeps them current in the same transaction as its
+# INSERT into chat_logs, so they never drift from the logs:
+#   chat_daily_counts    - questions per business and UTC day
+#   chat_question_counts - questions per business and normalized question
+#                          (normalize_query(), keyed by its md5 so long
+#                          questions fit in the primary key index)
+# ensure_schema() creates them once, with the chat_logs indexes, and fills
+# them from the existing history.
+DAILY_UPSERT_SQL = '''
+    INSERT INTO chat_daily_counts (business_id, day, queries) VALUES %s
+    ON CONFLICT (business_id, day) DO UPDATE SET queries = chat_daily_counts.queries + EXCLUDED.queries
+'''
+QUESTION_UPSERT_SQL = '''
+    INSERT INTO chat_question_counts (business_id, question_hash, question, asked, last_asked) VALUES %s
+    ON CONFLICT (business_id, question_hash) DO UPDATE
+    SET asked = chat_question_counts.asked + EXCLUDED.asked,
+        last_asked = GREATEST(chat_question_counts.last_asked, EXCLUDED.last_asked)
+'''
+
+SCHEMA_STATEMENTS = (
+    'CREATE INDEX IF NOT EXISTS chat_logs_business_id_timestamp_idx ON chat_logs (business_id, timestamp)',
+    '''CREATE TABLE IF NOT EXISTS chat_daily_counts (
+        business_id TEXT NOT NULL,
+        day DATE NOT NULL,
+        queries BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (business_id, day)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS chat_question_counts (
+        business_id TEXT NOT NULL,
+        question_hash TEXT NOT NULL,
+        question TEXT NOT NULL,
+        asked BIGINT NOT NULL DEFAULT 0,
+        last_asked TIMESTAMPTZ,
+        PRIMARY KEY (business_id, question_hash)
+    )''',
+    'CREATE INDEX IF NOT EXISTS chat_question_counts_top_idx ON chat_question_counts (business_id, asked DESC)',
+)
+
+# Same normalization as normalize_query(), for the rows logged before the rollups existed.
+BACKFILL_STATEMENTS = (
+    '''INSERT INTO chat_daily_counts (business_id, day, queries)
+       SELECT business_id, (timestamp AT TIME ZONE 'UTC')::date, COUNT(*) FROM chat_logs GROUP BY 1, 2''',
+    r'''INSERT INTO chat_question_counts (business_id, question_hash, question, asked, last_asked)
+        SELECT business_id, md5(normalized), MIN(question), COUNT(*), MAX(timestamp)
+        FROM (SELECT business_id, question, timestamp,
+                     btrim(regexp_replace(lower(question), '\s+', ' ', 'g')) AS normalized
+              FROM chat_logs) logs
+        GROUP BY business_id, normalized''',
+)
+
+
+def question_hash(question: str) -> str:
+    return hashlib.md5(document_processor.normalize_query(question).encode('utf-8')).hexdigest()
+
+
+def rollups_exist(cursor) -> bool:
+    cursor.execute("SELECT to_regclass('public.chat_question_counts')")
+    return cursor.fetchone()[0] is not None
+
+
+def ensure_schema(conn) -> bool:
+    """
+    Creates the chat_logs indexes and the rollup tables if they are missing,
+    and backfills the rollups from chat_logs. Returns whether it did. Running
+    API workers block on their next log write until this commits, so no log
+    row is counted twice or missed.
+    """
+    cursor = conn.cursor()
+    try:
+        if rollups_exist(cursor):
+            return False
+        cursor.execute('LOCK TABLE chat_logs IN SHARE MODE')
+        if rollups_exist(cursor):  # Another process migrated while we waited.
+            conn.rollback()
+            return False
+        for statement in SCHEMA_STATEMENTS + BACKFILL_STATEMENTS:
+            cursor.execute(statement)
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+
+
+def write_rollups(cursor, rows):
+    """
+    Adds (business_id, question, answer, timestamp) log rows to the rollups.
+    Call after inserting the rows into chat_logs, in the same transaction;
+    does nothing until ensure_schema() has created the tables.
+    """
+    if not rows or not rollups_exist(cursor):
+        return
+    daily = defaultdict(int)
+    questions = {}
+    for business_id, question, _, timestamp in rows:
+        daily[(business_id, timestamp.date())] += 1
+        key = (business_id, question_hash(question))
+        entry = questions.get(key)
+        if entry is None:
+            questions[key] = [question, 1, timestamp]
+        else:
+            entry[1] += 1
+            entry[2] = max(entry[2], timestamp)
+    # Sorted, so concurrent writers lock shared rows in the same order and can't deadlock.
+    psycopg2.extras.execute_values(cursor, DAILY_UPSERT_SQL,
+                                   [(b, day, n) for (b, day), n in sorted(daily.items())])
+    psycopg2.extras.execute_values(cursor, QUESTION_UPSERT_SQL,
+                                   [(b, h, q, n, last) for (b, h), (q, n, last) in sorted(questions.items())])
+
+
+def top_questions(cursor, business_id: str, limit: int = 10) -> list:
+    cursor.execute('SELECT question, asked AS count FROM chat_question_counts WHERE business_id = %s '
+                   'ORDER BY asked DESC LIMIT %s', (business_id, limit))
+    return cursor.fetchall()
+
+
+def queries_today(cursor, business_id: str) -> int:
+    cursor.execute("SELECT queries FROM chat_daily_counts WHERE business_id = %s "
+                   "AND day = (now() AT TIME ZONE 'UTC')::date", (business_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+# --- END OF CHAT ANALYTICS ROLLUPS ---
@@ -0,0 +1,242 @@
+# chat_log_writer.py
+import glob
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extras
+
+import chat_analytics
+import db_pool
+
+# --- BUFFERED CHAT LOG WRITER ---
+# Chat requests only enqueue their log row; a background thread writes the
+# queue to chat_logs in multi-row INSERTs once CHAT_LOG_BATCH_SIZE rows are
+# waiting or every CHAT_LOG_FLUSH_INTERVAL seconds. If the queue is full or
+# the database is unreachable, rows are appended to a spill file on disk and
+# replayed on the next successful flush, so nothing is lost. Each worker
+# process spills into its own file and also adopts the files of workers
+# that are no longer running. The timestamp is taken at enqueue time, so
+# delayed writes still record when the question was asked. The analytics
+# rollups are updated in the same transaction (see chat_analytics.py).
+# Spill lines that cannot be parsed (e.g. torn by a crash mid-write) are
+# moved to a ".bad" file next to the spill files instead of being replayed.
+CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "10000"))
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", "500"))
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "1.0"))
+CHAT_LOG_SPILL_DIR = os.getenv("CHAT_LOG_SPILL_DIR", os.path.join("data", "chat_log_spill"))
+
+INSERT_SQL = 'INSERT INTO chat_logs (business_id, question, answer, timestamp) VALUES %s'
+
+
+class ChatLogWriter:
+    def __init__(self, dsn: str, queue_size: int = CHAT_LOG_QUEUE_SIZE, batch_size: int = CHAT_LOG_BATCH_SIZE,
+                 flush_interval: float = CHAT_LOG_FLUSH_INTERVAL, spill_dir: str = CHAT_LOG_SPILL_DIR):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.write_failures = 0
+        self.bad_lines = 0
+
+    def start(self):
+        self._thread.start()
+
+    def enqueue(self, business_id: str, question: str, answer: str):
+        """Queues a log row without blocking; spills to disk if the queue is full."""
+        row = (business_id, question, answer, datetime.now(timezone.utc))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._spill([row])
+        self._count("enqueued", 1)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes everything still queued and stops the writer thread."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._safe_flush()
+        self._safe_flush()
+
+    def _safe_flush(self):
+        # An unexpected error must not kill the thread, or every later row
+        # would pile up in the queue and never be written.
+        try:
+            self._flush()
+        except Exception as e:
+            print(f"Error in chat log writer: {e}")
+            self._count("write_failures", 1)
+
+    def _flush(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            if not self._write(batch):
+                self._spill(batch)
+                return
+        self._replay_spill()
+
+    def _write(self, rows) -> bool:
+        try:
+            with db_pool.get_pool(self.dsn).connection() as conn:
+                with conn.cursor() as cursor:
+                    psycopg2.extras.execute_values(cursor, INSERT_SQL, rows, page_size=self.batch_size)
+                    chat_analytics.write_rollups(cursor, rows)
+                conn.commit()
+        except (psycopg2.Error, db_pool.PoolTimeout) as e:
+            print(f"Error writing {len(rows)} chat logs: {e}")
+            self._count("write_failures", 1)
+            return False
+        self._count("written", len(rows))
+        self._count("batches", 1)
+        return True
+
+    def _spill(self, rows, count: bool = True):
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(os.path.join(self.spill_dir, f"{os.getpid()}.jsonl"), 'a', encoding='utf-8') as f:
+                for business_id, question, answer, timestamp in rows:
+                    f.write(json.dumps([business_id, question, answer, timestamp.isoformat()]) + '\n')
+        if count:
+            self._count("spilled", len(rows))
+
+    def _replay_spill(self):
+        """Writes rows spilled earlier, now that the database accepts writes again."""
+        paths = glob.glob(os.path.join(self.spill_dir, "*.jsonl"))
+        # Files claimed by a replayer that died before finishing.
+        paths += glob.glob(os.path.join(self.spill_dir, "*.jsonl.replay-*"))
+        for path in paths:
+            owner = _spill_owner(path)
+            if owner is None:
+                continue
+            if owner != os.getpid() and _process_alive(owner):
+                continue  # Another live worker is still appending to or replaying it.
+            # Claim the file atomically so no other process replays it too.
+            base = path.split(".replay-")[0]
+            claimed = f"{base}.replay-{os.getpid()}"
+            if path != claimed:
+                with self._spill_lock:
+                    try:
+                        os.replace(path, claimed)
+                    except FileNotFoundError:
+                        continue
+            rows = self._read_spill(claimed)
+            for i in range(0, len(rows), self.batch_size):
+                if not self._write(rows[i:i + self.batch_size]):
+                    self._spill(rows[i:], count=False)
+                    break
+                self._count("replayed", len(rows[i:i + self.batch_size]))
+            os.remove(claimed)
+
+    def _read_spill(self, path: str) -> list:
+        rows, bad = [], []
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    b, q, a, t = json.loads(line)
+                    rows.append((b, q, a, datetime.fromisoformat(t)))
+                except (ValueError, TypeError) as e:
+                    print(f"Skipping unreadable chat log spill line in {path}: {e}")
+                    bad.append(line if line.endswith('\n') else line + '\n')
+        if bad:
+            with open(os.path.join(self.spill_dir, f"{os.getpid()}.jsonl.bad"), 'a', encoding='utf-8') as f:
+                f.writelines(bad)
+            self._count("bad_lines", len(bad))
+        return rows
+
+    def _count(self, name: str, n: int):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+                "write_failures": self.write_failures,
+                "bad_lines": self.bad_lines,
+            }
+
+
+def _spill_owner(path: str):
+    """The pid writing a spill file, or replaying it if it has been claimed."""
+    name = os.path.basename(path)
+    try:
+        if ".replay-" in name:
+            return int(name.rsplit(".replay-", 1)[1])
+        return int(name.split(".")[0])
+    except ValueError:
+        return None
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_writer = None
+
+
+def start(dsn: str):
+    """Starts the process-wide writer; call once per worker process."""
+    global _writer
+    if _writer is None:
+        _writer = ChatLogWriter(dsn)
+        _writer.start()
+    return _writer
+
+
+def log_interaction(business_id: str, question: str, answer: str):
+    _writer.enqueue(business_id, question, answer)
+
+
+def stop():
+    """Drains the queue into the database before the process exits."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def get_chat_log_writer_stats() -> dict:
+    return _writer.stats() if _writer is not None else {}
+# --- END OF BUFFERED CHAT LOG WRITER ---
@@ -0,0 +1,125 @@
+# chunk_store.py
+import mmap
+import os
+
+import numpy as np
+
+# A chunk store keeps the original text chunks of a knowledge base on disk as:
+#   chunks.bin - every chunk's UTF-8 bytes packed back to back
+#   chunks.idx - one little-endian uint64 per chunk holding the END offset of
+#                that chunk in chunks.bin (chunk i spans idx[i-1]..idx[i])
+# Both files are memory-mapped, so looking up k chunks touches only those k
+# byte ranges instead of loading the whole knowledge base into Python strings.
+# Chunks may contain any characters, including newlines.
+BLOB_FILENAME = "chunks.bin"
+OFFSETS_FILENAME = "chunks.idx"
+LEGACY_METADATA_FILENAME = "metadata.txt"
+OFFSET_DTYPE = np.dtype('<u8')
+
+
+class ChunkStore:
+    """Memory-mapped, append-only store of text chunks addressed by integer id."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blob_path = os.path.join(directory, BLOB_FILENAME)
+        self.offsets_path = os.path.join(directory, OFFSETS_FILENAME)
+        self._blob_file = None
+        self._blob = None
+        self._offsets = None
+        self._open()
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, OFFSETS_FILENAME))
+
+    def _open(self):
+        self.close()
+        n = os.path.getsize(self.offsets_path) // OFFSET_DTYPE.itemsize if os.path.exists(self.offsets_path) else 0
+        if n == 0:
+            self._offsets = np.zeros(0, dtype=OFFSET_DTYPE)
+            return
+        self._offsets = np.memmap(self.offsets_path, dtype=OFFSET_DTYPE, mode='r', shape=(n,))
+        if int(self._offsets[-1]) > 0:
+            self._blob_file = open(self.blob_path, 'rb')
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+        self._offsets = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def get(self, chunk_id: int) -> str:
+        """Decodes a single chunk."""
+        end = int(self._offsets[chunk_id])
+        start = int(self._offsets[chunk_id - 1]) if chunk_id > 0 else 0
+        if start == end:
+            return ""
+        return self._blob[start:end].decode('utf-8')
+
+    def get_many(self, chunk_ids) -> list[str]:
+        """Decodes only the requested chunks, skipping ids that are out of range."""
+        n = len(self)
+        return [self.get(int(i)) for i in chunk_ids if 0 <= i < n]
+
+    def append(self, texts: list[str]):
+        """
+        Appends chunks. The blob is written before the offsets, so a crash in
+        between leaves only unreferenced bytes that the next append trims.
+        """
+        if not texts:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        base = int(self._offsets[-1]) if len(self._offsets) else 0
+        encoded = [text.encode('utf-8') for text in texts]
+        ends = base + np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+        count = len(self)
+        self.close()
+
+        with open(self.blob_path, 'ab') as f:
+            f.truncate(base)
+            f.write(b''.join(encoded))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.offsets_path, 'ab') as f:
+            # Drop any partially written offset left behind by an earlier crash.
+            f.truncate(count * OFFSET_DTYPE.itemsize)
+            f.write(ends.astype(OFFSET_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._open()
+
+
+def migrate_metadata_txt(directory: str) -> bool:
+    """
+    Converts a legacy newline-delimited metadata.txt into a chunk store.
+    Returns True if a migration happened. The original file is kept as
+    metadata.txt.migrated for reference.
+    """
+    metadata_path = os.path.join(directory, LEGACY_METADATA_FILENAME)
+    if ChunkStore.exists(directory) or not os.path.exists(metadata_path):
+        return False
+
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f]
+    # Write into temporary names first so a half-finished migration is never picked up.
+    tmp_dir = os.path.join(directory, ".chunk_store_migration")
+    os.makedirs(tmp_dir, exist_ok=True)
+    for filename in (BLOB_FILENAME, OFFSETS_FILENAME):
+        open(os.path.join(tmp_dir, filename), 'wb').close()
+    store = ChunkStore(tmp_dir)
+    store.append(texts)
+    store.close()
+    os.replace(os.path.join(tmp_dir, BLOB_FILENAME), os.path.join(directory, BLOB_FILENAME))
+    os.replace(os.path.join(tmp_dir, OFFSETS_FILENAME), os.path.join(directory, OFFSETS_FILENAME))
+    os.rmdir(tmp_dir)
+    os.replace(metadata_path, metadata_path + ".migrated")
+    print(f"Migrated {len(texts)} chunks from {metadata_path} to the binary chunk store.")
+    return True
@@ -0,0 +1,166 @@
+# config_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import asyncpg
+
+# --- BUSINESS CONFIG CACHE ---
+# The widget asks for /config/{business_id} on every page load of every
+# customer site, but a business's settings only change when the dashboard
+# saves them. The API therefore keeps each config in memory with an ETag
+# (a hash of its content, so every worker computes the same one) and
+# answers If-None-Match with 304; browsers may reuse a response for
+# CONFIG_MAX_AGE seconds and serve it stale while revalidating for
+# CONFIG_STALE_WHILE_REVALIDATE more.
+# The dashboard runs in another process: update_business_settings() sends a
+# Postgres NOTIFY on CONFIG_CHANNEL, which every API worker LISTENs to and
+# drops that business's entry. Entries also expire after CONFIG_CACHE_TTL
+# seconds, which bounds staleness if a notification is missed while the
+# listener reconnects.
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "300"))
+CONFIG_CACHE_MAX_ENTRIES = int(os.getenv("CONFIG_CACHE_MAX_ENTRIES", "10000"))
+CONFIG_MAX_AGE = int(os.getenv("CONFIG_MAX_AGE", "60"))
+CONFIG_STALE_WHILE_REVALIDATE = int(os.getenv("CONFIG_STALE_WHILE_REVALIDATE", "86400"))
+CONFIG_LISTENER_RETRY = float(os.getenv("CONFIG_LISTENER_RETRY", "5"))
+CONFIG_CHANNEL = "business_config_changed"
+
+CACHE_CONTROL = f"public, max-age={CONFIG_MAX_AGE}, stale-while-revalidate={CONFIG_STALE_WHILE_REVALIDATE}"
+
+
+def compute_etag(config: dict) -> str:
+    payload = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Evaluates an If-None-Match header against an ETag (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ConfigEntry:
+    __slots__ = ("config", "etag", "loaded_at")
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.etag = compute_etag(config)
+        self.loaded_at = time.monotonic()
+
+
+class ConfigCache:
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL, max_entries: int = CONFIG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._generation = 0  # bumped by every invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.not_modified = 0
+
+    @property
+    def generation(self) -> int:
+        """Read before loading a config from the database; pass it to put()."""
+        return self._generation
+
+    def get(self, business_id: str):
+        with self._lock:
+            entry = self._entries.get(business_id)
+            if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, business_id: str, config: dict, generation: int) -> ConfigEntry:
+        entry = ConfigEntry(config)
+        with self._lock:
+            if generation != self._generation:
+                return entry  # Don't cache a load that raced with an invalidation.
+            if len(self._entries) >= self.max_entries and business_id not in self._entries:
+                # Configs are tiny; when full, dropping everything is simpler than LRU bookkeeping.
+                self._entries.clear()
+            self._entries[business_id] = entry
+        return entry
+
+    def invalidate(self, business_id: str = None):
+        """Drops one business's entry, or every entry when business_id is None."""
+        with self._lock:
+            if business_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(business_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+            }
+
+
+CONFIG_CACHE = ConfigCache()
+
+
+def notify_config_changed(cursor, business_id: str):
+    """Tells every API worker to drop the business's cached config; delivered when the transaction commits."""
+    cursor.execute("SELECT pg_notify(%s, %s)", (CONFIG_CHANNEL, business_id))
+
+
+async def listen_for_changes(dsn: str):
+    """
+    Runs for the worker's lifetime: LISTENs on CONFIG_CHANNEL on a dedicated
+    connection and invalidates changed businesses, reconnecting on failure.
+    Everything is dropped after a reconnect, since notifications may have
+    been missed in between.
+    """
+    def on_notification(connection, pid, channel, business_id):
+        CONFIG_CACHE.invalidate(business_id)
+
+    reported = False
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn)
+            lost = asyncio.get_running_loop().create_future()
+            conn.add_termination_listener(lambda connection: lost.done() or lost.set_result(None))
+            await conn.add_listener(CONFIG_CHANNEL, on_notification)
+            CONFIG_CACHE.invalidate()
+            reported = False
+            await lost
+            print("Config change listener lost its connection; reconnecting.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not reported:
+                print(f"Config change listener unavailable ({e}); configs expire after {CONFIG_CACHE_TTL}s instead.")
+                reported = True
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(CONFIG_LISTENER_RETRY)
+
+
+def get_config_cache_stats() -> dict:
+    return CONFIG_CACHE.stats()
+# --- END OF BUSINESS CONFIG CACHE ---
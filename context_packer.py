@@ -0,0 +1,189 @@
+# context_packer.py
+import math
+import os
+import threading
+
+import vector_store_manager
+
+# --- CONTEXT PACKER ---
+# Turns the retrieved chunks into the "Retrieved Information" of the prompt:
+#   1. chunks that follow each other in the same segment and share the
+#      chunk_text() overlap are stitched back into one contiguous span, so the
+#      overlapping characters are sent once,
+#   2. spans that repeat a more relevant span (contained in it, or nearly the
+#      same word shingles) are dropped,
+#   3. spans are added in relevance order until CONTEXT_TOKEN_BUDGET is full.
+# Tokens are estimated at CHARS_PER_TOKEN characters each; no tokenizer of the
+# LLM is needed to stay safely within the budget.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.9"))
+CHUNK_OVERLAP = 50  # chunk_text()'s default overlap
+CHARS_PER_TOKEN = 4
+SHINGLE_SIZE = 5
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class _Span:
+    """A run of consecutive chunks of one segment, stitched back together."""
+
+    def __init__(self, segment: str, local_id: int, text: str, distance: float):
+        self.segment = segment
+        self.first_id = self.last_id = local_id
+        self.text = text
+        self.distance = distance
+        self.chunks = 1
+
+    def extend(self, local_id: int, text: str, distance: float) -> bool:
+        """Appends the next chunk if it continues this span; returns whether it did."""
+        if local_id != self.last_id + 1:
+            return False
+        if text[:CHUNK_OVERLAP] == self.text[-CHUNK_OVERLAP:]:
+            self.text += text[CHUNK_OVERLAP:]
+        elif len(text) <= CHUNK_OVERLAP and self.text.endswith(text):
+            pass  # A final chunk that is entirely overlap adds nothing.
+        else:
+            return False  # Adjacent ids from different documents.
+        self.last_id = local_id
+        self.distance = min(self.distance, distance)
+        self.chunks += 1
+        return True
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _is_near_duplicate(text: str, shingles: set, kept: list) -> bool:
+    normalized = " ".join(text.lower().split())
+    for kept_normalized, kept_shingles in kept:
+        if normalized in kept_normalized:
+            return True
+        union = len(shingles | kept_shingles)
+        if union and len(shingles & kept_shingles) / union >= CONTEXT_DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+class PackedContext:
+    def __init__(self, texts: list[str], candidates: int, merged: int, duplicates: int, truncated: int,
+                 skipped: int, tokens: int, unpacked_tokens: int):
+        self.texts = texts
+        self.candidates = candidates
+        self.merged = merged
+        self.duplicates = duplicates
+        self.truncated = truncated
+        self.skipped = skipped
+        self.tokens = tokens
+        self.unpacked_tokens = unpacked_tokens
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.unpacked_tokens - self.tokens)
+
+
+def pack(hits: list[tuple], token_budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    Packs search hits, given as (distance, segment, local_id, text) in
+    relevance order, into a list of passages that fits the token budget.
+    """
+    # 1. Stitch consecutive chunks; a span ranks by its best chunk.
+    spans = []
+    by_segment = {}
+    for distance, segment, local_id, text in sorted(hits, key=lambda hit: (hit[1], hit[2])):
+        span = by_segment.get(segment)
+        if span is None or not span.extend(local_id, text, distance):
+            span = by_segment[segment] = _Span(segment, local_id, text, distance)
+            spans.append(span)
+    spans.sort(key=lambda span: span.distance)
+
+    # 2-3. Drop repeats and fill the budget in relevance order.
+    texts, kept = [], []
+    used = duplicates = truncated = skipped = 0
+    for span in spans:
+        shingles = _shingles(span.text)
+        if _is_near_duplicate(span.text, shingles, kept):
+            duplicates += 1
+            continue
+        tokens = estimate_tokens(span.text)
+        if used + tokens > token_budget:
+            if texts:
+                skipped += 1
+                continue
+            # Never send an empty context just because the best span is long.
+            span.text = span.text[:token_budget * CHARS_PER_TOKEN]
+            tokens = estimate_tokens(span.text)
+            truncated += 1
+        texts.append(span.text)
+        kept.append((" ".join(span.text.lower().split()), shingles))
+        used += tokens
+
+    return PackedContext(
+        texts=texts,
+        candidates=len(hits),
+        merged=len(hits) - len(spans),
+        duplicates=duplicates,
+        truncated=truncated,
+        skipped=skipped,
+        tokens=used,
+        unpacked_tokens=estimate_tokens("\n\n".join(hit[3] for hit in hits)),
+    )
+
+
+class PackerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.tokens_saved = 0
+        self.chunks_merged = 0
+        self.duplicates_dropped = 0
+
+    def record(self, packed: PackedContext):
+        with self._lock:
+            self.requests += 1
+            self.tokens += packed.tokens
+            self.tokens_saved += packed.tokens_saved
+            self.chunks_merged += packed.merged
+            self.duplicates_dropped += packed.duplicates
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "token_budget": CONTEXT_TOKEN_BUDGET,
+                "avg_prompt_context_tokens": round(self.tokens / self.requests, 1) if self.requests else 0.0,
+                "tokens_saved": self.tokens_saved,
+                "avg_tokens_saved": round(self.tokens_saved / self.requests, 1) if self.requests else 0.0,
+                "chunks_merged": self.chunks_merged,
+                "duplicates_dropped": self.duplicates_dropped,
+            }
+
+
+PACKER_STATS = PackerStats()
+
+
+def retrieve_context(business_id: str, query_embedding, k: int = CONTEXT_CANDIDATES,
+                     token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[str]:
+    """Searches the business's knowledge base and returns the packed passages for the prompt."""
+    hits = vector_store_manager.search_chunks(business_id, query_embedding, k)
+    if not hits:
+        return []
+    packed = pack(hits, token_budget)
+    PACKER_STATS.record(packed)
+    print(f"Context for business {business_id}: {packed.candidates} chunks -> {len(packed.texts)} passages, "
+          f"{packed.tokens} tokens ({packed.tokens_saved} saved, {packed.merged} merged, "
+          f"{packed.duplicates} duplicates, {packed.skipped} over budget).")
+    return packed.texts
+
+
+def get_context_packer_stats() -> dict:
+    """Returns prompt-size counters of the context packer."""
+    return PACKER_STATS.snapshot()
+# --- END OF CONTEXT PACKER ---
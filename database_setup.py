@@ -1,6 +1,7 @@
 import os
 import psycopg2
 import streamlit as st
+import chat_analytics
 
 def get_db_connection_for_setup():
     """Gets DB connection using Streamlit secrets."""
@@ -40,5 +41,7 @@ def setup_database():
 
     conn.commit()
     cursor.close()
+    # Indexes on chat_logs and the analytics rollup tables, backfilled once.
+    chat_analytics.ensure_schema(conn)
     conn.close()
     print("Database setup or verification complete.")
\ No newline at end of file
@@ -0,0 +1,237 @@
+# db_pool.py
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+# --- SHARED CONNECTION POOL ---
+# Opening a sslmode=require connection costs a TLS handshake plus Postgres
+# auth, often more than the query itself. Both the API and the dashboard
+# borrow connections from a per-process, size-bounded pool instead:
+#   DB_POOL_MAX_SIZE          - connections open at most
+#   DB_POOL_MAX_LIFETIME      - seconds after which a connection is recycled
+#   DB_POOL_ACQUIRE_TIMEOUT   - seconds to wait for a free connection
+#   DB_POOL_HEALTH_CHECK_IDLE - idle seconds after which a connection is
+#                               pinged before being handed out
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the acquisition timeout."""
+
+
+class PoolMetrics:
+    """Acquisition counters shared by the sync and async pools."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.connects = 0
+        self.recycled = 0
+        self.health_check_failures = 0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.acquisitions += 1
+                self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "acquire_timeouts": self.timeouts,
+                "avg_acquire_wait_ms": round(1000 * self.total_wait / self.acquisitions, 3) if self.acquisitions else 0.0,
+                "max_acquire_wait_ms": round(1000 * self.max_wait, 3),
+                "connects": self.connects,
+                "recycled": self.recycled,
+                "health_check_failures": self.health_check_failures,
+            }
+
+
+class ConnectionPool:
+    """A thread-safe psycopg2 connection pool with health checks and a max lifetime."""
+
+    def __init__(self, dsn: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 max_lifetime: float = DB_POOL_MAX_LIFETIME, acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT,
+                 health_check_idle: float = DB_POOL_HEALTH_CHECK_IDLE):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.health_check_idle = health_check_idle
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()  # (connection, created_at, last_used_at)
+        self._created_at = {}  # id(connection) -> created_at, for connections in use
+        self._lock = threading.Lock()
+        self.metrics = PoolMetrics()
+        for _ in range(min(min_size, max_size)):
+            conn = self._connect()
+            self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self.metrics.count("connects")
+        return conn
+
+    def _is_usable(self, conn, created_at: float, last_used_at: float) -> bool:
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - created_at > self.max_lifetime:
+            self.metrics.count("recycled")
+            return False
+        if now - last_used_at > self.health_check_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                self.metrics.count("health_check_failures")
+                return False
+        return True
+
+    def getconn(self):
+        """Borrows a connection, waiting up to acquire_timeout for a free slot."""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.metrics.record_wait(time.monotonic() - started, timed_out=True)
+            raise PoolTimeout(f"No database connection available within {self.acquire_timeout}s.")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn, created_at = self._connect(), time.monotonic()
+                    break
+                conn, created_at, last_used_at = entry
+                if self._is_usable(conn, created_at, last_used_at):
+                    break
+                _close_quietly(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._created_at[id(conn)] = created_at
+        self.metrics.record_wait(time.monotonic() - started)
+        return conn
+
+    def putconn(self, conn, broken: bool = False):
+        """Returns a connection; unfinished transactions are rolled back."""
+        with self._lock:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        try:
+            if not broken and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, created_at, time.monotonic()))
+                return
+        except psycopg2.Error:
+            pass
+        finally:
+            self._slots.release()
+        _close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """`with pool.connection() as conn:` borrows a connection for the block."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle, in_use = len(self._idle), len(self._created_at)
+        return {"idle": idle, "in_use": in_use, "max_size": self.max_size, **self.metrics.snapshot()}
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                _close_quietly(self._idle.pop()[0])
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: str) -> ConnectionPool:
+    """Returns the process-wide pool for a database URL, creating it on first use."""
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = _pools[dsn] = ConnectionPool(dsn)
+    return pool
+
+
+def close_pools():
+    """Closes the idle connections of every pool; used at shutdown."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+
+# --- ASYNC POOL METRICS ---
+# The async /chat path uses an asyncpg pool; acquiring through this helper
+# applies the same timeout and records the same metrics.
+ASYNC_POOL_METRICS = PoolMetrics()
+
+
+@asynccontextmanager
+async def acquire_async(pool):
+    started = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        ASYNC_POOL_METRICS.record_wait(time.monotonic() - started, timed_out=True)
+        raise PoolTimeout(f"No database connection available within {DB_POOL_ACQUIRE_TIMEOUT}s.")
+    ASYNC_POOL_METRICS.record_wait(time.monotonic() - started)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def get_pool_stats() -> dict:
+    """Returns the metrics of every pool in this process."""
+    stats = {"async": {**ASYNC_POOL_METRICS.snapshot()}}
+    with _pools_lock:
+        pools = list(_pools.values())
+    for i, pool in enumerate(pools):
+        stats["sync" if i == 0 else f"sync_{i}"] = pool.stats()
+    return stats
+# --- END OF SHARED CONNECTION POOL ---
@@ -1,17 +1,69 @@
 # document_processor.py (Final, Decoupled Version)
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
 import requests
-from bs4 import BeautifulSoup
-from pypdf import PdfReader
-from sentence_transformers import SentenceTransformer
+
+import embedding_batcher
+import startup
+
+# Heavy imports are deferred until first use; see startup.py.
+bs4 = startup.lazy_module("bs4")
+pypdf = startup.lazy_module("pypdf")
+sentence_transformers = startup.lazy_module("sentence_transformers")
 
 # --- NEW: Singleton pattern for loading the model ---
 # We will store the loaded model in this global variable.
 EMBEDDING_MODEL = None
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
-def load_embedding_model():
-    """Loads the sentence transformer model."""
-    print("Loading embedding model...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+# The embedding backend is chosen by EMBEDDING_BACKEND:
+#   torch     - full-precision PyTorch (default)
+#   onnx      - the same weights run by ONNX Runtime
+#   onnx-int8 - ONNX Runtime with dynamically quantized int8 weights, exported
+#               once into EMBEDDING_MODEL_DIR for EMBEDDING_ONNX_QUANTIZATION
+#               (arm64, avx2, avx512 or avx512_vnni, matching the CPU)
+# int8 vectors differ slightly from fp32 ones; benchmarks/embedding_backends.py
+# measures how far retrieval results agree. Since cached embeddings are keyed
+# by EMBEDDING_MODEL_ID (which includes the quantization config for int8),
+# switching backends never mixes cached vectors.
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_QUANTIZATION = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "avx2")
+EMBEDDING_MODEL_DIR = os.getenv("EMBEDDING_MODEL_DIR", os.path.join("data", "models"))
+if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+    raise ValueError(f"EMBEDDING_BACKEND must be one of {EMBEDDING_BACKENDS}, not {EMBEDDING_BACKEND!r}.")
+if EMBEDDING_BACKEND == "torch":
+    EMBEDDING_MODEL_ID = EMBEDDING_MODEL_NAME
+elif EMBEDDING_BACKEND == "onnx-int8":
+    # Each quantization config exports a different model.
+    EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}:{EMBEDDING_ONNX_QUANTIZATION}"
+else:
+    EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}"
+
+def _load_quantized_onnx_model(quantization: str):
+    model_dir = os.path.join(EMBEDDING_MODEL_DIR, f"{EMBEDDING_MODEL_NAME}-onnx")
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        print(f"Exporting int8 ONNX embedding model ({quantization}) to {model_dir}...")
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx")
+        model.save(model_dir)
+        sentence_transformers.export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    return sentence_transformers.SentenceTransformer(model_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+def load_embedding_model(backend: str = None):
+    """Loads the sentence transformer model with the configured backend."""
+    backend = backend or EMBEDDING_BACKEND
+    print(f"Loading embedding model ({backend})...")
+    if backend == "onnx-int8":
+        model = _load_quantized_onnx_model(EMBEDDING_ONNX_QUANTIZATION)
+    elif backend == "onnx":
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx")
+    else:
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME)
     print("Embedding model loaded.")
     return model
 
@@ -26,51 +78,189 @@ def get_embedding_model():
     return EMBEDDING_MODEL
 # --- END OF NEW SECTION ---
 
+# --- QUERY EMBEDDING CACHE ---
+# Chat questions repeat a lot ("what are your opening hours?"), so their
+# embeddings are cached by normalized text. The model is uncased, so folding
+# case and whitespace doesn't change the embedding.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+
+
+class QueryEmbeddingCache:
+    """A thread-safe LRU cache of query embeddings with a time-to-live."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # normalized text -> (expires_at, float32 vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def embed_query(text: str) -> np.ndarray:
+    """
+    Returns the float32 embedding of a single chat question, served from the
+    query cache when possible. The returned array is shared and read-only.
+    """
+    key = normalize_query(text)
+    vector = QUERY_EMBEDDING_CACHE.get(key)
+    if vector is None:
+        # Copy the row so the cache entry owns exactly one vector's memory.
+        vector = encode_texts([key])[0].copy()
+        vector.setflags(write=False)
+        QUERY_EMBEDDING_CACHE.put(key, vector)
+    return vector
+
+
+def get_query_embedding_cache_stats() -> dict:
+    """Returns hit-rate counters for the query embedding cache."""
+    return QUERY_EMBEDDING_CACHE.stats()
+# --- END OF QUERY EMBEDDING CACHE ---
+
+# Reused across scrapes so repeated requests to a site share connections.
+HTTP_SESSION = requests.Session()
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+
+def soup_to_text(soup) -> str:
+    """Returns the visible text of a parsed HTML page, one phrase per line."""
+    for script_or_style in soup(['script', 'style']):
+        script_or_style.decompose()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
 def get_text_from_url(url: str) -> str:
     """Scrapes text content from a given URL."""
     try:
-        response = requests.get(url)
+        response = HTTP_SESSION.get(url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for script_or_style in soup(['script', 'style']):
-            script_or_style.decompose()
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        return text
+        return soup_to_text(bs4.BeautifulSoup(response.text, 'html.parser'))
     except requests.exceptions.RequestException as e:
         print(f"Error scraping URL {url}: {e}")
         return ""
 
-def get_text_from_pdf(file_path: str) -> str:
-    """Extracts text from a PDF file."""
+def iter_pdf_pages(file_path: str):
+    """
+    Yields the text of a PDF one page at a time (each followed by a newline),
+    so a large document is never held in memory as a whole.
+    """
     try:
-        reader = PdfReader(file_path)
-        text = ""
+        reader = pypdf.PdfReader(file_path)
         for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+            yield (page.extract_text() or "") + "\n"
     except Exception as e:
         print(f"Error reading PDF {file_path}: {e}")
-        return ""
+
+def get_text_from_pdf(file_path: str) -> str:
+    """Extracts text from a PDF file."""
+    return "".join(iter_pdf_pages(file_path))
+
+def iter_chunks(pieces, chunk_size: int = 500, chunk_overlap: int = 50):
+    """
+    Splits a stream of text pieces (e.g. PDF pages) into overlapping chunks,
+    carrying the overlap across piece boundaries. Produces exactly the chunks
+    chunk_text() would for the concatenated text, while only buffering the
+    current piece plus one partial chunk.
+    """
+    step = chunk_size - chunk_overlap
+    buffer, start = "", 0
+    for piece in pieces:
+        buffer = buffer[start:] + piece
+        start = 0
+        while len(buffer) - start > chunk_size:
+            yield buffer[start:start + chunk_size]
+            start += step
+    if start < len(buffer):
+        yield buffer[start:]
 
 def chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> list[str]:
     """Splits text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        if end >= len(text):
-            break
-        start += chunk_size - chunk_overlap
-    return chunks
+    return list(iter_chunks([text], chunk_size, chunk_overlap))
+
+def iter_embedding_batches(chunks, batch_size: int = 512, embed=None):
+    """
+    Groups a stream of chunks into batches and yields (texts, embeddings)
+    pairs, so embedding starts before the whole document has been parsed.
+    `embed` maps a batch to (texts, embeddings) and may drop chunks (see
+    embedding_cache.ChunkDeduplicator); by default every chunk is encoded.
+    """
+    embed = embed or (lambda batch: (batch, encode_texts(batch)))
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            texts, embeddings = embed(batch)
+            if texts:
+                yield texts, embeddings
+            batch = []
+    if batch:
+        texts, embeddings = embed(batch)
+        if texts:
+            yield texts, embeddings
+
+# --- EMBEDDING BATCHER ---
+# Every encode call (chat questions and ingestion alike) goes through one
+# micro-batching queue, so concurrent requests share forward passes.
+def _encode_batch(texts: list[str]):
+    model = get_embedding_model()
+    return model.encode(texts, convert_to_tensor=False, batch_size=embedding_batcher.EMBEDDING_MAX_BATCH_SIZE)
+
+EMBEDDING_BATCHER = embedding_batcher.EmbeddingBatcher(_encode_batch)
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    """Encodes texts through the shared batcher and returns a float32 array."""
+    return EMBEDDING_BATCHER.encode(list(texts))
+
+def get_embedding_batcher_stats() -> dict:
+    """Returns queue depth and batch size metrics of the embedding batcher."""
+    return EMBEDDING_BATCHER.stats()
+# --- END OF EMBEDDING BATCHER ---
 
 def generate_embeddings(texts: list[str]) -> list:
     """Generates embeddings for a list of text chunks."""
-    # Now it calls our new function to get the model
-    model = get_embedding_model()
-    embeddings = model.encode(texts, convert_to_tensor=False)
-    return embeddings.tolist()
\ No newline at end of file
+    return encode_texts(texts).tolist()
\ No newline at end of file
@@ -0,0 +1,145 @@
+# embedding_batcher.py
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Under concurrency, many requests each encode a single question. A batch of
+# 32 texts costs about as much as a few single ones, so concurrent encode
+# calls are queued, collected for up to EMBEDDING_BATCH_WAIT_MS or until
+# EMBEDDING_MAX_BATCH_SIZE texts are waiting, and run as one batched call.
+# Small (interactive) requests are always taken before bulk ingestion
+# slices, so a chat question never waits behind a whole document upload.
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "2"))
+INTERACTIVE_MAX_TEXTS = 4
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Request:
+    __slots__ = ("texts", "enqueued_at", "done", "result", "error")
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent encode calls into batched calls of encode_fn."""
+
+    def __init__(self, encode_fn, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE, max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._interactive = deque()
+        self._bulk = deque()
+        self._queued_texts = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.max_queue_depth = 0
+        self.batch_size_histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.total_queue_wait = 0.0
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Encodes texts through the shared batch queue; returns a float32 array."""
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        # Bulk requests are split so interactive ones can slip in between slices.
+        requests = [_Request(texts[i:i + self.max_batch_size]) for i in range(0, len(texts), self.max_batch_size)]
+        with self._cond:
+            self._ensure_worker()
+            queue = self._interactive if len(texts) <= INTERACTIVE_MAX_TEXTS else self._bulk
+            queue.extend(requests)
+            self._queued_texts += len(texts)
+            self.max_queue_depth = max(self.max_queue_depth, self._queued_texts)
+            self._cond.notify()
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return requests[0].result if len(requests) == 1 else np.concatenate([r.result for r in requests])
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so a forked worker process starts its own.
+        if self._worker is None or self._worker_pid != os.getpid() or not self._worker.is_alive():
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> list[_Request]:
+        """Waits for work, then collects requests until the batch is full or the window closes."""
+        with self._cond:
+            while not self._interactive and not self._bulk:
+                self._cond.wait()
+            oldest = self._interactive[0] if self._interactive else self._bulk[0]
+            deadline = oldest.enqueued_at + self.max_wait
+            while self._queued_texts < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, size = [], 0
+            for queue in (self._interactive, self._bulk):
+                while queue and (not batch or size + len(queue[0].texts) <= self.max_batch_size):
+                    request = queue.popleft()
+                    batch.append(request)
+                    size += len(request.texts)
+            self._queued_texts -= size
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            texts = [text for request in batch for text in request.texts]
+            started = time.monotonic()
+            try:
+                embeddings = np.asarray(self.encode_fn(texts), dtype='float32')
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            offset = 0
+            for request in batch:
+                # A copy, so a result kept (e.g. in a cache) doesn't pin the whole batch array.
+                request.result = embeddings[offset:offset + len(request.texts)].copy()
+                offset += len(request.texts)
+                request.done.set()
+            with self._cond:
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(texts)
+                self.total_queue_wait += sum(started - r.enqueued_at for r in batch)
+                self.batch_size_histogram[_bucket(len(texts))] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                "queue_depth": self._queued_texts,
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "requests": self.requests,
+                "texts": self.texts,
+                "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "avg_queue_wait_ms": round(1000 * self.total_queue_wait / self.requests, 3) if self.requests else 0.0,
+                "batch_size_histogram": dict(zip(labels, self.batch_size_histogram)),
+            }
+
+
+def _bucket(size: int) -> int:
+    for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+        if size <= bound:
+            return i
+    return len(BATCH_SIZE_BUCKETS)
@@ -0,0 +1,203 @@
+# embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# --- CONTENT-ADDRESSED EMBEDDING CACHE ---
+# Re-uploading an updated brochure or re-scraping a page mostly produces
+# chunks that are already in the knowledge base. Every chunk is identified by
+# the SHA-256 of its text:
+#   - chunk_hashes holds, per business, the hashes already in its index, so a
+#     chunk is never inserted twice;
+#   - embeddings maps (model, hash) to the embedding, so a chunk seen before
+#     (by any business, or before a rebuild) is never embedded again.
+# Both live in one SQLite file shared by the API and the dashboard.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chunk_hashes (
+    business_id TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    PRIMARY KEY (business_id, hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS seeded_businesses (
+    business_id TEXT PRIMARY KEY
+);
+"""
+# SQLite limits the number of bound parameters per statement.
+LOOKUP_BATCH_SIZE = 500
+
+
+def chunk_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _select(self, sql: str, prefix: tuple, hashes: list[bytes]) -> list:
+        rows = []
+        conn = self._connection()
+        for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[i:i + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(conn.execute(sql.format(placeholders=placeholders), (*prefix, *batch)).fetchall())
+        return rows
+
+    def get_embeddings(self, model: str, hashes: list[bytes]) -> dict:
+        """Returns {hash: float32 vector} for the hashes that are cached."""
+        with self._lock:
+            rows = self._select("SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                                (model,), hashes)
+        return {bytes(h): np.frombuffer(vector, dtype='float32') for h, vector in rows}
+
+    def put_embeddings(self, model: str, hashes: list[bytes], embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype='float32')
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                                 [(model, h, vector.tobytes()) for h, vector in zip(hashes, embeddings)])
+
+    def known_hashes(self, business_id: str, hashes: list[bytes]) -> set:
+        """Returns the subset of hashes already in the business's knowledge base."""
+        with self._lock:
+            rows = self._select("SELECT hash FROM chunk_hashes WHERE business_id = ? AND hash IN ({placeholders})",
+                                (business_id,), hashes)
+        return {bytes(h) for (h,) in rows}
+
+    def add_business_hashes(self, business_id: str, hashes: list[bytes]):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO chunk_hashes (business_id, hash) VALUES (?, ?)",
+                                 [(business_id, h) for h in hashes])
+
+    def seed_business(self, business_id: str, iter_texts):
+        """
+        Records the hashes of a knowledge base that predates this cache, once,
+        so its existing chunks are recognised as duplicates too.
+        """
+        with self._lock:
+            seeded = self._connection().execute(
+                "SELECT 1 FROM seeded_businesses WHERE business_id = ?", (business_id,)).fetchone()
+        if seeded:
+            return
+        self.add_business_hashes(business_id, [chunk_hash(text) for text in iter_texts()])
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO seeded_businesses (business_id) VALUES (?)", (business_id,))
+
+    def forget_business(self, business_id: str):
+        """Forgets which chunks a business has, e.g. after its index was deleted."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM chunk_hashes WHERE business_id = ?", (business_id,))
+                conn.execute("DELETE FROM seeded_businesses WHERE business_id = ?", (business_id,))
+
+    def count(self, name: str, n: int):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "duplicates_skipped": self.duplicates,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+EMBEDDING_CACHE = EmbeddingCache()
+
+
+class ChunkDeduplicator:
+    """
+    Filters and embeds the chunks of one ingestion run for one business.
+    Chunks already in the knowledge base (or earlier in this run) are
+    dropped; the rest are embedded from the cache where possible and with
+    encode_fn otherwise. Call commit() once the new chunks are in the index.
+    """
+
+    def __init__(self, business_id: str, model: str, encode_fn, cache: EmbeddingCache = EMBEDDING_CACHE):
+        self.business_id = business_id
+        self.model = model
+        self.encode_fn = encode_fn
+        self.cache = cache
+        self._seen = set()
+        self._new_hashes = []
+        self.duplicates = 0
+        self.reused = 0
+        self.embedded = 0
+
+    def embed(self, chunks: list[str]) -> tuple[list[str], np.ndarray]:
+        """Returns (new chunks, their embeddings) for a batch of chunks."""
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        known = self.cache.known_hashes(self.business_id, hashes)
+        texts, new_hashes = [], []
+        for chunk, h in zip(chunks, hashes):
+            if h in known or h in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(h)
+            texts.append(chunk)
+            new_hashes.append(h)
+        if not texts:
+            return [], np.zeros((0, 0), dtype='float32')
+
+        cached = self.cache.get_embeddings(self.model, new_hashes)
+        missing = [i for i, h in enumerate(new_hashes) if h not in cached]
+        computed = {}
+        if missing:
+            vectors = np.asarray(self.encode_fn([texts[i] for i in missing]), dtype='float32')
+            missing_hashes = [new_hashes[i] for i in missing]
+            self.cache.put_embeddings(self.model, missing_hashes, vectors)
+            computed = dict(zip(missing_hashes, vectors))
+        embeddings = np.stack([cached[h] if h in cached else computed[h] for h in new_hashes])
+
+        self.reused += len(texts) - len(missing)
+        self.embedded += len(missing)
+        self.cache.count("hits", len(texts) - len(missing))
+        self.cache.count("misses", len(missing))
+        self.cache.count("duplicates", len(chunks) - len(texts))
+        self._new_hashes.extend(new_hashes)
+        return texts, embeddings
+
+    def commit(self):
+        """Records the new chunks as part of the business's knowledge base."""
+        self.cache.add_business_hashes(self.business_id, self._new_hashes)
+        self._new_hashes = []
+
+
+def get_embedding_cache_stats() -> dict:
+    """Returns reuse counters for the persistent embedding cache."""
+    return EMBEDDING_CACHE.stats()
+# --- END OF CONTENT-ADDRESSED EMBEDDING CACHE ---
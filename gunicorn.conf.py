@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+# Production entry point for the API:
+#
+#     gunicorn main:app
+#
+# The app is imported once in the master (preload_app) with STARTUP_MODE=preload,
+# so the embedding model and the WARM_BUSINESS_IDS indexes are loaded before
+# the workers fork and their memory is shared copy-on-write. Each worker then
+# warms up (one embedding, one search per hot tenant) before it accepts traffic.
+import os
+
+os.environ.setdefault("STARTUP_MODE", "preload")
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ["STARTUP_MODE"] == "preload"
+# Warm-up can take a while on a cold disk; don't let the master kill the worker for it.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s forked (STARTUP_MODE=%s)", worker.pid, os.environ["STARTUP_MODE"])
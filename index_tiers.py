@@ -0,0 +1,99 @@
+# index_tiers.py
+import math
+import os
+
+import numpy as np
+
+import startup
+
+faiss = startup.lazy_module("faiss")
+
+# Exact search is cheapest for small tenants, but its cost grows linearly
+# with the corpus. Larger segments are built as approximate indexes instead:
+#   flat  - IndexFlatL2, exact             (up to FLAT_MAX_VECTORS)
+#   hnsw  - IndexHNSWFlat, graph search    (up to HNSW_MAX_VECTORS)
+#   ivfpq - IndexIVFPQ, compressed vectors (everything larger)
+# The search-time knobs (nprobe for IVF, efSearch for HNSW) can be tuned per
+# business and are stored in its manifest.
+FLAT_MAX_VECTORS = int(os.getenv("FLAT_MAX_VECTORS", "50000"))
+HNSW_MAX_VECTORS = int(os.getenv("HNSW_MAX_VECTORS", "1000000"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+IVF_TRAINING_SAMPLE = int(os.getenv("IVF_TRAINING_SAMPLE", "200000"))
+PQ_BITS = 8
+# faiss wants ~39 training points per centroid; the PQ codebooks have
+# 2**PQ_BITS centroids each, so smaller segments fall back to HNSW.
+IVF_MIN_TRAINING_POINTS = 39 * 2 ** PQ_BITS
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+DEFAULT_SEARCH_PARAMS = {"nprobe": 16, "efSearch": 64}
+
+
+def choose_index_type(num_vectors: int) -> str:
+    """Picks the index tier for a segment of the given size."""
+    if num_vectors <= FLAT_MAX_VECTORS:
+        return "flat"
+    if num_vectors <= HNSW_MAX_VECTORS:
+        return "hnsw"
+    return "ivfpq"
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest of the usual PQ sizes that divides the dimension (384 -> 48)."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dimension % m == 0 and dimension // m >= 8:
+            return m
+    return 1
+
+
+def build_index(vectors: np.ndarray, index_type: str = None):
+    """
+    Builds (and, for IVF-PQ, trains) an index over the given float32 vectors.
+    The tier is chosen from the number of vectors unless index_type is given.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    n, d = vectors.shape
+    index_type = index_type or choose_index_type(n)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+    if index_type == "ivfpq" and n < IVF_MIN_TRAINING_POINTS:
+        print(f"IVF-PQ needs at least {IVF_MIN_TRAINING_POINTS} vectors to train well, got {n}; building HNSW instead.")
+        index_type = "hnsw"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        # Aim for ~4*sqrt(n) lists, but never fewer training points than faiss
+        # needs (39 per centroid) to avoid degenerate clusters.
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_subquantizers(d), PQ_BITS)
+        if n > IVF_TRAINING_SAMPLE:
+            sample = vectors[np.random.default_rng(0).choice(n, IVF_TRAINING_SAMPLE, replace=False)]
+        else:
+            sample = vectors
+        index.train(sample)
+
+    if n:
+        index.add(vectors)
+    return index
+
+
+def index_type_of(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+
+def apply_search_params(index, params: dict = None):
+    """Sets nprobe / efSearch on an index; exact indexes ignore them."""
+    params = {**DEFAULT_SEARCH_PARAMS, **(params or {})}
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = int(params["nprobe"])
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = int(params["efSearch"])
@@ -0,0 +1,151 @@
+# ingestion_pipeline.py
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import document_processor
+import embedding_cache
+import vector_store_manager
+
+# Ingests many sources in one go instead of one file at a time:
+#   1. extract text from all sources in a process pool (PDF parsing is CPU-bound),
+#   2. stream the text through the chunker into embedding batches, so the
+#      model is busy while later pages are still being chunked (with a
+#      single source, pages are parsed lazily and never held as one string),
+#   3. skip chunks the business already has and reuse cached embeddings
+#      (see embedding_cache.py), so only genuinely new text is embedded,
+#   4. write each embedded batch straight into a pending segment on disk and
+#      publish it once at the end, so the upload is still ONE atomic index
+#      update while memory stays flat however large the documents are.
+# With several files, each worker writes its extracted text to a file in a
+# temporary directory that is read back in pieces, never as one string.
+# Progress is reported through a callback as (stage, done, total).
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", str(os.cpu_count() or 1)))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "512"))
+TEXT_READ_SIZE = 1 << 16
+
+
+def iter_source_text(source: dict):
+    """
+    Yields the raw text of one source in pieces. A source is a dict with a
+    "kind" of "pdf" or "text" and a "path", or a "kind" of "raw" and the
+    "text" itself (scraped pages, pasted text).
+    """
+    if source["kind"] == "raw":
+        yield source["text"]
+        return
+    if source["kind"] == "pdf":
+        yield from document_processor.iter_pdf_pages(source["path"])
+        return
+    with open(source["path"], 'r', encoding='utf-8', errors='replace') as f:
+        while piece := f.read(TEXT_READ_SIZE):
+            yield piece
+
+
+def extract_source(source: dict, directory: str) -> str:
+    """
+    Extracts the text of one source into a temporary file in `directory` and
+    returns its path. Runs in a worker process, so it must stay a top-level
+    function.
+    """
+    fd, path = tempfile.mkstemp(suffix=".txt", dir=directory)
+    with open(fd, 'w', encoding='utf-8') as f:
+        for piece in iter_source_text(source):
+            f.write(piece)
+    return path
+
+
+def _extract_all(sources: list[dict], max_workers: int, progress, directory: str) -> list:
+    """Returns one iterable of text pieces per source."""
+    if max_workers <= 1 or sum(source["kind"] != "raw" for source in sources) <= 1:
+        # Extraction happens lazily while the chunks are consumed.
+        return [iter_source_text(source) for source in sources]
+
+    texts = [None] * len(sources)
+    # "spawn" keeps the workers independent of the threads running in this process.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(sources)), mp_context=context) as pool:
+        futures = {pool.submit(extract_source, source, directory): i for i, source in enumerate(sources)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                texts[i] = iter_source_text({"kind": "text", "path": future.result()})
+            except Exception as e:
+                print(f"Error extracting {sources[i].get('name', sources[i].get('path'))}: {e}")
+                texts[i] = []
+            progress("extract", done, len(sources))
+    return texts
+
+
+def ingest_sources(business_id: str, sources: list[dict], progress=None,
+                   max_workers: int = INGEST_MAX_WORKERS, embed_batch_size: int = INGEST_EMBED_BATCH_SIZE) -> dict:
+    """
+    Runs the whole pipeline for a batch of sources and returns a summary with
+    per-stage timings and throughput in chunks per second.
+    """
+    progress = progress or (lambda stage, done, total: None)
+    timings = {}
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix="ingest-") as extract_dir:
+        source_texts = _extract_all(sources, max_workers, progress, extract_dir)
+        timings["extract_seconds"] = time.perf_counter() - started
+
+        empty_sources = 0
+
+        def iter_all_chunks():
+            nonlocal empty_sources
+            for done, pieces in enumerate(source_texts, start=1):
+                produced = 0
+                for chunk in document_processor.iter_chunks(pieces):
+                    if chunk.strip():
+                        produced += 1
+                        yield chunk
+                empty_sources += produced == 0
+                progress("embed", done, len(source_texts))
+
+        embedding_dim = document_processor.get_embedding_model().get_sentence_embedding_dimension()
+        store = vector_store_manager.create_or_load_faiss_index(business_id, embedding_dimension=embedding_dim)
+        if store.ntotal == 0:
+            # The knowledge base is empty (new or deleted), so it holds no chunks either.
+            embedding_cache.EMBEDDING_CACHE.forget_business(business_id)
+        embedding_cache.EMBEDDING_CACHE.seed_business(business_id, store.iter_texts)
+        dedup = embedding_cache.ChunkDeduplicator(business_id, document_processor.EMBEDDING_MODEL_ID,
+                                                  document_processor.encode_texts)
+
+        # Chunking, embedding and (for a single source) parsing are interleaved
+        # here; each batch goes to disk before the next one is embedded.
+        stage_started = time.perf_counter()
+        pending = vector_store_manager.begin_segment(business_id)
+        chunk_count = 0
+        try:
+            for batch, embeddings in document_processor.iter_embedding_batches(iter_all_chunks(), embed_batch_size, dedup.embed):
+                pending.add(embeddings, batch)
+                chunk_count += len(batch)
+            timings["embed_seconds"] = time.perf_counter() - stage_started
+
+            stage_started = time.perf_counter()
+            vector_store_manager.publish_segment(business_id, pending, store)
+        except BaseException:
+            pending.abort()
+            raise
+        if chunk_count:
+            dedup.commit()
+        progress("commit", 1, 1)
+        timings["commit_seconds"] = time.perf_counter() - stage_started
+
+    total_seconds = time.perf_counter() - started
+    return {
+        "sources": len(sources),
+        "empty_sources": empty_sources,
+        "chunks": chunk_count,
+        "duplicate_chunks": dedup.duplicates,
+        "reused_embeddings": dedup.reused,
+        "embedded_chunks": dedup.embedded,
+        **{name: round(seconds, 3) for name, seconds in timings.items()},
+        "total_seconds": round(total_seconds, 3),
+        "chunks_per_second": round(chunk_count / total_seconds, 1) if total_seconds else 0.0,
+        "embed_chunks_per_second": round(dedup.embedded / timings["embed_seconds"], 1) if timings["embed_seconds"] else 0.0,
+    }
@@ -1,7 +1,15 @@
+import asyncio
 import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
 from typing import List, Dict
+
+import groq
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq, Groq
 
 # This part is for the FastAPI backend (main.py) to load its key
 # It will be ignored by the Streamlit app, which is what we want.
@@ -9,7 +17,181 @@ if os.path.exists('.env'):
     load_dotenv()
 BACKEND_GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-def generate_response_with_groq(messages: List[Dict], api_key: str, model: str = "openai/gpt-oss-120b") -> str:
+# Failed calls return this apology instead of raising, so callers that cache
+# answers need a way to tell the two apart.
+ERROR_RESPONSE_PREFIX = "Sorry, there was an error communicating with the AI model"
+
+def is_error_response(text: str) -> bool:
+    return text.startswith(ERROR_RESPONSE_PREFIX)
+
+class StreamFailure(str):
+    """
+    The apology a stream yields when it fails, possibly after some tokens.
+    Callers must check the type rather than the text, since the apology can
+    follow a partial answer.
+    """
+
+def failed_stream_answer(partial: str, failure: str) -> str:
+    """The text to log for a stream that failed; is_error_response() holds for it."""
+    if not partial:
+        return failure
+    return f"{failure}\n[partial answer before the failure]\n{partial}"
+
+# --- SHARED CLIENTS, CONCURRENCY LIMIT AND RETRIES ---
+# One client per API key (and base URL) is shared by the whole process, so
+# every call reuses pooled keep-alive connections and TLS sessions. At most
+# LLM_MAX_CONCURRENCY calls are in flight per process (sync and async path
+# each); callers beyond that queue, and the time they wait is recorded.
+# Rate-limit (429), 5xx and connection errors are retried with jittered
+# exponential backoff (honouring Retry-After) as long as the next attempt can
+# still start within LLM_DEADLINE seconds of the call; the queue wait counts
+# towards that deadline. GROQ_BASE_URL points the clients at another
+# OpenAI-compatible server, e.g. benchmarks/fake_llm_server.py.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+DEFAULT_MODEL = "openai/gpt-oss-120b"
+
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+
+class LLMBusyError(Exception):
+    """Raised when no call slot became free before the deadline."""
+
+
+class LLMMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.busy_rejections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.busy_rejections += 1
+            else:
+                self.calls += 1
+                self.total_wait += seconds
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.max_wait = max(self.max_wait, seconds)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "busy_rejections": self.busy_rejections,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "max_concurrency": LLM_MAX_CONCURRENCY,
+                "avg_queue_wait_ms": round(1000 * self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "max_queue_wait_ms": round(1000 * self.max_wait, 3),
+            }
+
+
+LLM_METRICS = LLMMetrics()
+
+
+def _connection_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY)
+
+
+def _retry_delay(error: Exception, attempt: int, remaining: float):
+    """Returns how long to wait before the next attempt, or None to give up."""
+    if attempt >= LLM_MAX_RETRIES:
+        return None
+    delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass  # An HTTP date; the backoff is a fine approximation.
+    return delay if delay < remaining else None
+
+
+def _record_retry(error: Exception):
+    LLM_METRICS.count("retries")
+    if isinstance(error, groq.RateLimitError):
+        LLM_METRICS.count("rate_limited")
+
+
+def get_llm_stats() -> dict:
+    """Returns call, retry and queue-wait counters of the LLM clients."""
+    return LLM_METRICS.snapshot()
+# --- END OF SHARED CLIENTS, CONCURRENCY LIMIT AND RETRIES ---
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+def get_client(api_key: str) -> Groq:
+    key = (api_key, GROQ_BASE_URL)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = Groq(
+                    api_key=api_key, base_url=GROQ_BASE_URL, max_retries=0,
+                    http_client=groq.DefaultHttpxClient(limits=_connection_limits()),
+                )
+    return client
+
+
+@contextmanager
+def _sync_slot(deadline: float):
+    started = time.monotonic()
+    if not _sync_slots.acquire(timeout=max(0.0, deadline - started)):
+        LLM_METRICS.record_wait(time.monotonic() - started, timed_out=True)
+        raise LLMBusyError("Too many concurrent LLM calls; no slot became free before the deadline.")
+    LLM_METRICS.record_wait(time.monotonic() - started)
+    try:
+        yield
+    finally:
+        LLM_METRICS.release()
+        _sync_slots.release()
+
+
+def _create_with_retries(client, deadline: float, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return client.chat.completions.create(timeout=max(0.1, min(LLM_REQUEST_TIMEOUT, deadline - time.monotonic())), **kwargs)
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(e, attempt, deadline - time.monotonic())
+            if delay is None:
+                raise
+            _record_retry(e)
+            time.sleep(delay)
+            attempt += 1
+
+
+def generate_response_with_groq(messages: List[Dict], api_key: str, model: str = DEFAULT_MODEL) -> str:
     """
     Generates a response using Groq's chat completion API.
     Accepts a list of message dictionaries and the API key directly.
@@ -17,20 +199,129 @@ def generate_response_with_groq(messages: List[Dict], api_key: str, model: str =
     if not api_key:
         raise ValueError("Groq API Key is missing.")
 
+    deadline = time.monotonic() + LLM_DEADLINE
     try:
-        # Create a client instance for each request using the provided key.
-        # This is essential for the multi-service setup.
-        client = Groq(api_key=api_key)
-        
-        # Make the API call with the required 'messages' and 'model' arguments.
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=0.7,
-            max_tokens=2048,
-        )
+        with _sync_slot(deadline):
+            chat_completion = _create_with_retries(
+                get_client(api_key), deadline,
+                messages=messages,
+                model=model,
+                temperature=0.7,
+                max_tokens=2048,
+            )
         return chat_completion.choices[0].message.content
     except Exception as e:
+        LLM_METRICS.count("failures")
         print(f"Error calling Groq API: {e}")
         # Provide a more specific error message back to the user
-        return f"Sorry, there was an error communicating with the AI model: {e}"
\ No newline at end of file
+        return f"{ERROR_RESPONSE_PREFIX}: {e}"
+
+# --- ASYNC CLIENT FOR THE API SERVER ---
+# The async chat endpoint shares one AsyncGroq client per API key, so every
+# request reuses the same pooled HTTP connections instead of opening new ones.
+_async_clients = {}
+_async_slots = None
+
+def get_async_client(api_key: str) -> AsyncGroq:
+    key = (api_key, GROQ_BASE_URL)
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients[key] = AsyncGroq(
+            api_key=api_key, base_url=GROQ_BASE_URL, max_retries=0,
+            http_client=groq.DefaultAsyncHttpxClient(limits=_connection_limits()),
+        )
+    return client
+
+@asynccontextmanager
+async def _async_slot(deadline: float):
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(_async_slots.acquire(), timeout=max(0.0, deadline - started))
+    except asyncio.TimeoutError:
+        LLM_METRICS.record_wait(time.monotonic() - started, timed_out=True)
+        raise LLMBusyError("Too many concurrent LLM calls; no slot became free before the deadline.")
+    LLM_METRICS.record_wait(time.monotonic() - started)
+    try:
+        yield
+    finally:
+        LLM_METRICS.release()
+        _async_slots.release()
+
+async def _create_with_retries_async(client, deadline: float, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return await client.chat.completions.create(timeout=max(0.1, min(LLM_REQUEST_TIMEOUT, deadline - time.monotonic())), **kwargs)
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(e, attempt, deadline - time.monotonic())
+            if delay is None:
+                raise
+            _record_retry(e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+async def generate_response_with_groq_async(messages: List[Dict], api_key: str, model: str = DEFAULT_MODEL) -> str:
+    """Async counterpart of generate_response_with_groq, for use on the event loop."""
+    if not api_key:
+        raise ValueError("Groq API Key is missing.")
+
+    deadline = time.monotonic() + LLM_DEADLINE
+    try:
+        async with _async_slot(deadline):
+            chat_completion = await _create_with_retries_async(
+                get_async_client(api_key), deadline,
+                messages=messages,
+                model=model,
+                temperature=0.7,
+                max_tokens=2048,
+            )
+        return chat_completion.choices[0].message.content
+    except Exception as e:
+        LLM_METRICS.count("failures")
+        print(f"Error calling Groq API: {e}")
+        return f"{ERROR_RESPONSE_PREFIX}: {e}"
+
+async def stream_response_with_groq_async(messages: List[Dict], api_key: str, model: str = DEFAULT_MODEL):
+    """
+    Streams the response as it is generated, yielding text deltas. On failure
+    it yields the same apology generate_response_with_groq would return, as a
+    StreamFailure, and stops.
+    Only opening the stream is retried; once tokens flow, an error ends it.
+    """
+    if not api_key:
+        raise ValueError("Groq API Key is missing.")
+
+    deadline = time.monotonic() + LLM_DEADLINE
+    try:
+        async with _async_slot(deadline):
+            stream = await _create_with_retries_async(
+                get_async_client(api_key), deadline,
+                messages=messages,
+                model=model,
+                temperature=0.7,
+                max_tokens=2048,
+                stream=True,
+            )
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            finally:
+                # Hand the pooled connection back now, not when the generator
+                # is garbage collected (e.g. after the client disconnected).
+                await stream.close()
+    except Exception as e:
+        LLM_METRICS.count("failures")
+        print(f"Error calling Groq API: {e}")
+        yield StreamFailure(f"{ERROR_RESPONSE_PREFIX}: {e}")
+
+async def close_async_clients():
+    """Closes the pooled connections; called when the API server shuts down."""
+    for client in _async_clients.values():
+        await client.close()
+    _async_clients.clear()
+# --- END OF ASYNC CLIENT ---
@@ -1,8 +1,17 @@
+import asyncio
+import contextlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncpg
 import psycopg2
 import psycopg2.extras
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -11,12 +20,71 @@ from dotenv import load_dotenv
 # This ensures it reads your secrets when running locally.
 load_dotenv()
 
-# Import our custom modules
+# Import our custom modules. Heavy third-party modules (torch, faiss) are
+# only imported on first use or during startup; see startup.py.
+import startup
 import document_processor
 import vector_store_manager
 import llm_interface
+import answer_cache
+import embedding_cache
+import db_pool
+import chat_log_writer
+import context_packer
+import metrics
+import admission
+import config_cache
 
-app = FastAPI()
+if startup.STARTUP_MODE not in startup.STARTUP_MODES:
+    raise ValueError(f"STARTUP_MODE must be one of {startup.STARTUP_MODES}, not {startup.STARTUP_MODE!r}.")
+if startup.STARTUP_MODE == "preload":
+    # Runs once in the gunicorn master with preload_app, before workers fork.
+    startup.preload()
+    startup.freeze_for_fork()
+
+# --- ASYNC RESOURCES ---
+# Embedding and FAISS search are CPU-bound, so /chat runs them on a small
+# dedicated executor instead of the shared threadpool; the database and the
+# LLM are awaited on the event loop, so one worker can hold many chats.
+RAG_EXECUTOR_WORKERS = int(os.getenv("RAG_EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+ASYNC_DB_POOL_MIN_SIZE = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", "1"))
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", "10"))
+# asyncpg closes connections that sat idle this long. Unlike DB_POOL_MAX_LIFETIME
+# for the psycopg2 pools, it is not a maximum connection age: busy connections
+# are kept open indefinitely.
+ASYNC_DB_POOL_MAX_IDLE = float(os.getenv("ASYNC_DB_POOL_MAX_IDLE", "300"))
+rag_executor = None
+async_db_pool = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global rag_executor, async_db_pool
+    rag_executor = ThreadPoolExecutor(max_workers=RAG_EXECUTOR_WORKERS, thread_name_prefix="rag")
+    async_db_pool = await asyncpg.create_pool(
+        get_database_url(), min_size=ASYNC_DB_POOL_MIN_SIZE, max_size=ASYNC_DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=ASYNC_DB_POOL_MAX_IDLE,
+    )
+    chat_log_writer.start(get_database_url())
+    config_listener = asyncio.create_task(config_cache.listen_for_changes(get_database_url()))
+    if startup.STARTUP_MODE != "lazy":
+        # The worker only starts accepting connections once this returns.
+        await asyncio.get_running_loop().run_in_executor(rag_executor, startup.warm_up)
+    startup.mark_ready()
+    try:
+        yield
+    finally:
+        config_listener.cancel()
+        # Let the listener close its connection before the loop goes away.
+        with contextlib.suppress(asyncio.CancelledError):
+            await config_listener
+        # Drain queued chat logs before the connections go away.
+        await asyncio.get_running_loop().run_in_executor(None, chat_log_writer.stop)
+        await async_db_pool.close()
+        await llm_interface.close_async_clients()
+        db_pool.close_pools()
+        rag_executor.shutdown(wait=True)
+
+app = FastAPI(lifespan=lifespan)
 
 # --- FINAL CORS CONFIG FOR LOCAL DEVELOPMENT ---
 # This explicitly allows connections from a local file ("null") and
@@ -33,10 +101,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the widget read the stage timings, the config version and when to
+    # retry after a 429/503.
+    expose_headers=["Server-Timing", "ETag", "Retry-After"],
 )
 
 # --- DATABASE CONNECTION ---
-def get_db_connection():
+def get_database_url():
     # Reads the database URL directly from your local .env file.
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
@@ -44,82 +115,296 @@ def get_db_connection():
     
     if "sslmode" not in database_url:
         database_url += "?sslmode=require"
-        
-    conn = psycopg2.connect(database_url)
-    return conn
+    return database_url
+
+def db_connection():
+    """Borrows a pooled connection: `with db_connection() as conn:`."""
+    return db_pool.get_pool(get_database_url()).connection()
 
 # --- API ENDPOINTS ---
 @app.get("/config/{business_id}")
-def get_config(business_id: str):
-    """Fetches the configuration for a specific business."""
+def get_config(business_id: str, request: Request, response: Response):
+    """
+    Fetches the configuration for a specific business. Served from the
+    config cache with an ETag; a matching If-None-Match gets a bodyless 304.
+    """
+    timer = metrics.RequestTimer("config", business_id)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute('SELECT * FROM businesses WHERE id = %s', (business_id,))
-        business = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if business is None:
-            raise HTTPException(status_code=404, detail="Business not found")
-        return dict(business)
+        with timer.stage("config_cache"):
+            entry = config_cache.CONFIG_CACHE.get(business_id)
+        if entry is None:
+            generation = config_cache.CONFIG_CACHE.generation
+            started = time.perf_counter()
+            with db_connection() as conn:
+                timer.add("db_acquire", time.perf_counter() - started)
+                with timer.stage("db_query"):
+                    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                    cursor.execute('SELECT * FROM businesses WHERE id = %s', (business_id,))
+                    business = cursor.fetchone()
+                    cursor.close()
+            if business is None:
+                timer.business_id = None
+                raise HTTPException(status_code=404, detail="Business not found")
+            entry = config_cache.CONFIG_CACHE.put(business_id, dict(business), generation)
+        timer.business_known = True
+        headers = {"ETag": entry.etag, "Cache-Control": config_cache.CACHE_CONTROL}
+        if config_cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+            timer.status = 304
+            config_cache.CONFIG_CACHE.count_not_modified()
+            headers["Server-Timing"] = timer.server_timing()
+            return Response(status_code=304, headers=headers)
+        timer.status = 200
+        response.headers.update(headers)
+        response.headers["Server-Timing"] = timer.server_timing()
+        return entry.config
+    except HTTPException as e:
+        timer.status = e.status_code
+        raise
+    except db_pool.PoolTimeout as e:
+        print(f"ERROR in /config endpoint: {e}")
+        timer.status = 503
+        raise HTTPException(status_code=503, detail="Database busy.", headers={"Retry-After": "1"})
     except Exception as e:
         print(f"ERROR in /config endpoint: {e}")
         raise HTTPException(status_code=500, detail="Database connection error.")
+    finally:
+        timer.finish()
 
 class ChatRequest(BaseModel):
     """Defines the structure of a chat request from the frontend."""
     question: str
     businessId: str
 
+NO_CONTEXT_ANSWER = "I'm sorry, but I couldn't find specific information about that in the knowledge base. Is there anything else I can help with?"
+
+PERSONALITY_PROMPTS = {
+    "friendly": "You are a friendly, helpful, and professional customer service AI assistant for the company '{name}'. Your personality should be welcoming and conversational.",
+    "formal": "You are a formal and direct AI assistant for '{name}'. Provide precise information without unnecessary pleasantries.",
+    "concise": "You are a concise AI assistant for '{name}'. Get straight to the point and provide short, clear answers."
+}
+
+def build_messages_payload(business, question: str, retrieved_texts: list[str]) -> list[dict]:
+    """Builds the system and user messages for the LLM from the retrieved context."""
+    context = "\n\n".join(retrieved_texts)
+    system_prompt = PERSONALITY_PROMPTS.get(business['personality'], PERSONALITY_PROMPTS['friendly']).format(name=business['name'])
+    user_prompt_with_context = f"Retrieved Information:\n---\n{context}\n---\n\nUser's Question: {question}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt_with_context}
+    ]
+
+def retrieve(business_id: str, business, question: str, timer: metrics.RequestTimer):
+    """
+    The CPU-bound half of RAG: embeds the question, checks the answer cache and
+    searches the vector store. Runs on the RAG executor as a single hop.
+    Returns (normalized_question, query_embedding, kb_version, cached_answer, retrieved_texts).
+    """
+    with timer.stage("embed"):
+        query_embedding = document_processor.embed_query(question)
+    with timer.stage("index_load"):
+        # Loads the index on an index cache miss; the search below then hits.
+        kb_version = vector_store_manager.get_knowledge_base_version(business_id)
+    with timer.stage("answer_cache"):
+        normalized_question = document_processor.normalize_query(question)
+        cached_answer = answer_cache.get_answer(business_id, business, kb_version, normalized_question, query_embedding)
+    retrieved_texts = []
+    if cached_answer is None:
+        with timer.stage("search"):
+            retrieved_texts = context_packer.retrieve_context(business_id, query_embedding)
+    return normalized_question, query_embedding, kb_version, cached_answer, retrieved_texts
+
+async def fetch_business(business_id: str, timer: metrics.RequestTimer):
+    started = time.perf_counter()
+    async with db_pool.acquire_async(async_db_pool) as conn:
+        timer.add("db_acquire", time.perf_counter() - started)
+        with timer.stage("db_query"):
+            row = await conn.fetchrow('SELECT * FROM businesses WHERE id = $1', business_id)
+    if row is None:
+        return None
+    timer.business_known = True
+    return dict(row)
+
+async def admit(business_id: str, timer: metrics.RequestTimer) -> admission.Ticket:
+    """Passes admission control (see admission.py) or sheds the request with 429/503 and Retry-After."""
+    try:
+        ticket = await admission.ADMISSION.acquire(business_id)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    timer.add("admission", ticket.waited)
+    return ticket
+
 @app.post("/chat")
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, response: Response):
     """Handles an incoming chat message, performs RAG, and returns an AI response."""
+    timer = metrics.RequestTimer("chat", request.businessId)
+    ticket = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute('SELECT * FROM businesses WHERE id = %s', (request.businessId,))
-        business = cursor.fetchone()
-        
+        ticket = await admit(request.businessId, timer)
+        business = await fetch_business(request.businessId, timer)
         if business is None:
+            timer.business_id = None
             raise HTTPException(status_code=404, detail="Business configuration not found")
 
-        # 1. Embed the user's question
-        query_embedding = document_processor.generate_embeddings([request.question])[0]
-        
-        # 2. Retrieve relevant documents from the vector store
-        retrieved_texts = vector_store_manager.search_faiss_index(request.businessId, query_embedding)
+        # 1-2. Embed the user's question and retrieve relevant documents from the vector store
+        loop = asyncio.get_running_loop()
+        normalized_question, query_embedding, kb_version, cached_answer, retrieved_texts = await loop.run_in_executor(
+            rag_executor, retrieve, request.businessId, business, request.question, timer
+        )
 
-        if not retrieved_texts:
-            final_answer = "I'm sorry, but I couldn't find specific information about that in the knowledge base. Is there anything else I can help with?"
+        if cached_answer is not None:
+            final_answer = cached_answer
+        elif not retrieved_texts:
+            final_answer = NO_CONTEXT_ANSWER
         else:
             # 3. Generate a response using the LLM with the retrieved context
-            context = "\n\n".join(retrieved_texts)
-            personality_map = {
-                "friendly": "You are a friendly, helpful, and professional customer service AI assistant for the company '{name}'. Your personality should be welcoming and conversational.",
-                "formal": "You are a formal and direct AI assistant for '{name}'. Provide precise information without unnecessary pleasantries.",
-                "concise": "You are a concise AI assistant for '{name}'. Get straight to the point and provide short, clear answers."
-            }
-            system_prompt = personality_map.get(business['personality'], personality_map['friendly']).format(name=business['name'])
-            user_prompt_with_context = f"Retrieved Information:\n---\n{context}\n---\n\nUser's Question: {request.question}"
-            
-            messages_payload = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt_with_context}
-            ]
-            
+            messages_payload = build_messages_payload(business, request.question, retrieved_texts)
             groq_api_key = os.getenv("GROQ_API_KEY")
-            final_answer = llm_interface.generate_response_with_groq(messages_payload, api_key=groq_api_key)
-
-        # 4. Log the interaction in the database
-        cursor.execute('INSERT INTO chat_logs (business_id, question, answer) VALUES (%s, %s, %s)', (request.businessId, request.question, final_answer))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+            with timer.stage("llm"):
+                final_answer = await llm_interface.generate_response_with_groq_async(messages_payload, api_key=groq_api_key)
+            if not llm_interface.is_error_response(final_answer):
+                answer_cache.put_answer(request.businessId, business, kb_version, normalized_question, query_embedding, final_answer)
+
+        # 4. Queue the interaction for the background log writer
+        with timer.stage("log"):
+            chat_log_writer.log_interaction(request.businessId, request.question, final_answer)
+
+        timer.status = 200
+        response.headers["Server-Timing"] = timer.server_timing()
         return {"answer": final_answer}
+    except HTTPException as e:
+        timer.status = e.status_code
+        raise
+    except db_pool.PoolTimeout as e:
+        print(f"ERROR in /chat endpoint: {e}")
+        timer.status = 503
+        raise HTTPException(status_code=503, detail="Database busy.", headers={"Retry-After": "1"})
     except Exception as e:
         print(f"ERROR in /chat endpoint: {e}")
         raise HTTPException(status_code=500, detail="An internal server error occurred.")
+    finally:
+        if ticket is not None:
+            ticket.release()
+        timer.finish()
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event; JSON keeps newlines in tokens intact."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Same pipeline as /chat, but forwards LLM tokens to the widget as
+    Server-Sent Events ("token" events, then "done") as soon as they arrive.
+    The full answer is queued for logging once the stream has completed.
+    The Server-Timing header can only cover the stages before the stream;
+    the LLM and log stages still reach the histograms.
+    """
+    timer = metrics.RequestTimer("chat_stream", request.businessId)
+    ticket = None
+    streaming = False
+    try:
+        ticket = await admit(request.businessId, timer)
+        business = await fetch_business(request.businessId, timer)
+        if business is None:
+            timer.business_id = None
+            raise HTTPException(status_code=404, detail="Business configuration not found")
+        loop = asyncio.get_running_loop()
+        normalized_question, query_embedding, kb_version, cached_answer, retrieved_texts = await loop.run_in_executor(
+            rag_executor, retrieve, request.businessId, business, request.question, timer
+        )
+        streaming = True
+    except HTTPException as e:
+        timer.status = e.status_code
+        raise
+    except db_pool.PoolTimeout as e:
+        print(f"ERROR in /chat/stream endpoint: {e}")
+        timer.status = 503
+        raise HTTPException(status_code=503, detail="Database busy.", headers={"Retry-After": "1"})
+    except Exception as e:
+        print(f"ERROR in /chat/stream endpoint: {e}")
+        raise HTTPException(status_code=500, detail="An internal server error occurred.")
+    finally:
+        # From here on the stream owns the admission slot and the timer.
+        if not streaming:
+            if ticket is not None:
+                ticket.release()
+            timer.finish()
+
+    async def event_stream():
+        failure = None
+        try:
+            if cached_answer is not None or not retrieved_texts:
+                final_answer = cached_answer if cached_answer is not None else NO_CONTEXT_ANSWER
+                yield sse_event("token", {"text": final_answer})
+            else:
+                messages_payload = build_messages_payload(business, request.question, retrieved_texts)
+                groq_api_key = os.getenv("GROQ_API_KEY")
+                parts = []
+                # Includes the time the client takes to read the tokens.
+                with timer.stage("llm"):
+                    # aclosing() closes the upstream stream as soon as this one stops.
+                    async with contextlib.aclosing(
+                        llm_interface.stream_response_with_groq_async(messages_payload, api_key=groq_api_key)
+                    ) as tokens:
+                        async for token in tokens:
+                            if isinstance(token, llm_interface.StreamFailure):
+                                failure = token
+                            else:
+                                parts.append(token)
+                            yield sse_event("token", {"text": token})
+                if failure is not None:
+                    # Never cache a partial answer; log it marked as failed.
+                    final_answer = llm_interface.failed_stream_answer("".join(parts), failure)
+                else:
+                    final_answer = "".join(parts)
+                    answer_cache.put_answer(request.businessId, business, kb_version, normalized_question, query_embedding, final_answer)
+            yield sse_event("done", {})
+            with timer.stage("log"):
+                chat_log_writer.log_interaction(request.businessId, request.question, final_answer)
+            timer.status = 200 if failure is None else 502
+        except Exception as e:
+            print(f"ERROR in /chat/stream endpoint: {e}")
+            yield sse_event("error", {"detail": "An internal server error occurred."})
+        finally:
+            ticket.release()
+            timer.finish()
+
+    def release():
+        # Also runs when the client leaves before the stream starts, in which
+        # case event_stream's finally never does. Both steps are idempotent.
+        ticket.release()
+        timer.finish()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(release),
+        # Stop proxies from buffering the stream, which would defeat its purpose.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timer.server_timing()},
+    )
+
+@app.get("/stats")
+def get_stats():
+    """Reports in-process cache counters for this worker."""
+    return {
+        "index_cache": vector_store_manager.get_index_cache_stats(),
+        "query_embedding_cache": document_processor.get_query_embedding_cache_stats(),
+        "answer_cache": answer_cache.get_answer_cache_stats(),
+        "embedding_batcher": document_processor.get_embedding_batcher_stats(),
+        "embedding_cache": embedding_cache.get_embedding_cache_stats(),
+        "db_pools": db_pool.get_pool_stats(),
+        "chat_log_writer": chat_log_writer.get_chat_log_writer_stats(),
+        "llm": llm_interface.get_llm_stats(),
+        "context_packer": context_packer.get_context_packer_stats(),
+        "admission": admission.get_admission_stats(),
+        "config_cache": config_cache.get_config_cache_stats(),
+        "startup": startup.get_startup_timings(),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """Per-stage latency histograms and the /stats counters in the Prometheus text format."""
+    return PlainTextResponse(metrics.render_prometheus(get_stats()), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
 
 if __name__ == "__main__":
     print("Starting local backend server on http://0.0.0.0:8000")
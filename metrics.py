@@ -0,0 +1,220 @@
+# metrics.py
+import bisect
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# --- REQUEST METRICS ---
+# Every /chat, /chat/stream and /config request carries a RequestTimer; each
+# stage of the request (pool acquire, query, embedding, answer cache, index
+# load, search, LLM, log enqueue) is timed with timer.stage(...). When the
+# request ends its stage durations go into latency histograms per endpoint,
+# stage and business, which GET /metrics renders in the Prometheus text
+# format together with the /stats counters. The same durations are sent to
+# the browser in a Server-Timing header.
+#   METRICS_MAX_BUSINESSES        - distinct business_id labels; requests for
+#                                   further businesses are counted as "_other".
+#                                   Only businesses found in the database claim
+#                                   a label, so made-up ids can't use them up
+#   METRICS_SLOW_REQUEST_MS       - requests slower than this are logged as
+#                                   one JSON line with their stages (0 = off)
+#   METRICS_SLOW_REQUEST_SAMPLE_RATE - fraction of slow requests to log
+# Metrics are per worker process, like /stats; Prometheus adds the instance.
+METRICS_MAX_BUSINESSES = int(os.getenv("METRICS_MAX_BUSINESSES", "100"))
+METRICS_SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "2000"))
+METRICS_SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("METRICS_SLOW_REQUEST_SAMPLE_RATE", "1.0"))
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; the upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OTHER_BUSINESS = "_other"
+UNKNOWN_BUSINESS = "_unknown"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricRegistry:
+    """Latency histograms and counters keyed by metric name and label values."""
+
+    def __init__(self, max_businesses: int = METRICS_MAX_BUSINESSES):
+        self.max_businesses = max_businesses
+        self._histograms = {}  # (name, labels) -> _Histogram
+        self._counters = {}  # (name, labels) -> count
+        self._businesses = set()
+        self._lock = threading.Lock()
+
+    def business_label(self, business_id: str, claim: bool = True) -> str:
+        """
+        The label for a business. With claim=False (for ids not yet known to
+        exist) no new label slot is taken.
+        """
+        if business_id is None:
+            return UNKNOWN_BUSINESS
+        if business_id in self._businesses:
+            return business_id
+        if not claim:
+            return OTHER_BUSINESS
+        with self._lock:
+            if len(self._businesses) < self.max_businesses:
+                self._businesses.add(business_id)
+                return business_id
+        return OTHER_BUSINESS
+
+    def observe_many(self, observations):
+        """Records (name, labels, seconds) tuples under one lock acquisition."""
+        with self._lock:
+            for name, labels, seconds in observations:
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[(name, labels)] = _Histogram()
+                histogram.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+                histogram.sum += seconds
+                histogram.count += 1
+
+    def inc(self, name: str, labels: tuple, n: int = 1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + n
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return sorted((name, labels, list(h.counts), h.sum, h.count) for (name, labels), h in self._histograms.items())
+
+    def counters(self) -> list:
+        with self._lock:
+            return sorted((name, labels, count) for (name, labels), count in self._counters.items())
+
+
+REGISTRY = MetricRegistry()
+
+METRIC_HELP = {
+    "rag_request_seconds": "Latency of API requests by endpoint, business and status.",
+    "rag_stage_seconds": "Latency of the stages of API requests by endpoint, business and stage.",
+    "rag_admission_shed_total": "Chat requests turned away by admission control, by business and reason.",
+}
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "started")
+
+    def __init__(self, timer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class RequestTimer:
+    """Collects the stage durations of one request; see the section comment."""
+
+    __slots__ = ("endpoint", "business_id", "business_known", "status", "started", "stages", "finished")
+
+    def __init__(self, endpoint: str, business_id: str = None):
+        self.endpoint = endpoint
+        self.business_id = business_id
+        # Set once the business has been found; only then may it claim its own label.
+        self.business_known = False
+        self.status = 500  # until the handler says otherwise
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.finished = False
+
+    def stage(self, name: str) -> _Stage:
+        """`with timer.stage("embed"):` times the block; repeated stages add up."""
+        return _Stage(self, name)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """The stages so far as a Server-Timing header value (milliseconds)."""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+    def finish(self):
+        """Records the request in the histograms and logs it if it was slow; idempotent."""
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self.started
+        business = REGISTRY.business_label(self.business_id, claim=self.business_known)
+        status = str(self.status)
+        observations = [("rag_request_seconds", (("endpoint", self.endpoint), ("business_id", business), ("status", status)), total)]
+        for name, seconds in self.stages.items():
+            observations.append(("rag_stage_seconds", (("endpoint", self.endpoint), ("business_id", business), ("stage", name)), seconds))
+        REGISTRY.observe_many(observations)
+        if (METRICS_SLOW_REQUEST_MS > 0 and total * 1000 >= METRICS_SLOW_REQUEST_MS
+                and random.random() < METRICS_SLOW_REQUEST_SAMPLE_RATE):
+            print(json.dumps({
+                "event": "slow_request",
+                "endpoint": self.endpoint,
+                "business_id": self.business_id,
+                "status": self.status,
+                "total_ms": round(total * 1000, 2),
+                "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+                "pid": os.getpid(),
+            }))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+def _flatten_stats(stats: dict, prefix: str):
+    for key, value in stats.items():
+        name = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(key))}"
+        if isinstance(value, dict):
+            yield from _flatten_stats(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def render_prometheus(stats: dict = None) -> str:
+    """Renders the histograms and counters, and the /stats counters as gauges, in the Prometheus text format."""
+    lines = []
+    current = None
+    for name, labels, counts, total, count in REGISTRY.snapshot():
+        if name != current:
+            current = name
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        label_text = _format_labels(labels)
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+        lines.append(f"{name}_sum{{{label_text}}} {total:.6f}")
+        lines.append(f"{name}_count{{{label_text}}} {count}")
+    current = None
+    for name, labels, count in REGISTRY.counters():
+        if name != current:
+            current = name
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{{{_format_labels(labels)}}} {count}")
+    for name, value in _flatten_stats(stats or {}, "rag"):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+# --- END OF REQUEST METRICS ---
@@ -0,0 +1,509 @@
+# segment_store.py
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+import chunk_store
+import index_tiers
+import startup
+
+faiss = startup.lazy_module("faiss")
+
+# A business's knowledge base is stored as a list of immutable segments:
+#
+#   data/<business_id>/manifest.json
+#   data/<business_id>/segments/seg-000001/faiss_index.bin
+#   data/<business_id>/segments/seg-000001/vectors.npy (raw float32, for rebuilds)
+#   data/<business_id>/segments/seg-000001/chunks.bin, chunks.idx
+#
+# Each upload writes one new segment next to the existing ones and then swaps
+# in a new manifest, so the cost of a write depends only on the size of the
+# batch. Every file is written under a temporary name and renamed into place,
+# so a crash never leaves a half-written segment or manifest behind.
+# Once there are more than COMPACTION_MAX_SEGMENTS segments, a background
+# compaction merges the small trailing ones (size-tiered, so each vector is
+# rewritten only a logarithmic number of times). The large base segment is
+# only rebuilt on request (rebuild_index), which is also where a tenant moves
+# its whole corpus up to an approximate index tier. Large
+# uploads are written batch by batch into a PendingSegment, which streams
+# vectors and chunks to disk and is published in one manifest swap.
+MANIFEST_FILENAME = "manifest.json"
+SEGMENTS_DIRNAME = "segments"
+INDEX_FILENAME = "faiss_index.bin"
+VECTORS_FILENAME = "vectors.npy"
+RAW_VECTORS_FILENAME = "vectors.f32"
+VECTOR_COPY_ROWS = 65536
+COMPACTION_MAX_SEGMENTS = int(os.getenv("COMPACTION_MAX_SEGMENTS", "8"))
+COMPACTION_SIZE_RATIO = float(os.getenv("COMPACTION_SIZE_RATIO", "2"))
+
+# With INDEX_MMAP on (the default), segments are searched through memory
+# mappings instead of private copies, so every worker process serving a
+# tenant shares the same page-cache pages:
+#   - flat segments are searched directly on vectors.npy (np.load with
+#     mmap_mode='r' + faiss.knn), which is exactly what IndexFlatL2 does,
+#   - other tiers are read with IO_FLAG_MMAP, which maps the parts faiss
+#     supports (e.g. IVF inverted lists) and loads the rest as before.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"
+FLAT_FOURCCS = (b"IxF2", b"IxFI")
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+_compactions_running = set()
+
+
+def business_dir(business_id: str) -> str:
+    return os.path.join("data", business_id)
+
+
+def manifest_path(business_id: str) -> str:
+    return os.path.join(business_dir(business_id), MANIFEST_FILENAME)
+
+
+def manifest_key(business_id: str):
+    """Returns a cheap fingerprint of the manifest file, or None if there is no knowledge base yet."""
+    migrate_legacy_layout(business_id)
+    try:
+        st = os.stat(manifest_path(business_id))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _write_lock(business_id: str) -> threading.Lock:
+    with _write_locks_guard:
+        return _write_locks.setdefault(business_id, threading.Lock())
+
+
+def _fsync_dir(path: str):
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_manifest(business_id: str) -> dict:
+    try:
+        with open(manifest_path(business_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": 0, "next_segment": 1, "dimension": None, "segments": []}
+
+
+def _write_manifest(business_id: str, manifest: dict):
+    """Atomically replaces the manifest via temp-file-and-rename."""
+    path = manifest_path(business_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def migrate_legacy_layout(business_id: str):
+    """Adopts a pre-segment faiss_index.bin (plus its chunk store) as the first segment."""
+    base_dir = business_dir(business_id)
+    legacy_index = os.path.join(base_dir, INDEX_FILENAME)
+    if not os.path.exists(legacy_index) or os.path.exists(manifest_path(business_id)):
+        return
+    with _write_lock(business_id):
+        if not os.path.exists(legacy_index) or os.path.exists(manifest_path(business_id)):
+            return
+        chunk_store.migrate_metadata_txt(base_dir)
+        name = "seg-000000"
+        seg_dir = os.path.join(base_dir, SEGMENTS_DIRNAME, name)
+        os.makedirs(seg_dir, exist_ok=True)
+        for filename in (chunk_store.BLOB_FILENAME, chunk_store.OFFSETS_FILENAME):
+            src = os.path.join(base_dir, filename)
+            if os.path.exists(src):
+                os.replace(src, os.path.join(seg_dir, filename))
+        index = faiss.read_index(legacy_index)
+        os.replace(legacy_index, os.path.join(seg_dir, INDEX_FILENAME))
+        _write_manifest(business_id, {
+            "version": 1, "next_segment": 1, "dimension": index.d, "segments": [name],
+        })
+        print(f"Migrated FAISS index for business {business_id} to the segmented layout.")
+
+
+def _read_fourcc(index_path: str) -> bytes:
+    with open(index_path, 'rb') as f:
+        return f.read(4)
+
+
+class Segment:
+    """
+    One immutable batch of vectors and their chunk texts. `nbytes` is the
+    memory private to this process, `mapped_nbytes` the memory-mapped part
+    that all processes share.
+    """
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        self.path = path
+        index_path = os.path.join(path, INDEX_FILENAME)
+        vectors_path = os.path.join(path, VECTORS_FILENAME)
+        self.index = None
+        self._mapped_vectors = None
+        if INDEX_MMAP and _read_fourcc(index_path) in FLAT_FOURCCS and os.path.exists(vectors_path):
+            self._mapped_vectors = np.load(vectors_path, mmap_mode='r')
+            self.index_type = "flat"
+            self.nbytes = 0
+            self.mapped_nbytes = self._mapped_vectors.nbytes
+        else:
+            self.index = _read_index(index_path)
+            self.index_type = index_tiers.index_type_of(self.index)
+            self.nbytes = os.path.getsize(index_path)
+            self.mapped_nbytes = 0
+        self.chunks = chunk_store.ChunkStore(path)
+        if len(self.chunks) != self.ntotal:
+            print(f"Warning: segment {path} has {self.ntotal} vectors but {len(self.chunks)} chunks; "
+                  "results without a chunk will be skipped.")
+
+    @property
+    def ntotal(self) -> int:
+        return len(self._mapped_vectors) if self.index is None else self.index.ntotal
+
+    def search(self, query_np: np.ndarray, k: int):
+        """Returns (distances, ids) like faiss' Index.search."""
+        if self.index is None:
+            return faiss.knn(query_np, self._mapped_vectors, k)
+        return self.index.search(query_np, k)
+
+    def vectors(self) -> np.ndarray:
+        """Returns the exact vectors of this segment (memory-mapped when available)."""
+        if self._mapped_vectors is not None:
+            return self._mapped_vectors
+        vectors_path = os.path.join(self.path, VECTORS_FILENAME)
+        if os.path.exists(vectors_path):
+            return np.load(vectors_path, mmap_mode='r')
+        # Segments written before vectors.npy existed are always flat, which reconstructs exactly.
+        return self.index.reconstruct_n(0, self.ntotal)
+
+
+def _read_index(index_path: str):
+    if INDEX_MMAP:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass  # Not every index type can be mapped.
+    return faiss.read_index(index_path)
+
+
+class SegmentedStore:
+    """
+    The loaded view of a business's knowledge base. Segments are immutable, so
+    refresh() only loads segments it hasn't seen yet and searches can keep
+    using a snapshot of the segment list while it is being replaced.
+    """
+
+    def __init__(self, business_id: str):
+        self.business_id = business_id
+        self.segments = []
+        self.version = 0
+        self.dimension = None
+        self.refresh()
+
+    @property
+    def ntotal(self) -> int:
+        return sum(seg.ntotal for seg in self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(seg.nbytes for seg in self.segments)
+
+    @property
+    def mapped_nbytes(self) -> int:
+        return sum(seg.mapped_nbytes for seg in self.segments)
+
+    def refresh(self):
+        """Brings the segment list in line with the manifest on disk."""
+        migrate_legacy_layout(self.business_id)
+        for attempt in range(2):
+            manifest = read_manifest(self.business_id)
+            loaded = {seg.name: seg for seg in self.segments}
+            try:
+                segments = [
+                    loaded.get(name) or Segment(os.path.join(business_dir(self.business_id), SEGMENTS_DIRNAME, name))
+                    for name in manifest["segments"]
+                ]
+                break
+            except (FileNotFoundError, RuntimeError):
+                # A compaction removed a segment between reading the manifest
+                # and loading it; the new manifest already points past it.
+                if attempt == 1:
+                    raise
+        for seg in segments:
+            index_tiers.apply_search_params(seg.index, manifest.get("search_params"))
+        self.segments = segments
+        self.version = manifest["version"]
+        self.dimension = manifest["dimension"]
+
+    def search(self, query_np: np.ndarray, k: int) -> list[tuple]:
+        """Fans the query out to every segment and merges the global top-k as (distance, segment, local_id)."""
+        hits = []
+        for seg in self.segments:
+            if seg.ntotal == 0:
+                continue
+            D, I = seg.search(query_np, min(k, seg.ntotal))
+            hits.extend((float(d), seg, int(i)) for d, i in zip(D[0], I[0]) if i >= 0)
+        hits.sort(key=lambda hit: hit[0])
+        return hits[:k]
+
+    def iter_texts(self):
+        """Yields every chunk text of the knowledge base, segment by segment."""
+        for seg in self.segments:
+            for i in range(len(seg.chunks)):
+                yield seg.chunks.get(i)
+
+    def append(self, embeddings_np: np.ndarray, texts: list[str]):
+        """Writes a batch as a new segment and publishes it in the manifest."""
+        with _write_lock(self.business_id):
+            manifest = read_manifest(self.business_id)
+            name = f"seg-{manifest['next_segment']:06d}"
+            index = index_tiers.build_index(embeddings_np)
+            _write_segment(self.business_id, name, index, embeddings_np, [texts])
+            manifest["next_segment"] += 1
+            manifest["version"] += 1
+            manifest["dimension"] = embeddings_np.shape[1]
+            manifest["segments"].append(name)
+            _write_manifest(self.business_id, manifest)
+        self.refresh()
+
+
+class PendingSegment:
+    """
+    A segment that is written batch by batch and only becomes visible when
+    publish() adds it to the manifest, so an upload of any size stays a
+    single atomic update without holding its vectors or chunks in memory.
+    """
+
+    def __init__(self, business_id: str):
+        self.business_id = business_id
+        with _write_lock(business_id):
+            manifest = read_manifest(business_id)
+            # Reserve the name so appends and compactions can carry on meanwhile.
+            self.name = f"seg-{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            _write_manifest(business_id, manifest)
+        self.segments_dir = os.path.join(business_dir(business_id), SEGMENTS_DIRNAME)
+        self.tmp_dir = os.path.join(self.segments_dir, f".tmp-{self.name}")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self._raw_vectors = open(os.path.join(self.tmp_dir, RAW_VECTORS_FILENAME), 'wb')
+        self._chunks = chunk_store.ChunkStore(self.tmp_dir)
+        self.ntotal = 0
+        self.dimension = None
+
+    def add(self, embeddings_np: np.ndarray, texts: list[str]):
+        """Appends one batch of vectors and their chunk texts to the segment files."""
+        embeddings_np = np.ascontiguousarray(embeddings_np, dtype='float32')
+        if len(embeddings_np) != len(texts):
+            raise ValueError(f"Got {len(embeddings_np)} embeddings for {len(texts)} texts.")
+        if self.dimension is None:
+            self.dimension = embeddings_np.shape[1]
+        elif embeddings_np.shape[1] != self.dimension:
+            raise ValueError(f"Embedding dimension {embeddings_np.shape[1]} does not match {self.dimension}.")
+        self._raw_vectors.write(embeddings_np.tobytes())
+        self._chunks.append(list(texts))
+        self.ntotal += len(texts)
+
+    def write(self, index_type: str = None):
+        """
+        Builds the index and renames the segment into place without publishing
+        it. Returns the index, or None (and discards the files) if nothing was added.
+        """
+        self._raw_vectors.close()
+        self._chunks.close()
+        if self.ntotal == 0:
+            self.abort()
+            return None
+
+        raw_path = os.path.join(self.tmp_dir, RAW_VECTORS_FILENAME)
+        vectors_path = os.path.join(self.tmp_dir, VECTORS_FILENAME)
+        raw = np.memmap(raw_path, dtype='float32', mode='r', shape=(self.ntotal, self.dimension))
+        out = np.lib.format.open_memmap(vectors_path, mode='w+', dtype='float32', shape=raw.shape)
+        for start in range(0, self.ntotal, VECTOR_COPY_ROWS):
+            out[start:start + VECTOR_COPY_ROWS] = raw[start:start + VECTOR_COPY_ROWS]
+        out.flush()
+        del out, raw
+        os.remove(raw_path)
+
+        index = index_tiers.build_index(np.load(vectors_path, mmap_mode='r'), index_type)
+        faiss.write_index(index, os.path.join(self.tmp_dir, INDEX_FILENAME))
+        for filename in (INDEX_FILENAME, VECTORS_FILENAME):
+            with open(os.path.join(self.tmp_dir, filename), 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(self.tmp_dir, os.path.join(self.segments_dir, self.name))
+        _fsync_dir(self.segments_dir)
+        return index
+
+    def publish(self) -> bool:
+        """
+        Writes the segment and adds it to the manifest. Returns False (and
+        discards the files) if nothing was added.
+        """
+        if self.write() is None:
+            return False
+        with _write_lock(self.business_id):
+            manifest = read_manifest(self.business_id)
+            manifest["version"] += 1
+            manifest["dimension"] = self.dimension
+            manifest["segments"].append(self.name)
+            _write_manifest(self.business_id, manifest)
+        return True
+
+    def abort(self):
+        """Discards everything written so far."""
+        self._raw_vectors.close()
+        self._chunks.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _write_segment(business_id: str, name: str, index, vectors: np.ndarray, text_batches):
+    """Writes a segment into a temporary directory and renames it into place."""
+    segments_dir = os.path.join(business_dir(business_id), SEGMENTS_DIRNAME)
+    tmp_dir = os.path.join(segments_dir, f".tmp-{name}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILENAME))
+    np.save(os.path.join(tmp_dir, VECTORS_FILENAME), np.ascontiguousarray(vectors, dtype='float32'))
+    for filename in (INDEX_FILENAME, VECTORS_FILENAME):
+        with open(os.path.join(tmp_dir, filename), 'rb') as f:
+            os.fsync(f.fileno())
+    chunks = chunk_store.ChunkStore(tmp_dir)
+    for texts in text_batches:
+        chunks.append(list(texts))
+    chunks.close()
+    os.replace(tmp_dir, os.path.join(segments_dir, name))
+    _fsync_dir(segments_dir)
+
+
+def _segment_size(business_id: str, name: str) -> int:
+    """Number of chunks in a segment, read from the size of its offsets file."""
+    path = os.path.join(business_dir(business_id), SEGMENTS_DIRNAME, name, chunk_store.OFFSETS_FILENAME)
+    try:
+        return os.path.getsize(path) // chunk_store.OFFSET_DTYPE.itemsize
+    except FileNotFoundError:
+        return 0
+
+
+def _compaction_run(business_id: str, names: list[str]) -> list[str]:
+    """
+    Picks the trailing segments to merge: always the last two, extended to
+    older segments while each is at most COMPACTION_SIZE_RATIO times the
+    size of the run so far. The base (first) segment is never included.
+    """
+    candidates = names[1:]
+    if len(candidates) < 2:
+        return []
+    run = candidates[-2:]
+    total = sum(_segment_size(business_id, name) for name in run)
+    for name in reversed(candidates[:-2]):
+        size = _segment_size(business_id, name)
+        if size > COMPACTION_SIZE_RATIO * total:
+            break
+        run.insert(0, name)
+        total += size
+    return run
+
+
+def _find_run(segments: list[str], run: list[str]) -> int:
+    """Returns where `run` sits contiguously in `segments`, or -1."""
+    for start in range(len(segments) - len(run) + 1):
+        if segments[start:start + len(run)] == run:
+            return start
+    return -1
+
+
+def compact(business_id: str, force: bool = False, index_type: str = None) -> bool:
+    """
+    Merges the small trailing segments into one (see _compaction_run), or,
+    with force=True, every segment including the base, rebuilding the index
+    in the tier that fits the merged size (or the given index_type). Vectors
+    and chunks are streamed into the merged segment in blocks. Segments
+    appended while the merge runs are kept after the merged one.
+    Returns True if anything was rebuilt.
+    """
+    with _write_lock(business_id):
+        manifest = read_manifest(business_id)
+        if force:
+            names = list(manifest["segments"])
+        else:
+            names = _compaction_run(business_id, manifest["segments"])
+        if not names:
+            return False
+
+    segments_dir = os.path.join(business_dir(business_id), SEGMENTS_DIRNAME)
+    segments = [Segment(os.path.join(segments_dir, old)) for old in names]
+    # Reserves the merged segment's name, so appends can carry on meanwhile.
+    pending = PendingSegment(business_id)
+    try:
+        for seg in segments:
+            vectors = seg.vectors()
+            for start in range(0, seg.ntotal, VECTOR_COPY_ROWS):
+                stop = min(start + VECTOR_COPY_ROWS, seg.ntotal)
+                pending.add(vectors[start:stop], seg.chunks.get_many(range(start, stop)))
+        merged = pending.write(index_type)
+    except BaseException:
+        pending.abort()
+        raise
+    name = pending.name
+
+    with _write_lock(business_id):
+        manifest = read_manifest(business_id)
+        start = _find_run(manifest["segments"], names)
+        if start < 0:
+            print(f"Skipping compaction for business {business_id}: segments changed underneath it.")
+            shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+            return False
+        manifest["version"] += 1
+        manifest["segments"][start:start + len(names)] = [name] if merged is not None else []
+        _write_manifest(business_id, manifest)
+
+    # Readers holding the old segments keep working: the index is in memory
+    # and an unlinked chunk store stays readable through its open mmap.
+    for old in names:
+        shutil.rmtree(os.path.join(segments_dir, old), ignore_errors=True)
+    if merged is not None:
+        print(f"Compacted {len(names)} segments into {name} ({index_tiers.index_type_of(merged)}) for business {business_id}. Total: {merged.ntotal}")
+    return True
+
+
+def set_search_params(business_id: str, params: dict):
+    """Stores per-business search parameters (nprobe, efSearch) in the manifest."""
+    unknown = set(params) - set(index_tiers.DEFAULT_SEARCH_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown search parameters: {sorted(unknown)}")
+    with _write_lock(business_id):
+        manifest = read_manifest(business_id)
+        manifest["search_params"] = {**manifest.get("search_params", {}), **params}
+        manifest["version"] += 1
+        _write_manifest(business_id, manifest)
+
+
+def compact_in_background(business_id: str):
+    """Starts a compaction thread if the business has accumulated too many segments."""
+    if len(read_manifest(business_id)["segments"]) <= COMPACTION_MAX_SEGMENTS:
+        return
+    with _write_locks_guard:
+        if business_id in _compactions_running:
+            return
+        _compactions_running.add(business_id)
+
+    def run():
+        try:
+            compact(business_id)
+        except Exception as e:
+            print(f"Error compacting segments for business {business_id}: {e}")
+        finally:
+            with _write_locks_guard:
+                _compactions_running.discard(business_id)
+
+    threading.Thread(target=run, name=f"compact-{business_id}", daemon=True).start()
@@ -0,0 +1,300 @@
+# site_crawler.py
+import codecs
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag, urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import document_processor
+import startup
+
+bs4 = startup.lazy_module("bs4")
+
+# --- SITE CRAWLER ---
+# Indexes a whole site (e.g. a help centre) from one start URL. Pages are
+# fetched breadth-first, up to CRAWL_MAX_DEPTH links away and CRAWL_MAX_PAGES
+# in total, by CRAWL_MAX_WORKERS threads sharing one pooled session. The
+# crawl stays on the start URL's host (and path prefix, if given), honours
+# robots.txt, and keeps to CRAWL_PER_HOST_CONCURRENCY requests in flight and
+# CRAWL_HOST_DELAY seconds between requests per host.
+#
+# Re-crawls are incremental: each page's ETag, Last-Modified, text hash and
+# links are kept in data/<business_id>/crawl_state.json. Unchanged pages cost
+# a 304 (or at worst a download whose hash matches) and are never re-embedded;
+# their stored links keep the crawl going.
+CRAWL_MAX_WORKERS = int(os.getenv("CRAWL_MAX_WORKERS", "8"))
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "2"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "200"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", "4"))
+CRAWL_HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "0.1"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "10"))
+CRAWL_USER_AGENT = os.getenv("CRAWL_USER_AGENT", "RagChatbotCrawler/1.0")
+CRAWL_STATE_FILENAME = "crawl_state.json"
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def _decode(body: bytes, encoding: str) -> str:
+    """Decodes a page body, falling back to UTF-8 if it declares an unknown charset."""
+    try:
+        codecs.lookup(encoding or "utf-8")
+    except LookupError:
+        encoding = "utf-8"
+    return body.decode(encoding or "utf-8", errors="replace")
+
+
+def normalize_url(url: str, base: str = None) -> str:
+    """Resolves a link against its page and drops the #fragment."""
+    return urldefrag(urljoin(base, url) if base else url)[0]
+
+
+class _HostGate:
+    """Limits concurrency and enforces a minimum delay between requests to one host."""
+
+    def __init__(self, concurrency: int, delay: float):
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self.delay = delay
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.delay
+        if start_at > now:
+            time.sleep(start_at - now)
+        return self
+
+    def __exit__(self, *exc):
+        self._slots.release()
+
+
+class CrawlResult:
+    """The pages whose text changed since the last crawl, plus counters."""
+
+    def __init__(self, business_id: str, state: dict):
+        self.business_id = business_id
+        self.state = state
+        self.changed_pages = []  # (url, text)
+        self.fetched = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def summary(self) -> dict:
+        visited = self.fetched + self.not_modified
+        return {
+            "pages_visited": visited,
+            "pages_changed": len(self.changed_pages),
+            "fetched": self.fetched,
+            "not_modified": self.not_modified,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "pages_per_second": round(visited / self.seconds, 1) if self.seconds else 0.0,
+        }
+
+    def commit(self):
+        """Saves the crawl state; call once the changed pages are in the knowledge base."""
+        if self.business_id is not None:
+            save_state(self.business_id, self.state)
+
+
+class SiteCrawler:
+    def __init__(self, max_workers: int = CRAWL_MAX_WORKERS, max_depth: int = CRAWL_MAX_DEPTH,
+                 max_pages: int = CRAWL_MAX_PAGES, per_host_concurrency: int = CRAWL_PER_HOST_CONCURRENCY,
+                 host_delay: float = CRAWL_HOST_DELAY, timeout: float = CRAWL_TIMEOUT,
+                 user_agent: str = CRAWL_USER_AGENT, respect_robots: bool = True):
+        self.max_workers = max(1, max_workers)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.per_host_concurrency = per_host_concurrency
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.respect_robots = respect_robots
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+        self._gates = {}
+        self._robots = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def _gate(self, host: str) -> _HostGate:
+        with self._lock:
+            gate = self._gates.get(host)
+            if gate is None:
+                gate = self._gates[host] = _HostGate(self.per_host_concurrency, self.host_delay)
+            return gate
+
+    def _allowed(self, url: str) -> bool:
+        if not self.respect_robots:
+            return True
+        parts = urlparse(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            parser = self._robots.get(origin)
+        if parser is None:
+            parser = RobotFileParser()
+            try:
+                response = self.session.get(origin + "/robots.txt", timeout=self.timeout)
+                parser.parse(response.text.splitlines() if response.status_code == 200 else [])
+            except requests.exceptions.RequestException:
+                parser.parse([])
+            delay = parser.crawl_delay(self.user_agent)
+            if delay:
+                gate = self._gate(parts.netloc)
+                gate.delay = max(gate.delay, float(delay))
+            with self._lock:
+                self._robots[origin] = parser
+        return parser.can_fetch(self.user_agent, url)
+
+    def _fetch(self, url: str, previous: dict):
+        """Fetches one page. Returns (status, entry, text, bytes)."""
+        headers = {}
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        with self._gate(urlparse(url).netloc):
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    return "not_modified", previous, None, 0
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type not in HTML_CONTENT_TYPES:
+                    return "skipped", None, None, 0
+                body = response.content
+                encoding = response.encoding or response.apparent_encoding
+                final_url = normalize_url(response.url)
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+        soup = bs4.BeautifulSoup(_decode(body, encoding), 'html.parser')
+        links = []
+        for anchor in soup.find_all("a", href=True):
+            link = normalize_url(anchor["href"], final_url)
+            if link.startswith(("http://", "https://")):
+                links.append(link)
+        text = document_processor.soup_to_text(soup)
+        entry = {
+            "final_url": final_url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            "links": sorted(set(links)),
+        }
+        return "fetched", entry, text, len(body)
+
+    def crawl(self, start_url: str, state: dict = None, path_prefix: str = None, business_id: str = None) -> CrawlResult:
+        """
+        Crawls from start_url and returns the pages whose text is new or changed
+        compared to `state` (a previous crawl's state, e.g. from load_state()).
+        """
+        started = time.perf_counter()
+        state = state or {"pages": {}}
+        previous_pages = state.get("pages", {})
+        # Pages not reached this time (e.g. another site of the same business) keep their entries.
+        result = CrawlResult(business_id, {"pages": dict(previous_pages)})
+        start_url = normalize_url(start_url)
+        # Narrowed to the start page's final host once it has been fetched,
+        # so a redirect (e.g. apex -> www) doesn't put every link out of scope.
+        scope_netloc = urlparse(start_url).netloc
+
+        def in_scope(url: str) -> bool:
+            parts = urlparse(url)
+            return parts.netloc == scope_netloc and (not path_prefix or parts.path.startswith(path_prefix))
+
+        seen = {start_url}
+        frontier = [start_url]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crawler") as pool:
+            for depth in range(self.max_depth + 1):
+                if not frontier:
+                    break
+                batch = [url for url in frontier if self._allowed(url)]
+                result.skipped += len(frontier) - len(batch)
+                futures = [(url, pool.submit(self._fetch, url, previous_pages.get(url, {}))) for url in batch]
+                next_frontier = []
+                for url, future in futures:
+                    try:
+                        status, entry, text, size = future.result()
+                    except Exception as e:
+                        # One bad page (network or parsing) must not end the crawl.
+                        print(f"Error crawling {url}: {e}")
+                        result.failed += 1
+                        continue
+                    if status == "skipped":
+                        result.skipped += 1
+                        continue
+                    if url == start_url:
+                        final_url = entry.get("final_url", url)
+                        scope_netloc = urlparse(final_url).netloc
+                        seen.add(final_url)
+                    result.state["pages"][url] = entry
+                    if status == "not_modified":
+                        result.not_modified += 1
+                    else:
+                        result.fetched += 1
+                        result.bytes += size
+                        if entry["content_hash"] == previous_pages.get(url, {}).get("content_hash"):
+                            result.unchanged += 1
+                        elif text.strip():
+                            result.changed_pages.append((url, text))
+                    for link in entry.get("links", []):
+                        if link not in seen and in_scope(link) and len(seen) < self.max_pages:
+                            seen.add(link)
+                            next_frontier.append(link)
+                frontier = next_frontier if depth < self.max_depth else []
+        result.seconds = time.perf_counter() - started
+        return result
+
+
+def state_path(business_id: str) -> str:
+    return os.path.join("data", business_id, CRAWL_STATE_FILENAME)
+
+
+def load_state(business_id: str) -> dict:
+    try:
+        with open(state_path(business_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"pages": {}}
+
+
+def save_state(business_id: str, state: dict):
+    path = state_path(business_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def crawl_site(business_id: str, start_url: str, **options) -> CrawlResult:
+    """
+    Crawls a site incrementally against the business's previous crawl state.
+    Options are SiteCrawler's keyword arguments plus `path_prefix`.
+    """
+    path_prefix = options.pop("path_prefix", None)
+    crawler = SiteCrawler(**options)
+    try:
+        return crawler.crawl(start_url, load_state(business_id), path_prefix=path_prefix, business_id=business_id)
+    finally:
+        crawler.close()
+# --- END OF SITE CRAWLER ---
@@ -0,0 +1,139 @@
+# startup.py
+import gc
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- STARTUP: LAZY IMPORTS, PRELOADING AND WARM-UP ---
+# torch/sentence_transformers and faiss take seconds to import and the model
+# more to load. Modules refer to them through lazy_module(), so importing
+# main.py stays cheap and /config never pays for them. STARTUP_MODE decides
+# when the cost is paid instead:
+#   lazy    - on the first request that needs them (the old behaviour)
+#   warm    - in each worker's startup, before it accepts traffic
+#   preload - once in the gunicorn master (see gunicorn.conf.py), before the
+#             workers are forked, so they share the model weights and hot
+#             indexes copy-on-write; each worker then only runs warm_up()
+# WARM_BUSINESS_IDS lists the tenants whose indexes are loaded up front.
+# Timings of every step are kept in STARTUP_TIMINGS and shown on /stats.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+STARTUP_MODES = ("lazy", "warm", "preload")
+WARM_BUSINESS_IDS = [bid.strip() for bid in os.getenv("WARM_BUSINESS_IDS", "").split(",") if bid.strip()]
+
+PROCESS_STARTED = time.perf_counter()
+STARTUP_TIMINGS = {}
+_timings_lock = threading.Lock()
+
+
+def record_timing(name: str, seconds: float):
+    with _timings_lock:
+        STARTUP_TIMINGS[name] = round(seconds, 4)
+    print(f"[startup] {name}: {seconds:.3f}s")
+
+
+@contextmanager
+def timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
+
+
+class _LazyModule:
+    """Imports the named module on first attribute access, thread-safely."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with timed(f"import {self._name}"):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+_lazy_modules = {}
+
+
+def lazy_module(name: str) -> _LazyModule:
+    """Returns a stand-in for a heavy module that is imported when first used."""
+    return _lazy_modules.setdefault(name, _LazyModule(name))
+
+
+def import_heavy_modules():
+    """Imports every module registered with lazy_module()."""
+    for module in list(_lazy_modules.values()):
+        module.load()
+
+
+def preload(business_ids: list[str] = WARM_BUSINESS_IDS):
+    """
+    Imports the heavy modules, loads the embedding model and the given
+    tenants' indexes. Safe to run before forking: it loads data but starts no
+    threads and runs no inference, which would not survive a fork cleanly.
+    """
+    import vector_store_manager
+
+    import_heavy_modules()
+    load_embedding_model()
+    for business_id in business_ids:
+        with timed(f"load index {business_id}"):
+            vector_store_manager.INDEX_CACHE.get(business_id)
+
+
+def load_embedding_model():
+    import document_processor
+
+    if document_processor.EMBEDDING_MODEL is None:
+        with timed("load embedding model"):
+            document_processor.get_embedding_model()
+
+
+def freeze_for_fork():
+    """
+    Moves everything allocated so far out of the garbage collector's reach, so
+    collections in the forked workers don't write to (and un-share) the
+    pages holding the preloaded objects.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def warm_up(business_ids: list[str] = WARM_BUSINESS_IDS):
+    """
+    Makes the first real request as fast as later ones: loads whatever was
+    not preloaded, then runs one embedding and one search per hot tenant
+    (which also loads the indexes that were not preloaded).
+    """
+    import document_processor
+    import vector_store_manager
+
+    started = time.perf_counter()
+    import_heavy_modules()
+    load_embedding_model()
+    with timed("warm-up embedding"):
+        query_embedding = document_processor.encode_texts(["warm-up"])[0]
+    for business_id in business_ids:
+        with timed(f"warm-up search {business_id}"):
+            vector_store_manager.search_faiss_index(business_id, query_embedding)
+    record_timing("warm-up total", time.perf_counter() - started)
+
+
+def mark_ready():
+    record_timing("process start to ready", time.perf_counter() - PROCESS_STARTED)
+
+
+def get_startup_timings() -> dict:
+    with _timings_lock:
+        return {"mode": STARTUP_MODE, "pid": os.getpid(), **STARTUP_TIMINGS}
+# --- END OF STARTUP ---
@@ -13,18 +13,65 @@
         return;
     }
 
+    // The last config we saw is kept in localStorage, so returning visitors get
+    // the widget without waiting for the API. It is revalidated in the
+    // background on every page load; the browser's HTTP cache handles the
+    // ETag and max-age, and a changed config is applied in place.
+    const CONFIG_CACHE_KEY = `chatbot-config:${businessId}`;
+    let welcomeMessage = null;
+
     document.addEventListener("DOMContentLoaded", function() {
+        const cached = readCachedConfig();
+        if (cached) buildChatbotUI(cached.config);
+
         fetch(`${API_BASE_URL}/config/${businessId}`)
             .then(response => {
+                if (response.status === 404) forgetCachedConfig();
                 if (!response.ok) throw new Error(`Config fetch failed: ${response.status}`);
-                return response.json();
-            })
-            .then(config => {
-                buildChatbotUI(config);
+                const etag = response.headers.get('ETag');
+                if (cached && etag && etag === cached.etag) return;
+                return response.json().then(config => {
+                    writeCachedConfig({ config: config, etag: etag });
+                    if (cached) updateChatbotUI(config);
+                    else buildChatbotUI(config);
+                });
             })
             .catch(error => console.error("Failed to load chatbot configuration:", error));
     });
 
+    function readCachedConfig() {
+        try {
+            return JSON.parse(localStorage.getItem(CONFIG_CACHE_KEY));
+        } catch (error) {
+            return null;  // Storage disabled (private mode, sandboxed iframe) or corrupt.
+        }
+    }
+
+    function writeCachedConfig(entry) {
+        try {
+            localStorage.setItem(CONFIG_CACHE_KEY, JSON.stringify(entry));
+        } catch (error) {
+            // Storage full or disabled; the widget still works, just without the head start.
+        }
+    }
+
+    function forgetCachedConfig() {
+        try {
+            localStorage.removeItem(CONFIG_CACHE_KEY);
+        } catch (error) {}
+    }
+
+    function updateChatbotUI(config) {
+        document.documentElement.style.setProperty('--brand-color', config.brand_color || '#007bff');
+        const agentName = document.querySelector('#chat-header span');
+        if (agentName) agentName.textContent = config.agent_name || 'AI Assistant';
+        // Only rewrite the greeting if the visitor hasn't started chatting.
+        const messages = document.getElementById('chat-messages');
+        if (welcomeMessage && messages && messages.childElementCount === 1) {
+            welcomeMessage.textContent = config.welcome_message || 'Hello!';
+        }
+    }
+
     function buildChatbotUI(config) {
         const style = document.createElement('style');
         style.innerHTML = `
@@ -47,7 +94,7 @@
         const sendBtn = document.getElementById('send-btn');
         const chatInput = document.getElementById('chat-input');
         
-        addMessage(config.welcome_message || 'Hello!', 'bot');
+        welcomeMessage = addMessage(config.welcome_message || 'Hello!', 'bot');
         
         chatBubble.addEventListener('click', () => toggleChatWindow());
         closeBtn.addEventListener('click', () => toggleChatWindow());
@@ -69,7 +116,7 @@
         const typingIndicator = addMessage('Typing...', 'bot typing-indicator');
         
         try {
-            const response = await fetch(`${API_BASE_URL}/chat`, {
+            const response = await fetch(`${API_BASE_URL}/chat/stream`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -78,9 +125,38 @@
                 }),
             });
             if (!response.ok) throw new Error(`Chat fetch failed: ${response.status}`);
-            const data = await response.json();
-            typingIndicator.remove();
-            addMessage(data.answer, 'bot');
+            if (!response.body) {
+                // Browsers without streamed fetch bodies get the whole answer at once.
+                const events = parseEvents(await response.text());
+                typingIndicator.remove();
+                addMessage(events.filter(e => e.name === 'token').map(e => e.data.text).join(''), 'bot');
+                return;
+            }
+
+            // Render tokens as they arrive instead of waiting for the full answer.
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let botMessage = null;
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const boundary = buffer.lastIndexOf('\n\n');
+                if (boundary === -1) continue;
+                const events = parseEvents(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                for (const event of events) {
+                    if (event.name === 'error') throw new Error(event.data.detail);
+                    if (event.name !== 'token') continue;
+                    if (!botMessage) {
+                        typingIndicator.remove();
+                        botMessage = addMessage('', 'bot');
+                    }
+                    appendToMessage(botMessage, event.data.text);
+                }
+            }
+            if (!botMessage) throw new Error('Chat stream ended without an answer');
         } catch (error) {
             console.error("Error fetching chat response:", error);
             typingIndicator.remove();
@@ -88,6 +164,24 @@
         }
     }
 
+    function parseEvents(text) {
+        // Parses complete Server-Sent Events ("event: ...\ndata: {...}") separated by blank lines.
+        return text.split('\n\n').filter(block => block.trim()).map(block => {
+            const event = { name: 'message', data: {} };
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event.name = line.slice(7);
+                else if (line.startsWith('data: ')) event.data = JSON.parse(line.slice(6));
+            }
+            return event;
+        });
+    }
+
+    function appendToMessage(msgDiv, text) {
+        const container = document.getElementById('chat-messages');
+        msgDiv.textContent += text;
+        container.scrollTop = container.scrollHeight;
+    }
+
     function addMessage(text, type) {
         const container = document.getElementById('chat-messages');
         const msgDiv = document.createElement('div');
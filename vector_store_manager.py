@@ -1,76 +1,227 @@
 # vector_store_manager.py
-import faiss
 import numpy as np
 import os
+import threading
+from collections import OrderedDict
 
-def create_or_load_faiss_index(business_id: str, embedding_dimension: int = 384) -> faiss.IndexFlatL2:
+import answer_cache
+import segment_store
+
+# --- IN-PROCESS INDEX CACHE ---
+# Loaded indexes are kept resident per business so that /chat does not pay
+# for faiss.read_index on every question. Chunk texts and (by default) flat
+# segments are memory-mapped rather than loaded, so the cache is bounded by
+# entry count and by an approximate budget of the memory private to this
+# process (the on-disk size of the non-mapped segment indexes), evicting
+# least recently used tenants first. Mapped bytes are shared between worker
+# processes through the page cache and are reported separately.
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INDEX_CACHE_MAX_ENTRIES", "64"))
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class IndexCache:
+    """
+    A thread-safe LRU registry of loaded knowledge bases keyed by business_id.
+    An entry is reused only while the manifest it was loaded from is unchanged
+    and no newer version was written by this process. A stale entry is
+    refreshed in place, which loads only the segments it hasn't seen yet.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # business_id -> (store, manifest_key, nbytes, version)
+        self._versions = {}  # business_id -> write counter bumped by add_embeddings_to_faiss
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, business_id: str):
+        """Returns the SegmentedStore for a business, loading from disk on a miss."""
+        file_key = segment_store.manifest_key(business_id)
+        if file_key is None:
+            self.invalidate(business_id)
+            return None
+
+        with self._lock:
+            version = self._versions.get(business_id, 0)
+            entry = self._entries.get(business_id)
+            if entry is not None and entry[1] == file_key and entry[3] == version:
+                self._entries.move_to_end(business_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Load outside the lock so a slow tenant doesn't block every other one.
+        if entry is not None:
+            store = entry[0]
+            store.refresh()
+        else:
+            store = segment_store.SegmentedStore(business_id)
+        nbytes = store.nbytes
+
+        with self._lock:
+            # Don't cache a load that raced with a newer write.
+            if self._versions.get(business_id, 0) == version:
+                self._discard(business_id)
+                self._entries[business_id] = (store, file_key, nbytes, version)
+                self._total_bytes += nbytes
+                self._evict()
+        return store
+
+    def invalidate(self, business_id: str, new_version: bool = False):
+        """Marks a business as changed after a write, or drops it when its files are gone."""
+        with self._lock:
+            if new_version:
+                # Keep the entry so the next lookup can refresh it incrementally.
+                self._versions[business_id] = self._versions.get(business_id, 0) + 1
+                self.invalidations += 1
+            elif self._discard(business_id):
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            mapped_bytes = sum(entry[0].mapped_nbytes for entry in self._entries.values())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "mapped_bytes": mapped_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _discard(self, business_id: str) -> bool:
+        entry = self._entries.pop(business_id, None)
+        if entry is None:
+            return False
+        self._total_bytes -= entry[2]
+        return True
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry[2]
+            self.evictions += 1
+
+
+INDEX_CACHE = IndexCache(INDEX_CACHE_MAX_ENTRIES, INDEX_CACHE_MAX_BYTES)
+
+
+def get_index_cache_stats() -> dict:
+    """Returns hit/miss/eviction counters for the resident index cache."""
+    return INDEX_CACHE.stats()
+# --- END OF INDEX CACHE ---
+
+def create_or_load_faiss_index(business_id: str, embedding_dimension: int = 384) -> segment_store.SegmentedStore:
     """
-    Creates a new FAISS index for a business if one doesn't exist,
-    otherwise loads the existing one.
+    Opens the segmented knowledge base of a business, creating an empty one
+    if it doesn't exist yet. Legacy single-file indexes are migrated on open.
     """
-    index_dir = os.path.join("data", business_id)
-    os.makedirs(index_dir, exist_ok=True)
-    index_path = os.path.join(index_dir, "faiss_index.bin")
-    metadata_path = os.path.join(index_dir, "metadata.txt") # To store original text chunks
-
-    if os.path.exists(index_path):
-        print(f"Loading existing FAISS index for business {business_id}...")
-        index = faiss.read_index(index_path)
-        # Load metadata (original text chunks)
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            texts = [line.strip() for line in f]
-        print(f"Loaded {len(texts)} text chunks.")
-        return index, texts
+    os.makedirs(segment_store.business_dir(business_id), exist_ok=True)
+    store = segment_store.SegmentedStore(business_id)
+    if store.segments:
+        print(f"Loaded FAISS index for business {business_id}: {len(store.segments)} segments, {store.ntotal} vectors.")
     else:
         print(f"Creating new FAISS index for business {business_id}...")
-        index = faiss.IndexFlatL2(embedding_dimension)
-        # Initialize an empty list for texts (metadata)
-        texts = []
-        return index, texts
+    if store.dimension is not None and store.dimension != embedding_dimension:
+        raise ValueError(f"Index dimension {store.dimension} does not match embedding dimension {embedding_dimension}.")
+    return store
 
 def add_embeddings_to_faiss(business_id: str, embeddings: list, texts: list,
-                             current_index: faiss.IndexFlatL2, current_texts: list):
-    """Adds new embeddings and their corresponding texts to the FAISS index."""
-    if not embeddings:
-        return current_index, current_texts
+                             current_store: segment_store.SegmentedStore = None) -> segment_store.SegmentedStore:
+    """
+    Adds new embeddings and their corresponding texts as a new segment.
+    Only the new batch is written; existing segments are never rewritten.
+    """
+    if current_store is None:
+        current_store = segment_store.SegmentedStore(business_id)
+    if len(embeddings) == 0:
+        return current_store
 
     embeddings_np = np.array(embeddings).astype('float32')
-    current_index.add(embeddings_np)
-    current_texts.extend(texts)
+    current_store.append(embeddings_np, list(texts))
 
-    index_dir = os.path.join("data", business_id)
-    os.makedirs(index_dir, exist_ok=True)
-    index_path = os.path.join(index_dir, "faiss_index.bin")
-    metadata_path = os.path.join(index_dir, "metadata.txt")
+    # Make sure no reader keeps serving the previous version from memory.
+    INDEX_CACHE.invalidate(business_id, new_version=True)
+    answer_cache.invalidate(business_id)
+    segment_store.compact_in_background(business_id)
 
-    faiss.write_index(current_index, index_path)
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        for text in current_texts:
-            f.write(text + '\n')
+    print(f"Added {len(embeddings)} embeddings to FAISS index for business {business_id}. Total: {current_store.ntotal}")
+    return current_store
 
-    print(f"Added {len(embeddings)} embeddings to FAISS index for business {business_id}. Total: {current_index.ntotal}")
-    return current_index, current_texts
 
+def begin_segment(business_id: str) -> segment_store.PendingSegment:
+    """Starts a segment that an upload fills batch by batch (see publish_segment)."""
+    return segment_store.PendingSegment(business_id)
 
-def search_faiss_index(business_id: str, query_embedding: list, k: int = 5) -> list[str]:
+def publish_segment(business_id: str, pending: segment_store.PendingSegment,
+                    current_store: segment_store.SegmentedStore = None) -> segment_store.SegmentedStore:
+    """Makes a pending segment visible to searches in one manifest update."""
+    if current_store is None:
+        current_store = segment_store.SegmentedStore(business_id)
+    if not pending.publish():
+        return current_store
+    current_store.refresh()
+
+    INDEX_CACHE.invalidate(business_id, new_version=True)
+    answer_cache.invalidate(business_id)
+    segment_store.compact_in_background(business_id)
+
+    print(f"Added {pending.ntotal} embeddings to FAISS index for business {business_id}. Total: {current_store.ntotal}")
+    return current_store
+
+
+def rebuild_index(business_id: str, index_type: str = None) -> bool:
     """
-    Searches the FAISS index for the most similar text chunks.
-    Returns the original text chunks.
+    Merges and retrains a business's index in the tier that fits its size
+    (flat, hnsw or ivfpq), or in the given index_type.
     """
-    index_dir = os.path.join("data", business_id)
-    index_path = os.path.join(index_dir, "faiss_index.bin")
-    metadata_path = os.path.join(index_dir, "metadata.txt")
+    rebuilt = segment_store.compact(business_id, force=True, index_type=index_type)
+    if rebuilt:
+        INDEX_CACHE.invalidate(business_id, new_version=True)
+        answer_cache.invalidate(business_id)
+    return rebuilt
 
-    if not os.path.exists(index_path) or not os.path.exists(metadata_path):
-        print(f"No FAISS index or metadata found for business {business_id}.")
-        return []
+def set_search_params(business_id: str, nprobe: int = None, efSearch: int = None):
+    """Tunes the recall/latency trade-off of a business's approximate index."""
+    params = {name: value for name, value in (("nprobe", nprobe), ("efSearch", efSearch)) if value is not None}
+    segment_store.set_search_params(business_id, params)
+    INDEX_CACHE.invalidate(business_id, new_version=True)
+    answer_cache.invalidate(business_id)
+
+def get_knowledge_base_version(business_id: str) -> int:
+    """Returns the manifest version of a business's knowledge base (0 if it has none)."""
+    store = INDEX_CACHE.get(business_id)
+    return store.version if store is not None else 0
 
-    index = faiss.read_index(index_path)
-    with open(metadata_path, 'r', encoding='utf-8') as f:
-        texts = [line.strip() for line in f]
+
+def search_chunks(business_id: str, query_embedding: list, k: int = 5) -> list[tuple]:
+    """
+    Searches every segment of the business's index for the most similar text
+    chunks and returns the merged top-k as (distance, segment name, local_id, text).
+    Consecutive local ids of a segment are consecutive chunks.
+    """
+    store = INDEX_CACHE.get(business_id)
+    if store is None:
+        print(f"No FAISS index found for business {business_id}.")
+        return []
 
     query_embedding_np = np.array([query_embedding]).astype('float32')
-    D, I = index.search(query_embedding_np, k) # D are distances, I are indices
+    hits = store.search(query_embedding_np, k)
+    return [(distance, seg.name, local_id, seg.chunks.get(local_id))
+            for distance, seg, local_id in hits if local_id < len(seg.chunks)]
 
-    retrieved_texts = [texts[idx] for idx in I[0] if idx < len(texts)]
-    return retrieved_texts
\ No newline at end of file
+
+def search_faiss_index(business_id: str, query_embedding: list, k: int = 5) -> list[str]:
+    """Returns the original texts of the top-k chunks; see search_chunks()."""
+    return [text for _, _, _, text in search_chunks(business_id, query_embedding, k)]